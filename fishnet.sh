@@ -56,6 +56,71 @@ Usage: fishnet.sh [options]
     --num-permutations <integer>
         Configures the number of permutations
         Default: 200
+    --virtual-permutations
+        Identifies each random permutation by its seed only and regenerates the permuted
+        scores in memory instead of writing and reading one RPscores file per permutation
+        Default: false
+    --root-seed <integer>
+        Root seed of the seed-addressable permutation stream used by --virtual-permutations
+        Default: 42
+    --adaptive-permutations
+        Runs permutations in rounds and stops them for a network once no rank of any trait
+        can reach --percentile-threshold within --num-permutations (implies --virtual-permutations)
+        Default: false
+    --permutation-round-size <integer>
+        Number of permutations per round of --adaptive-permutations
+        Default: 50
+    --ora-engine <webgestalt|python>
+        Engine of the GO over-representation analysis of significant modules.
+        python runs a vectorized ORA of every module against a local GO snapshot (requires --go-annotation)
+        Known differences of python to webgestalt (compare both with test/validate_ora.py):
+          - gene symbols are matched to the snapshot as given, without WebGestaltR's mapping to Entrez IDs,
+            so unmapped or merged symbols can change the reference and interesting gene sets
+          - overlapId holds gene symbols like userId, not Entrez IDs
+          - terms are reduced with a reimplementation of the affinity propagation of apcluster,
+            exemplars can differ when it does not converge or on ties
+          - terms come from the --go-annotation snapshot, not from the database release of WebGestaltR
+        Default: webgestalt
+    --go-annotation <path/to/go_biological_process.gmt>
+        GO Biological Process gene sets (gene symbols) in GMT format used by --ora-engine python
+    --ora-cache-size <integer>
+        Size limit in MB of the ORA result cache (results/ora_cache/) shared by every permutation
+        with --ora-engine python. 0 disables the cache
+        Default: 1024
+    --artifact-store
+        Writes every distinct phase 1 Module, GO and GS file once to a content-addressed store
+        (results/artifact_store/) and links task outputs to it. The store must be on the same
+        filesystem as the Nextflow work directory
+        Default: false
+    --compile-networks
+        Compiles every network module file into a memory-mappable form (<modules>/.compiled/)
+        that every stage reads instead of parsing the module files. Networks are recompiled
+        only when their module file changes
+        Default: false
+    --rank-matrix
+        Builds the ranked genes of every permutation once as a memory-mapped matrix
+        (results/<study-random>/rank_matrix_<study-random>.npy) read by every permutation statistics job
+        Default: false
+    --pairs-per-task <integer>
+        Number of (threshold, network) pairs of the permutation statistics run by one SLURM array element
+        Default: 50
+    --resume
+        Runs the default thresholding pipeline through the resumable task driver (scripts/fishnet_dag.py)
+        on the current node. Tasks whose inputs, parameters and upstream outputs did not change since their
+        last successful run are skipped, and a failed run resumes at the failed tasks
+        Default: false
+    --resume-jobs <integer>
+        Maximum number of tasks run at once by --resume
+        Default: 1
+    --batch-traits
+        Runs the original run of every trait of the study in one Nextflow run instead of one per trait.
+        Every network is parsed once and each Pascal task scores all traits against one network
+        Default: false
+    --telemetry
+        Every python task appends its stage, parameters, wall/CPU time, peak RSS, I/O and row counts
+        to the ledger results/telemetry/. Summarize it with
+        python3 scripts/phase1/nextflow/bin/telemetry.py results/telemetry/
+        Default: false
 EOF
 }
 
@@ -83,6 +148,26 @@ BONFERRONI_ALPHA=0.05 # for phase 1 nextflow scripts
 FDR_THRESHOLD=0.05
 PERCENTILE_THRESHOLD=99
 NUM_PERMUTATIONS=200
+VIRTUAL_PERMUTATIONS=false
+ROOT_SEED=42
+ADAPTIVE_PERMUTATIONS=false
+PERMUTATION_ROUND_SIZE=50
+PERMUTATION_START=1
+ORA_ENGINE="webgestalt"
+GO_ANNOTATION="NONE"
+ORA_CACHE_SIZE=1024
+ARTIFACT_STORE=false
+COMPILE_NETWORKS=false
+RANK_MATRIX=false
+PAIRS_PER_TASK=50
+RESUME=false
+RESUME_JOBS=1
+TELEMETRY=false
+BATCH_TRAITS=false
+# extra arguments set by adaptive permutation rounds
+COMPILE_RESULTS_ARGS=""
+RP_STATISTICS_ARGS=""
+SUMMARY_STATISTICS_ARGS=""
 STUDY_PATH="NONE"
 STUDY_RANDOM_PATH="NONE"
 STUDY="NONE"
@@ -106,6 +191,80 @@ while [[ $# -gt 0 ]]; do
             TEST_MODE=true
             shift
             ;;
+        --ora-engine)
+            # make sure we have a supported engine
+            if [[ "${2:-}" = "webgestalt" || "${2:-}" = "python" ]]; then
+                ORA_ENGINE="$2"
+                shift 2
+            else
+                echo "ERROR: --ora-engine requires webgestalt or python."
+                exit 1
+            fi
+            ;;
+        --go-annotation)
+            # make sure we have a value and not another flag
+            if [[ -n "$2" && ! "$2" =~ ^- && -f "$2" ]]; then
+                GO_ANNOTATION="$2"
+                shift 2
+            else
+                echo "ERROR: --go-annotation requires a valid file path."
+                exit 1
+            fi
+            ;;
+        --ora-cache-size)
+            # make sure we have a value and not another flag
+            if [[ -n "$2" && ! "$2" =~ ^- ]]; then
+                ORA_CACHE_SIZE="$2"
+                shift 2
+            else
+                echo "ERROR: --ora-cache-size requires an integer argument."
+                exit 1
+            fi
+            ;;
+        --artifact-store)
+            ARTIFACT_STORE=true
+            shift
+            ;;
+        --compile-networks)
+            COMPILE_NETWORKS=true
+            shift
+            ;;
+        --rank-matrix)
+            RANK_MATRIX=true
+            shift
+            ;;
+        --pairs-per-task)
+            # make sure we have a value and not another flag
+            if [[ -n "$2" && ! "$2" =~ ^- ]]; then
+                PAIRS_PER_TASK="$2"
+                shift 2
+            else
+                echo "ERROR: --pairs-per-task requires an integer argument."
+                exit 1
+            fi
+            ;;
+        --resume)
+            RESUME=true
+            shift
+            ;;
+        --resume-jobs)
+            # make sure we have a value and not another flag
+            if [[ -n "$2" && ! "$2" =~ ^- ]]; then
+                RESUME_JOBS="$2"
+                shift 2
+            else
+                echo "ERROR: --resume-jobs requires an integer argument."
+                exit 1
+            fi
+            ;;
+        --telemetry)
+            TELEMETRY=true
+            shift
+            ;;
+        --batch-traits)
+            BATCH_TRAITS=true
+            shift
+            ;;
         --skip-stage-1)
             SKIP_STAGE_1=true
             shift
@@ -208,6 +367,35 @@ while [[ $# -gt 0 ]]; do
                 exit 1
             fi
             ;;
+        --virtual-permutations)
+            VIRTUAL_PERMUTATIONS=true
+            shift
+            ;;
+        --root-seed)
+            # make sure we have a value and not another flag
+            if [[ -n "$2" && ! "$2" =~ ^- ]]; then
+                ROOT_SEED="$2"
+                shift 2
+            else
+                echo "ERROR: --root-seed requires an integer argument."
+                exit 1
+            fi
+            ;;
+        --adaptive-permutations)
+            ADAPTIVE_PERMUTATIONS=true
+            VIRTUAL_PERMUTATIONS=true
+            shift
+            ;;
+        --permutation-round-size)
+            # make sure we have a value and not another flag
+            if [[ -n "$2" && ! "$2" =~ ^- ]]; then
+                PERMUTATION_ROUND_SIZE="$2"
+                shift 2
+            else
+                echo "ERROR: --permutation-round-size requires an integer argument."
+                exit 1
+            fi
+            ;;
         *)
             echo "ERROR: Unknown option $1"
             usage
@@ -281,6 +469,38 @@ STUDY_RANDOM_PATH=$( readlink -f "$STUDY_RANDOM_PATH" )
 STUDY_RANDOM=$( basename $STUDY_RANDOM_PATH )
 MODULE_FILE_PATH=$( readlink -f "$MODULE_FILE_PATH" )
 
+# nextflow arguments of the ORA engine
+ORA_ARGS=""
+if [ "$ORA_ENGINE" = "python" ]; then
+    if [ ! -f "$GO_ANNOTATION" ]; then
+        echo "--ora-engine python requires --go-annotation"
+        exit 1
+    fi
+    GO_ANNOTATION=$( readlink -f "$GO_ANNOTATION" )
+    ORA_ARGS="--oraEngine python --goAnnotation $GO_ANNOTATION"
+    if [ "$ORA_CACHE_SIZE" -gt 0 ]; then
+        # module and background gene sets repeat across permutations, so ORA results are cached by content
+        mkdir -p "${RESULTS_PATH}/ora_cache"
+        ORA_ARGS="$ORA_ARGS --oraCacheDir ${RESULTS_PATH}/ora_cache --oraCacheMaxSize $ORA_CACHE_SIZE"
+    fi
+fi
+
+# nextflow arguments of the artifact store
+ARTIFACT_STORE_ARGS=""
+if [ "$ARTIFACT_STORE" = true ]; then
+    mkdir -p "${RESULTS_PATH}/artifact_store"
+    ARTIFACT_STORE_ARGS="--artifactStore ${RESULTS_PATH}/artifact_store"
+fi
+
+# telemetry ledger of every python task (scripts/phase1/nextflow/bin/telemetry.py)
+TELEMETRY_ARGS=""
+FISHNET_TELEMETRY=""
+if [ "$TELEMETRY" = true ]; then
+    FISHNET_TELEMETRY="${RESULTS_PATH}/telemetry"
+    mkdir -p "$FISHNET_TELEMETRY"
+    TELEMETRY_ARGS="--telemetry $FISHNET_TELEMETRY"
+fi
+
 # check and list traits in input study path
 TRAITDIRS=($(find "$STUDY_PATH" -mindepth 1 -maxdepth 1 -type d))
 NUM_TRAITS=${#TRAITDIRS[@]}
@@ -308,6 +528,13 @@ export STUDY_RANDOM
 export NUM_TRAITS
 export RANDOM_PERMUTATION
 export NUM_PERMUTATIONS
+export VIRTUAL_PERMUTATIONS
+export ROOT_SEED
+export PERMUTATION_START
+export ORA_ARGS
+export ARTIFACT_STORE_ARGS
+export TELEMETRY_ARGS
+export FISHNET_TELEMETRY
 export NUM_MODULE_FILES
 export PVALFILEDIR
 export PVALFILEPATH
@@ -427,20 +654,29 @@ phase1_step1() {
     tmpfile=$(mktemp --tmpdir="$(pwd)/tmp")
     find "$STUDY_PATH" -mindepth 1 -maxdepth 1 -type d > $tmpfile
 
+    # one array element per trait, or a single job running every trait of the study
+    if [ "$BATCH_TRAITS" = true ]; then
+        STEP1_JOB_ARGS="./scripts/phase1/phase1_step1_study.sh $(pwd)"
+    else
+        STEP1_JOB_ARGS="--array=1-${NUM_TRAITS} ./scripts/phase1/phase1_step1_multi.sh $(pwd) $tmpfile"
+    fi
+
     # run nextflow
     if [ "$SINGULARITY" = true ]; then
         if [ "$PULL_PYTHON_CONTAINER" = true ]; then
             if [ "$PULL_R_CONTAINER" = true ]; then
-                JOB_STAGE1_STEP1=$(sbatch --dependency=afterok:"$JOB_PULL_SINGULARITY_PYTHON_ID":"$JOB_PULL_SINGULARITY_R_ID" --array=1-${NUM_TRAITS} ./scripts/phase1/phase1_step1_multi.sh $(pwd) $tmpfile )
+                JOB_STAGE1_STEP1=$(sbatch --dependency=afterok:"$JOB_PULL_SINGULARITY_PYTHON_ID":"$JOB_PULL_SINGULARITY_R_ID" ${STEP1_JOB_ARGS} )
             else
-                JOB_STAGE1_STEP1=$(sbatch --dependency=afterok:"$JOB_PULL_SINGULARITY_PYTHON_ID"  --array=1-${NUM_TRAITS} ./scripts/phase1/phase1_step1_multi.sh $(pwd) $tmpfile)
+                JOB_STAGE1_STEP1=$(sbatch --dependency=afterok:"$JOB_PULL_SINGULARITY_PYTHON_ID" ${STEP1_JOB_ARGS})
             fi
         elif [ "$PULL_R_CONTAINER" = true ]; then
-                JOB_STAGE1_STEP1=$(sbatch --dependency=afterok:"$JOB_PULL_SINGULARITY_R_ID" --array=1-${NUM_TRAITS} ./scripts/phase1/phase1_step1_multi.sh $(pwd) $tmpfile)
+                JOB_STAGE1_STEP1=$(sbatch --dependency=afterok:"$JOB_PULL_SINGULARITY_R_ID" ${STEP1_JOB_ARGS})
         else
-            JOB_STAGE1_STEP1=$(sbatch --array=1-${NUM_TRAITS} ./scripts/phase1/phase1_step1_multi.sh $(pwd) $tmpfile)
+            JOB_STAGE1_STEP1=$(sbatch ${STEP1_JOB_ARGS})
         fi
         JOB_STAGE1_STEP1_ID=$(echo "$JOB_STAGE1_STEP1" | awk '{print $4}')
+    elif [ "$BATCH_TRAITS" = true ]; then
+        ./scripts/phase1/phase1_step1_study.sh $(pwd)
     else
         ./scripts/phase1/phase1_step1_multi.sh $(pwd)
     fi
@@ -461,6 +697,9 @@ python3 ./scripts/phase1/compile_results.py \
     --dirPath $SUMMARIES_PATH_ORIGINAL \
     --identifier $STUDY \
     --output $RESULTS_PATH_OR
+python3 ./scripts/phase2/dc_go_index.py \
+    --go_path $RESULTS_PATH_OR/GO_summaries/ \
+    --output_path $RESULTS_PATH_OR/go_index_${STUDY}.npz
 EOT
 )
         JOB_STAGE1_STEP2_ORIGINAL_ID=$(echo "$JOB_STAGE1_STEP2_ORIGINAL" | awk '{print $4}')
@@ -474,15 +713,23 @@ python3 ./scripts/phase1/compile_results.py \
     --dirPath $SUMMARIES_PATH_ORIGINAL \
     --identifier $STUDY \
     --output $RESULTS_PATH_OR
+singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python \
+python3 ./scripts/phase2/dc_go_index.py \
+    --go_path $RESULTS_PATH_OR/GO_summaries/ \
+    --output_path $RESULTS_PATH_OR/go_index_${STUDY}.npz
 EOT
 )
         JOB_STAGE1_STEP2_ORIGINAL_ID=$(echo "$JOB_STAGE1_STEP2_ORIGINAL" | awk '{print $4}')
     else
-        docker run --rm -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
+        docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
             "python3 ./scripts/phase1/compile_results.py \
                 --dirPath $SUMMARIES_PATH_ORIGINAL \
                 --identifier $TRAIT \
                 --output $RESULTS_PATH"
+        docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
+            "python3 ./scripts/phase2/dc_go_index.py \
+                --go_path $RESULTS_PATH_OR/GO_summaries/ \
+                --output_path $RESULTS_PATH_OR/go_index_${STUDY}.npz"
     fi
 }
 
@@ -518,7 +765,10 @@ source activate $CONDA_ENV
 python3 ./scripts/phase1/compile_results.py \
     --dirPath $SUMMARIES_PATH_PERMUTATION \
     --identifier $STUDY_RANDOM \
-    --output $RESULTS_PATH_RR
+    --output $RESULTS_PATH_RR ${COMPILE_RESULTS_ARGS}
+python3 ./scripts/phase2/dc_go_index.py \
+    --go_path $RESULTS_PATH_RR/GO_summaries/ \
+    --output_path $RESULTS_PATH_RR/go_index_${STUDY_RANDOM}.npz
 EOT
 )
         JOB_STAGE1_STEP4_PERMUTATION_ID=$(echo "$JOB_STAGE1_STEP4_PERMUTATION" | awk '{print $4}')
@@ -532,16 +782,24 @@ singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python \
 python3 ./scripts/phase1/compile_results.py \
     --dirPath $SUMMARIES_PATH_PERMUTATION \
     --identifier $STUDY_RANDOM \
-    --output $RESULTS_PATH_RR
+    --output $RESULTS_PATH_RR ${COMPILE_RESULTS_ARGS}
+singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python \
+python3 ./scripts/phase2/dc_go_index.py \
+    --go_path $RESULTS_PATH_RR/GO_summaries/ \
+    --output_path $RESULTS_PATH_RR/go_index_${STUDY_RANDOM}.npz
 EOT
 )
         JOB_STAGE1_STEP4_PERMUTATION_ID=$(echo "$JOB_STAGE1_STEP4_PERMUTATION" | awk '{print $4}')
     else
-        docker run --rm -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
+        docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
             "python3 ./scripts/phase1/compile_results.py \
                 --dirPath $SUMMARIES_PATH_PERMUTATION \
                 --identifier $STUDY_RANDOM \
-                --output $RESULTS_PATH_RR"
+                --output $RESULTS_PATH_RR ${COMPILE_RESULTS_ARGS}"
+        docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
+            "python3 ./scripts/phase2/dc_go_index.py \
+                --go_path $RESULTS_PATH_RR/GO_summaries/ \
+                --output_path $RESULTS_PATH_RR/go_index_${STUDY_RANDOM}.npz"
     fi
 }
 
@@ -552,13 +810,28 @@ EOT
 phase2_step0() {
     # (0) filter the summary file for original/permuted runs
     echo "# STEP 2.0: filtering + parsing master_summary.csv files"
-    cp "${RESULTS_PATH_OR}/master_summary_${STUDY}.csv" "${RESULTS_PATH_OR}/master_summary.csv"
-    ( head -n 1 "${RESULTS_PATH_OR}/master_summary.csv"; grep 'True' "${RESULTS_PATH_OR}/master_summary.csv" ) > "${RESULTS_PATH_OR}/master_summary_filtered.csv"
-    cut -d ',' -f 1-8 "${RESULTS_PATH_OR}/master_summary_filtered.csv" > "${RESULTS_PATH_OR}/master_summary_filtered_parsed.csv"
+    build_summary_store "${RESULTS_PATH_OR}" "${STUDY}"
+    build_summary_store "${RESULTS_PATH_RR}" "${STUDY_RANDOM}"
+}
 
-    cp "${RESULTS_PATH_RR}/master_summary_${STUDY_RANDOM}.csv" "${RESULTS_PATH_RR}/master_summary.csv"
-    ( head -n 1 "${RESULTS_PATH_RR}/master_summary.csv"; grep 'True' "${RESULTS_PATH_RR}/master_summary.csv" ) > "${RESULTS_PATH_RR}/master_summary_filtered.csv"
-    cut -d ',' -f 1-8 "${RESULTS_PATH_RR}/master_summary_filtered.csv" > "${RESULTS_PATH_RR}/master_summary_filtered_parsed.csv"
+# significant modules go to an indexed store read by partition in phase 2,
+# and to master_summary_filtered_parsed.csv for the remaining csv readers
+build_summary_store() {
+    local results_path="$1"
+    local identifier="$2"
+
+    cp "${results_path}/master_summary_${identifier}.csv" "${results_path}/master_summary.csv"
+    run_python ./scripts/phase2/dc_summary_store.py \
+        --summary_path "${results_path}/master_summary.csv" \
+        --store_path "${results_path}/master_summary.sqlite" \
+        --filtered_csv_path "${results_path}/master_summary_filtered_parsed.csv"
+}
+
+# compiles every module network once into memory-mapped arrays (compiledNetwork.py)
+compile_networks() {
+    echo "# compiling networks of ${MODULE_FILE_PATH}"
+    wait_for_job "${JOB_PULL_SINGULARITY_PYTHON_ID:-}"
+    run_python ./scripts/phase1/nextflow/bin/compiledNetwork.py "${MODULE_FILE_PATH}"
 }
 
 # generates tab-delimited file with all pairs
@@ -606,13 +879,14 @@ source activate $CONDA_ENV
 
 python3 ./scripts/phase2/dc_generate_or_statistics.py \
     --gene_set_path \$PVALFILEPATH \
-    --master_summary_path ${RESULTS_PATH_OR}/master_summary_filtered_parsed.csv \
+    --master_summary_path ${RESULTS_PATH_OR}/master_summary.sqlite \
     --trait \$TRAIT  \
     --module_path ${MODULE_FILE_PATH}/\${NETWORK}.txt \
     --go_path ${RESULTS_PATH_OR}/GO_summaries/\${TRAIT}/ \
     --study $STUDY \
     --output_path ${RESULTS_PATH_OR}/results/raw/ \
-    --network \$NETWORK
+    --network \$NETWORK \
+    --go_index_path ${RESULTS_PATH_OR}/go_index_${STUDY}.npz
 EOT
 )
         else
@@ -631,13 +905,14 @@ echo "Network: \$NETWORK"
 singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python \
     python3 ./scripts/phase2/dc_generate_or_statistics.py \
         --gene_set_path \$PVALFILEPATH \
-        --master_summary_path ${RESULTS_PATH_OR}/master_summary_filtered_parsed.csv \
+        --master_summary_path ${RESULTS_PATH_OR}/master_summary.sqlite \
         --trait \$TRAIT  \
         --module_path ${MODULE_FILE_PATH}/\${NETWORK}.txt \
         --go_path ${RESULTS_PATH_OR}/GO_summaries/\${TRAIT}/ \
         --study $STUDY \
         --output_path ${RESULTS_PATH_OR}/results/raw/ \
-        --network \$NETWORK
+        --network \$NETWORK \
+        --go_index_path ${RESULTS_PATH_OR}/go_index_${STUDY}.npz
 EOT
 )
         fi
@@ -648,7 +923,7 @@ EOT
         do
             echo "Network: $network"
             network="${network%.*}" # remove extension
-            docker run --rm -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
+            docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
                 "python3 ./scripts/phase2/dc_generate_or_statistics.py \
                     --gene_set_path $PVALFILEDIR \
                     --master_summary_path ${OUTPUT_DIR}/${TRAIT}/master_summary_filtered_parsed.csv \
@@ -657,11 +932,65 @@ EOT
                     --go_path ${OUTPUT_DIR}/${TRAIT}/GO_summaries/${TRAIT}/ \
                     --study $TRAIT \
                     --output_path ${OUTPUT_DIR}/${TRAIT}/results/raw/ \
-                    --network $network"
+                    --network $network \
+                    --go_index_path ${RESULTS_PATH_OR}/go_index_${STUDY}.npz"
         done
     fi
 }
 
+build_rank_matrix() {
+    local gene_set_path="$1"
+    local matrix_path="$2"
+
+    # adaptive rounds allocate the matrix for the whole permutation budget and
+    # only fill the rows of their own permutations
+    local MATRIX_ARGS="--permutation_start ${PERMUTATION_START} --max_permutations ${PERMUTATION_BUDGET:-$NUM_PERMUTATIONS}"
+    if [ "$VIRTUAL_PERMUTATIONS" = true ]; then
+        MATRIX_ARGS="${MATRIX_ARGS} --root_seed ${ROOT_SEED}"
+    fi
+    if [ "$SINGULARITY" = true ] && [ "$CONDA" = true ]; then
+        # permutation files are complete once the previous step finished
+        JOB_RANK_MATRIX=$(sbatch --dependency=afterok:"$STEP2_DEPENDENCY_ID" <<EOT
+#!/bin/bash
+#SBATCH -J rank_matrix_${STUDY_RANDOM}
+#SBATCH --mem=8G
+#SBATCH -o ./logs/rank_matrix_%J.out
+source activate $CONDA_ENV
+python3 ./scripts/phase2/dc_rank_matrix.py \
+    --gene_set_path ${gene_set_path} \
+    --trait ${STUDY_RANDOM} \
+    --num_permutations ${NUM_PERMUTATIONS} \
+    --matrix_path ${matrix_path} \
+    ${MATRIX_ARGS}
+EOT
+)
+        STEP2_DEPENDENCY_ID=$(echo "$JOB_RANK_MATRIX" | awk '{print $4}')
+    elif [ "$SINGULARITY" = true ]; then
+        JOB_RANK_MATRIX=$(sbatch --dependency=afterok:"$STEP2_DEPENDENCY_ID" <<EOT
+#!/bin/bash
+#SBATCH -J rank_matrix_${STUDY_RANDOM}
+#SBATCH --mem=8G
+#SBATCH -o ./logs/rank_matrix_%J.out
+singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python \
+    python3 ./scripts/phase2/dc_rank_matrix.py \
+        --gene_set_path ${gene_set_path} \
+        --trait ${STUDY_RANDOM} \
+        --num_permutations ${NUM_PERMUTATIONS} \
+        --matrix_path ${matrix_path} \
+        ${MATRIX_ARGS}
+EOT
+)
+        STEP2_DEPENDENCY_ID=$(echo "$JOB_RANK_MATRIX" | awk '{print $4}')
+    else
+        run_python ./scripts/phase2/dc_rank_matrix.py \
+            --gene_set_path ${gene_set_path} \
+            --trait ${STUDY_RANDOM} \
+            --num_permutations ${NUM_PERMUTATIONS} \
+            --matrix_path ${matrix_path} \
+            ${MATRIX_ARGS}
+    fi
+}
+
 phase2_step2_default() {
 
     # (2.2) generate statistics for permutation run
@@ -694,83 +1023,94 @@ phase2_step2_default() {
     }
 
     GENES_RPSCORES_FILEDIR="${RESULTS_PATH_RR}/RPscores/${STUDY_RANDOM}"
+    VIRTUAL_PERMUTATION_ARGS=""
+    if [ "$VIRTUAL_PERMUTATIONS" = true ]; then
+        # permutations are regenerated from the unpermuted scores, no RPscores files exist
+        GENES_RPSCORES_FILEDIR="${STUDY_RANDOM_PATH}"
+        VIRTUAL_PERMUTATION_ARGS="--root_seed ${ROOT_SEED}"
+    fi
+    # jobs of the array wait for the rank matrix when it is built
+    STEP2_DEPENDENCY_ID=${JOB_STAGE2_STEP1_DEFAULT_ID:-}
+    RANK_MATRIX_ARGS=""
+    if [ "$RANK_MATRIX" = true ]; then
+        RANK_MATRIX_PATH="${RESULTS_PATH_RR}/rank_matrix_${STUDY_RANDOM}.npy"
+        RANK_MATRIX_ARGS="--rank_matrix_path ${RANK_MATRIX_PATH}"
+        build_rank_matrix "$GENES_RPSCORES_FILEDIR" "$RANK_MATRIX_PATH"
+    fi
     tmpfile=$(mktemp --tmpdir="$(pwd)/tmp")
     create_tmp_threshold_network_pairs_default $tmpfile
 
+    # every array element runs a shard of PAIRS_PER_TASK pairs (dc_rp_statistics_tasks.py)
+    NUM_PAIRS=$( wc -l < $tmpfile )
+    NUM_SHARDS=$(( (NUM_PAIRS + PAIRS_PER_TASK - 1) / PAIRS_PER_TASK ))
     if [ "$SINGULARITY" = true ]; then
-        NUM_PAIRS=$( wc -l < $tmpfile )
         if [ "$CONDA" = true ]; then
             echo "RUNNING WITH CONDA ENVIRONMENT ($CONDA_ENV)"
-            JOB_STAGE2_STEP2_DEFAULT=$(sbatch --dependency=afterok:"$JOB_STAGE2_STEP1_DEFAULT_ID" <<EOT
+            JOB_STAGE2_STEP2_DEFAULT=$(sbatch --dependency=afterok:"$STEP2_DEPENDENCY_ID" <<EOT
 #!/bin/bash
 #SBATCH -J phase2_step2_default_${STUDY_RANDOM}
-#SBATCH --array=1-$NUM_PAIRS
+#SBATCH --array=1-$NUM_SHARDS
 #SBATCH --mem-per-cpu=4G
 #SBATCH --cpus-per-task=1
 #SBATCH -o ./logs/phase2_step2_default_%A_%a.out
-NETWORK=\$( sed -n \${SLURM_ARRAY_TASK_ID}p $tmpfile | cut -f 2 )
-THRESHOLD=\$( sed -n \${SLURM_ARRAY_TASK_ID}p $tmpfile | cut -f 1 )
-echo \$NETWORK
-echo \$THRESHOLD
 
 source activate $CONDA_ENV
 
-python3 ./scripts/phase2/dc_generate_rp_statistics.py \
+python3 ./scripts/phase2/dc_rp_statistics_tasks.py \
+    --pairs_path $tmpfile \
+    --shard \${SLURM_ARRAY_TASK_ID}/${NUM_SHARDS} \
+    --module_path ${MODULE_FILE_PATH} \
     --gene_set_path $GENES_RPSCORES_FILEDIR \
-    --master_summary_path ${RESULTS_PATH_RR}/master_summary_filtered_parsed.csv \
+    --master_summary_path ${RESULTS_PATH_RR}/master_summary.sqlite \
     --trait ${STUDY_RANDOM} \
-    --module_path ${MODULE_FILE_PATH}/\${NETWORK}.txt \
     --go_path ${RESULTS_PATH_RR}/GO_summaries/${STUDY_RANDOM}/ \
     --output_path ${RESULTS_PATH_RR}/results/raw/ \
-    --network \$NETWORK \
-    --threshold \$THRESHOLD \
-    --num_permutations ${NUM_PERMUTATIONS}
+    --num_permutations ${NUM_PERMUTATIONS} \
+    --go_index_path ${RESULTS_PATH_RR}/go_index_${STUDY_RANDOM}.npz \
+    ${VIRTUAL_PERMUTATION_ARGS} ${RANK_MATRIX_ARGS} ${RP_STATISTICS_ARGS}
 EOT
 )
         else
             echo "RUNNING WITH SINGULARITY"
-            JOB_STAGE2_STEP2_DEFAULT=$(sbatch --dependency=afterok:"$JOB_STAGE2_STEP1_DEFAULT_ID" <<EOT
+            JOB_STAGE2_STEP2_DEFAULT=$(sbatch --dependency=afterok:"$STEP2_DEPENDENCY_ID" <<EOT
 #!/bin/bash
 #SBATCH -J phase2_step2_default_${STUDY_RANDOM}
-#SBATCH --array=1-$NUM_PAIRS
+#SBATCH --array=1-$NUM_SHARDS
 #SBATCH --mem-per-cpu=4G
 #SBATCH --cpus-per-task=1
 #SBATCH -o ./logs/phase2_step2_default_%A_%a.out
-NETWORK=\$( sed -n \${SLURM_ARRAY_TASK_ID}p $tmpfile | cut -f 2 )
-THRESHOLD=\$( sed -n \${SLURM_ARRAY_TASK_ID}p $tmpfile | cut -f 1 )
-echo \$NETWORK
-echo \$THRESHOLD
 
 singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python \
-    python3 ./scripts/phase2/dc_generate_rp_statistics.py \
+    python3 ./scripts/phase2/dc_rp_statistics_tasks.py \
+        --pairs_path $tmpfile \
+        --shard \${SLURM_ARRAY_TASK_ID}/${NUM_SHARDS} \
+        --module_path ${MODULE_FILE_PATH} \
         --gene_set_path $GENES_RPSCORES_FILEDIR \
-        --master_summary_path ${RESULTS_PATH_RR}/master_summary_filtered_parsed.csv \
+        --master_summary_path ${RESULTS_PATH_RR}/master_summary.sqlite \
         --trait ${STUDY_RANDOM} \
-        --module_path ${MODULE_FILE_PATH}/\${NETWORK}.txt \
         --go_path ${RESULTS_PATH_RR}/GO_summaries/${STUDY_RANDOM}/ \
         --output_path ${RESULTS_PATH_RR}/results/raw/ \
-        --network \$NETWORK \
-        --threshold \$THRESHOLD \
-        --num_permutations ${NUM_PERMUTATIONS}
+        --num_permutations ${NUM_PERMUTATIONS} \
+        --go_index_path ${RESULTS_PATH_RR}/go_index_${STUDY_RANDOM}.npz \
+        ${VIRTUAL_PERMUTATION_ARGS} ${RANK_MATRIX_ARGS} ${RP_STATISTICS_ARGS}
 EOT
 )
         fi
         JOB_STAGE2_STEP2_DEFAULT_ID=$(echo "$JOB_STAGE2_STEP2_DEFAULT" | awk '{print $4}')
     else
-        while IFS=$'\t' read -r threshold network; do
-            echo "Threshold $threshold, Network: $network"
-            docker run --rm -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
-                "python3 ./scripts/phase2/dc_generate_rp_statistics.py \
-                    --gene_set_path $genes_rpscores_filedir \
-                    --master_summary_path ${OUTPUT_DIR}/${TRAITRR}/master_summary_filtered_parsed.csv \
-                    --trait ${TRAITRR} \
-                    --module_path ${MODULEFILEDIR}/${network}.txt \
-                    --go_path ${OUTPUT_DIR}/${TRAITRR}/GO_summaries/${TRAITRR}/ \
-                    --output_path ${OUTPUT_DIR}/${TRAITRR}/results/raw/ \
-                    --network $network \
-                    --threshold $threshold \
-                    --num_permutations $NUM_PERMUTATIONS"
-        done < $tmpfile
+        # one shard holds every pair
+        run_python ./scripts/phase2/dc_rp_statistics_tasks.py \
+            --pairs_path $tmpfile \
+            --shard 1/1 \
+            --module_path ${MODULE_FILE_PATH} \
+            --gene_set_path $GENES_RPSCORES_FILEDIR \
+            --master_summary_path ${RESULTS_PATH_RR}/master_summary.sqlite \
+            --trait ${STUDY_RANDOM} \
+            --go_path ${RESULTS_PATH_RR}/GO_summaries/${STUDY_RANDOM}/ \
+            --output_path ${RESULTS_PATH_RR}/results/raw/ \
+            --num_permutations ${NUM_PERMUTATIONS} \
+            --go_index_path ${RESULTS_PATH_RR}/go_index_${STUDY_RANDOM}.npz \
+            ${VIRTUAL_PERMUTATION_ARGS} ${RANK_MATRIX_ARGS} ${RP_STATISTICS_ARGS}
    fi
    #rm -rf $tmpfile
 }
@@ -809,7 +1149,7 @@ python3 ./scripts/phase2/dc_summary_statistics_rp.py \
     --input_file_rr_id ${STUDY_RANDOM} \
     --network \$NETWORK \
     --output_path ${RESULTS_PATH_OR}/summary/ \
-    --num_permutations ${NUM_PERMUTATIONS}
+    --num_permutations ${NUM_PERMUTATIONS} ${SUMMARY_STATISTICS_ARGS}
 EOT
 )
         else
@@ -835,7 +1175,7 @@ singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python \
         --input_file_rr_id ${STUDY_RANDOM} \
         --network \$NETWORK \
         --output_path ${RESULTS_PATH_OR}/summary/ \
-        --num_permutations ${NUM_PERMUTATIONS}
+        --num_permutations ${NUM_PERMUTATIONS} ${SUMMARY_STATISTICS_ARGS}
 EOT
 )
         fi
@@ -846,7 +1186,7 @@ EOT
         do
             echo "Network: $network"
             network="${network%.*}" # remove extension
-            docker run --rm -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
+            docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
                 "python3 ./scripts/phase2/dc_summary_statistics_rp.py \
                     --trait $TRAIT \
                     --input_path $OUTPUT_DIR \
@@ -928,7 +1268,7 @@ EOT
         do
             echo "Network: $network"
             network="${network%.*}" # remove extension
-            docker run --rm -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
+            docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python /bin/bash -c \
                 "python3 ./scripts/phase2/dc_identify_mea_passing_genes.py \
                     --trait $TRAIT \
                     --geneset_input $PVALFILEDIR\
@@ -941,6 +1281,82 @@ EOT
 }
 
 
+phase_adaptive_permutations() {
+
+    # runs permutations in rounds of PERMUTATION_ROUND_SIZE and keeps only the networks
+    # whose decisions are still open (dc_adaptive_permutations.py) for the next round
+    echo "# ADAPTIVE PERMUTATIONS: up to ${NUM_PERMUTATIONS} permutations in rounds of ${PERMUTATION_ROUND_SIZE}"
+    local PERMUTATION_BUDGET=$NUM_PERMUTATIONS
+    local ALL_MODULE_FILE_PATH=$MODULE_FILE_PATH
+    local ALL_NUM_MODULE_FILES=$NUM_MODULE_FILES
+    local ROUND_MODULE_FILE_PATH="$(pwd)/tmp/adaptive_modules_${STUDY_RANDOM}"
+    local UNDECIDED_FILE="$(pwd)/tmp/adaptive_undecided_${STUDY_RANDOM}.txt"
+    local STATUS_FILE="${RESULTS_PATH_OR}/summary/adaptive_status_${NUM_PERMUTATIONS}_permutations.csv"
+
+    # every network takes part in the first round
+    rm -rf "$ROUND_MODULE_FILE_PATH" "$STATUS_FILE"
+    mkdir -p "$ROUND_MODULE_FILE_PATH"
+    for network_file in "$ALL_MODULE_FILE_PATH"/*.txt; do
+        ln -s "$network_file" "$ROUND_MODULE_FILE_PATH/"
+    done
+
+    COMPILE_RESULTS_ARGS="--append"
+    MODULE_FILE_PATH=$ROUND_MODULE_FILE_PATH
+    PERMUTATION_START=1
+    while [ "$PERMUTATION_START" -le "$PERMUTATION_BUDGET" ] && [ -n "$(ls -A "$ROUND_MODULE_FILE_PATH")" ]; do
+        NUM_PERMUTATIONS=$(( PERMUTATION_START + PERMUTATION_ROUND_SIZE - 1 ))
+        if [ "$NUM_PERMUTATIONS" -gt "$PERMUTATION_BUDGET" ]; then
+            NUM_PERMUTATIONS=$PERMUTATION_BUDGET
+        fi
+        NUM_MODULE_FILES=$( ls -1 ${MODULE_FILE_PATH}/*.txt | wc -l )
+        echo "# ADAPTIVE ROUND: permutations ${PERMUTATION_START}-${NUM_PERMUTATIONS} on ${NUM_MODULE_FILES} networks"
+        # phase 2 only scores this round's permutations and appends them to the counts of the earlier rounds
+        RP_STATISTICS_ARGS="--max_permutations ${PERMUTATION_BUDGET} --permutation_start ${PERMUTATION_START}"
+
+        # each round depends on the job that finished the previous one
+        JOB_STAGE1_STEP1_ID=$LAST_JOB_ID
+        phase1_step3
+        phase1_step4
+        wait_for_job "${JOB_STAGE1_STEP4_PERMUTATION_ID:-}"
+        build_summary_store "${RESULTS_PATH_RR}" "${STUDY_RANDOM}"
+
+        JOB_STAGE2_STEP1_DEFAULT_ID=${JOB_STAGE1_STEP4_PERMUTATION_ID:-}
+        phase2_step2_default
+        wait_for_job "${JOB_STAGE2_STEP2_DEFAULT_ID:-}"
+        LAST_JOB_ID=${JOB_STAGE2_STEP2_DEFAULT_ID:-}
+
+        NETWORKS=$( ls "$ROUND_MODULE_FILE_PATH" | sed 's/\.txt$//' | paste -sd, - )
+        run_python ./scripts/phase2/dc_adaptive_permutations.py \
+            --study_path ${STUDY_PATH} \
+            --input_path ${RESULTS_PATH} \
+            --or_id ${STUDY} \
+            --rr_id ${STUDY_RANDOM} \
+            --input_file_rr_id ${STUDY_RANDOM} \
+            --networks ${NETWORKS} \
+            --num_permutations ${NUM_PERMUTATIONS} \
+            --max_permutations ${PERMUTATION_BUDGET} \
+            --percentile_threshold ${PERCENTILE_THRESHOLD} \
+            --status_path ${STATUS_FILE} \
+            --undecided_path ${UNDECIDED_FILE}
+
+        # drop decided networks from the next round
+        for network_file in "$ROUND_MODULE_FILE_PATH"/*.txt; do
+            if ! grep -Fxq "$(basename "$network_file" .txt)" "$UNDECIDED_FILE"; then
+                rm "$network_file"
+            fi
+        done
+        PERMUTATION_START=$(( NUM_PERMUTATIONS + 1 ))
+    done
+
+    # phase 2 summarizes every network against the permutation budget
+    NUM_PERMUTATIONS=$PERMUTATION_BUDGET
+    MODULE_FILE_PATH=$ALL_MODULE_FILE_PATH
+    NUM_MODULE_FILES=$ALL_NUM_MODULE_FILES
+    SUMMARY_STATISTICS_ARGS="--percentile_threshold ${PERCENTILE_THRESHOLD}"
+    JOB_STAGE2_STEP2_DEFAULT_ID=$LAST_JOB_ID
+}
+
+
 #########################
 ### UTILITY FUNCTIONS ###
 #########################
@@ -972,16 +1388,61 @@ print_phase_completion() {
 ########################
 "
 }
-print_phase_completion_message() {
+wait_for_job() {
     if [ "$SINGULARITY" = true ]; then
-        PHASE=$1
-        JOBID=$2
+        JOBID=$1
         while squeue -j "$JOBID" | grep -q "$JOBID"; do
             sleep 5
         done
     fi
+}
+print_phase_completion_message() {
+    PHASE=$1
+    wait_for_job $2
     print_phase_completion $PHASE
 }
+# runs a python script in the configured environment (conda, singularity or docker) on this node
+run_python() {
+    if [ "$CONDA" = true ]; then
+        conda run -n "$CONDA_ENV" python3 "$@"
+    elif [ "$SINGULARITY" = true ]; then
+        singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python python3 "$@"
+    else
+        docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python python3 "$@"
+    fi
+}
+run_dag() {
+    # python command of the tasks, the driver itself only needs python3 on the current node
+    if [ "$CONDA" = true ]; then
+        DAG_PYTHON="conda run -n $CONDA_ENV python3"
+    elif [ "$SINGULARITY" = true ]; then
+        DAG_PYTHON="singularity exec --no-home -B $(pwd):$(pwd) --pwd $(pwd) $container_python python3"
+    else
+        DAG_PYTHON="docker run --rm -e FISHNET_TELEMETRY -v $(pwd):$(pwd) -w $(pwd) -u $(id -u):$(id -g) $container_python python3"
+    fi
+    DAG_ARGS=""
+    if [ "$VIRTUAL_PERMUTATIONS" = true ]; then
+        DAG_ARGS="$DAG_ARGS --root_seed ${ROOT_SEED}"
+    fi
+    if [ "$RANK_MATRIX" = true ]; then
+        DAG_ARGS="$DAG_ARGS --rank_matrix"
+    fi
+    if [ "$BATCH_TRAITS" = true ]; then
+        DAG_ARGS="$DAG_ARGS --batch_traits"
+    fi
+    python3 ./scripts/fishnet_dag.py \
+        --study ${STUDY_PATH} \
+        --study_random ${STUDY_RANDOM_PATH} \
+        --modules ${MODULE_FILE_PATH} \
+        --num_permutations ${NUM_PERMUTATIONS} \
+        --FDR_threshold ${FDR_THRESHOLD} \
+        --percentile_threshold ${PERCENTILE_THRESHOLD} \
+        --nxf_config ${NXF_CONFIG} \
+        --nextflow_args "${ORA_ARGS} ${ARTIFACT_STORE_ARGS} ${TELEMETRY_ARGS}" \
+        --python "$DAG_PYTHON" \
+        --jobs ${RESUME_JOBS} \
+        ${DAG_ARGS}
+}
 nextflow_cleanup() {
     rm -rf .nextflow* work/
 }
@@ -999,7 +1460,54 @@ fi
 # pull containers
 pull_docker_image
 
-if [ "$SKIP_STAGE_1" = true ]; then
+if [ "$COMPILE_NETWORKS" = true ]; then
+    compile_networks
+fi
+
+if [ "$RESUME" = true ]; then
+    if [ "$ADAPTIVE_PERMUTATIONS" = true ] || [ "$THRESHOLDING_MODE" != "$THRESHOLDING_MODE_DEFAULT" ]; then
+        echo "--resume runs the default thresholding without adaptive permutations"
+        exit 1
+    fi
+    wait_for_job "${JOB_PULL_SINGULARITY_PYTHON_ID:-}"
+    run_dag
+    echo "### FISHNET COMPLETE ###"
+    exit 0
+fi
+
+if [ "$ADAPTIVE_PERMUTATIONS" = true ]; then
+    #############################
+    ### ADAPTIVE PERMUTATIONS ###
+    #############################
+    # the original run and its statistics come first, permutations then run in rounds
+    print_phase_message 1
+    mkdir -p "$(pwd)/tmp"
+
+    phase1_step1
+
+    phase1_step2
+
+    wait_for_job "${JOB_STAGE1_STEP2_ORIGINAL_ID:-}"
+    build_summary_store "${RESULTS_PATH_OR}" "${STUDY}"
+
+    phase2_step1_default
+
+    wait_for_job "${JOB_STAGE2_STEP1_DEFAULT_ID:-}"
+    LAST_JOB_ID=${JOB_STAGE2_STEP1_DEFAULT_ID:-}
+
+    phase_adaptive_permutations
+
+    print_phase_completion 1
+
+    print_phase_message 2
+
+    phase2_step3_default
+
+    phase2_step4_default
+
+    print_phase_completion_message 2 $JOB_STAGE2_STEP4_DEFAULT_ID
+
+elif [ "$SKIP_STAGE_1" = true ]; then
     echo "Skipping STAGE 1"
 else
     ###############
@@ -1020,7 +1528,9 @@ else
     #nextflow_cleanup
 fi
 
-if [ "$SKIP_STAGE_2" = true ]; then
+if [ "$ADAPTIVE_PERMUTATIONS" = true ]; then
+    : # stage 2 ran along with the adaptive permutation rounds
+elif [ "$SKIP_STAGE_2" = true ]; then
     echo "Skipping STAGE 2"
 else
     ###############
@@ -0,0 +1,485 @@
+import ast
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# python scripts/fishnet_dag.py
+#   --study data/pvals/exampleOR/
+#   --study_random data/pvals/exampleRR/
+#   --modules data/modules/ker_based/
+#   [--num_permutations 200] [--FDR_threshold 0.05] [--percentile_threshold 99]
+#   [--nxf_config conf/fishnet.config] [--nextflow_args "--oraEngine python --goAnnotation go.gmt"]
+#   [--python "conda run -n fishnet python3"] [--batch_traits] [--jobs 4] [--dry_run] [--force "rp_statistics/*"]
+#
+# Resumable driver of the default thresholding run of FISHNET. The stages of fishnet.sh are modelled as a DAG of
+# tasks (one Nextflow run per trait, or one for the whole study with --batch_traits, and one for the permutations,
+# compile, GO index, summary store, then OR statistics per (network, trait), RP statistics per network, summary and
+# identify per (network, trait)).
+#
+# A task is skipped when its fingerprint matches the one recorded at its last successful run and its outputs exist.
+# The fingerprint of a task hashes
+#   - its commands (every parameter of the task is an argument of a command)
+#   - the content of its input files and directories, including the python scripts it runs and their local imports
+#   - the output fingerprints of the tasks it depends on
+# so a rerun only runs the tasks downstream of what changed, and a task whose rerun writes the same outputs as before
+# does not invalidate its dependents. Records live in results/.fishnet_dag/ and are written once a task succeeds, so
+# a run that failed part way resumes at the failed tasks. The Nextflow runs pass -resume, so an up to date permutation,
+# Pascal or ORA task of a rerun Nextflow run is taken from the Nextflow cache.
+#
+# File content hashes are cached by (size, mtime), so an unchanged input is hashed once.
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(ROOT_PATH, "results")
+STATE_DIR = ".fishnet_dag"
+NEXTFLOW_PATH = os.path.join(ROOT_PATH, "scripts", "phase1", "nextflow")
+PHASE1_PATH = os.path.join(ROOT_PATH, "scripts", "phase1")
+PHASE2_PATH = os.path.join(ROOT_PATH, "scripts", "phase2")
+# directories searched for the local imports of a script, as the sys.path of the phase 2 scripts
+IMPORT_PATHS = [PHASE2_PATH, PHASE1_PATH, os.path.join(NEXTFLOW_PATH, "bin")]
+
+
+class Task:
+    """
+    One node of the DAG.
+
+    Args:
+        name (str): unique name, e.g. or_statistics/<network>/<trait>
+        commands (list): argv lists run in order from the FISHNET directory
+        inputs (list): files and directories read by the task that no other task writes
+        outputs (list): files and directories written by the task
+        deps (list): names of the tasks whose outputs the task reads
+        group (str): tasks of the same group never run at the same time
+    """
+
+    def __init__(self, name, commands, inputs = (), outputs = (), deps = (), group = None):
+        self.name = name
+        self.commands = [list(command) for command in commands]
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.group = group
+
+
+class DagState:
+    """Fingerprints of the last successful run of every task, and the content hash cache of files."""
+
+    def __init__(self, results_path):
+        self.state_path = os.path.join(results_path, STATE_DIR)
+        self.tasks_path = os.path.join(self.state_path, "tasks")
+        self.hashes_path = os.path.join(self.state_path, "file_hashes.json")
+        os.makedirs(self.tasks_path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.file_hashes = {}
+        if os.path.exists(self.hashes_path):
+            with open(self.hashes_path, "r") as f:
+                self.file_hashes = json.load(f)
+
+    def record_path(self, name):
+        return os.path.join(self.tasks_path, name.replace("/", "__") + ".json")
+
+    def record(self, name):
+        record_path = self.record_path(name)
+        if not os.path.exists(record_path):
+            return None
+        with open(record_path, "r") as f:
+            return json.load(f)
+
+    def write_record(self, name, record):
+        write_json(self.record_path(name), record)
+
+    def clear_record(self, name):
+        if os.path.exists(self.record_path(name)):
+            os.remove(self.record_path(name))
+
+    def file_hash(self, path):
+        """sha256 of a file, recomputed only when its size or mtime changed."""
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            cached = self.file_hashes.get(path)
+        if cached is not None and cached[:2] == stamp:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self.lock:
+            self.file_hashes[path] = stamp + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def path_hash(self, path):
+        """Content hash of a file or a directory tree (hidden entries and __pycache__ excluded), None if missing."""
+        if os.path.isfile(path):
+            return self.file_hash(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for directory, subdirs, files in os.walk(path):
+            subdirs[:] = sorted(d for d in subdirs if not d.startswith(".") and d != "__pycache__")
+            for file in sorted(files):
+                if file.startswith("."):
+                    continue
+                file_path = os.path.join(directory, file)
+                digest.update(f"{os.path.relpath(file_path, path)}\0{self.file_hash(file_path)}\0".encode())
+        return digest.hexdigest()
+
+    def save(self):
+        with self.lock:
+            write_json(self.hashes_path, self.file_hashes)
+
+
+def write_json(path, content):
+    # a record is replaced atomically, so an interrupted run never leaves a truncated one
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(content, f, sort_keys = True)
+    os.replace(tmp_path, path)
+
+def local_imports(script_path, seen = None):
+    """The script and every module of IMPORT_PATHS it imports, recursively."""
+    seen = set() if seen is None else seen
+    if script_path in seen:
+        return seen
+    seen.add(script_path)
+    with open(script_path, "r") as f:
+        tree = ast.parse(f.read(), filename = script_path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            modules = [node.module]
+        else:
+            continue
+        for module in modules:
+            for import_path in IMPORT_PATHS:
+                module_path = os.path.join(import_path, module.split(".")[0] + ".py")
+                if os.path.exists(module_path):
+                    local_imports(module_path, seen)
+                    break
+    return seen
+
+def python_command(python, script, *args):
+    """argv running a FISHNET python script with the python command of the run, and the code it depends on."""
+    script_path = os.path.join(ROOT_PATH, script)
+    return python + [script_path] + [str(arg) for arg in args], sorted(local_imports(script_path))
+
+def num_tests(pval_file_path):
+    """Number of genes of a p-value file (lines minus header)."""
+    with open(pval_file_path, "r") as f:
+        return sum(1 for _ in f) - 1
+
+def rp_thresholds(num_genes):
+    """Thresholds of the permutation run: every 10 genes up to 25% of the genes, as phase2_step2_default."""
+    rounded_25 = (25 * num_genes + 50) // 100
+    return list(range(10, rounded_25 - rounded_25 % 10 + 1, 10))
+
+def build_dag(study_path, study_random_path, module_path, num_permutations, fdr_threshold, percentile_threshold,
+              nxf_config, python, nextflow_args = (), root_seed = None, rank_matrix = False, batch_traits = False):
+    """
+    Tasks of a default thresholding run, in an order where every task comes after its dependencies.
+
+    Args:
+        study_path (str): directory of trait subdirectories
+        study_random_path (str): directory of the uniform p-values of the permutations
+        module_path (str): directory of the network module files
+        num_permutations (int): number of permutations
+        fdr_threshold (float): FDR cutoff of identify
+        percentile_threshold (float): percentile cutoff of identify
+        nxf_config (str): nextflow config
+        python (list): argv prefix running python3 (e.g. conda run or singularity exec)
+        nextflow_args (list): extra arguments of every Nextflow run (ORA engine, artifact store)
+        root_seed (int): run virtual permutations from this root seed
+        rank_matrix (bool): build the rank matrix of the permutations for the RP statistics
+        batch_traits (bool): run the original run of every trait in one Nextflow run (study mode)
+
+    Returns:
+        dict of task name -> Task
+    """
+    study_path, study_random_path, module_path = (os.path.abspath(path) for path in (study_path, study_random_path, module_path))
+    study, study_random = os.path.basename(study_path.rstrip("/")), os.path.basename(study_random_path.rstrip("/"))
+    # the Nextflow runs publish to ./results of the FISHNET directory
+    results_path = RESULTS_PATH
+    results_path_or, results_path_rr = os.path.join(results_path, study), os.path.join(results_path, study_random)
+    nxf_config = os.path.abspath(nxf_config)
+    traits = sorted(entry.name for entry in os.scandir(study_path) if entry.is_dir())
+    networks = sorted(os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(module_path, "*.txt")))
+    nextflow = ["nextflow", "run", os.path.join(NEXTFLOW_PATH, "main.nf"), "--moduleFileDir", module_path,
+                "--geneColName", "Genes", "--pvalColName", "p_vals", "--bonferroni_alpha", "0.05"] + list(nextflow_args)
+    nextflow_inputs = [NEXTFLOW_PATH, nxf_config, module_path]
+    tasks = {}
+
+    def add(task):
+        tasks[task.name] = task
+
+    # phase 1
+    if batch_traits:
+        add(Task("phase1_original",
+                 [nextflow + ["--studyDir", study_path, "--pipeline", study, "-c", nxf_config, "-resume"]],
+                 inputs = nextflow_inputs + [study_path],
+                 outputs = [os.path.join(results_path_or, "GO_summaries")],
+                 group = "nextflow"))
+    for trait in [] if batch_traits else traits:
+        pval_file_path = os.path.join(study_path, trait, f"0-{trait}.csv")
+        add(Task(f"phase1_original/{trait}",
+                 [nextflow + ["--trait", trait, "--numTests", num_tests(pval_file_path), "--pipeline", study,
+                              "--pvalFileName", pval_file_path, "-c", nxf_config, "-resume"]],
+                 inputs = nextflow_inputs + [os.path.join(study_path, trait)],
+                 outputs = [os.path.join(results_path_or, "GO_summaries", trait)],
+                 group = "nextflow"))
+    pval_file_path_rr = os.path.join(study_random_path, f"{study_random}.csv")
+    virtual_args = [] if root_seed is None else ["--virtual_permutations", "--rootSeed", root_seed]
+    add(Task("phase1_permutation",
+             [nextflow + ["--trait", study_random, "--numTests", num_tests(pval_file_path_rr), "--pipeline", study_random,
+                          "--pvalFileName", pval_file_path_rr, "--random_permutation", "--numRP", num_permutations] + virtual_args +
+              ["--GO_summaries_path", "GO_summaries", "--masterSummaries_path", "masterSummaries", "-c", nxf_config, "-resume"]],
+             inputs = nextflow_inputs + [pval_file_path_rr],
+             outputs = [os.path.join(results_path_rr, "GO_summaries", study_random)],
+             group = "nextflow"))
+
+    phase1_original = ["phase1_original"] if batch_traits else [f"phase1_original/{trait}" for trait in traits]
+    for run, identifier, run_path, phase1_tasks in (("original", study, results_path_or, phase1_original),
+                                                   ("permutation", study_random, results_path_rr, ["phase1_permutation"])):
+        compile_command, compile_code = python_command(python, "scripts/phase1/compile_results.py", "--dirPath",
+                                                       os.path.join(run_path, "masterSummaries", "summaries") + "/",
+                                                       "--identifier", identifier, "--output", run_path)
+        add(Task(f"compile/{run}", [compile_command], inputs = compile_code,
+                 outputs = [os.path.join(run_path, f"master_summary_{identifier}.csv")], deps = phase1_tasks))
+        go_index_command, go_index_code = python_command(python, "scripts/phase2/dc_go_index.py", "--go_path",
+                                                         os.path.join(run_path, "GO_summaries") + "/", "--output_path",
+                                                         os.path.join(run_path, f"go_index_{identifier}.npz"))
+        add(Task(f"go_index/{run}", [go_index_command], inputs = go_index_code,
+                 outputs = [os.path.join(run_path, f"go_index_{identifier}.npz")], deps = phase1_tasks))
+        store_command, store_code = python_command(python, "scripts/phase2/dc_summary_store.py", "--summary_path",
+                                                   os.path.join(run_path, "master_summary.csv"), "--store_path",
+                                                   os.path.join(run_path, "master_summary.sqlite"), "--filtered_csv_path",
+                                                   os.path.join(run_path, "master_summary_filtered_parsed.csv"))
+        add(Task(f"summary_store/{run}",
+                 [["cp", os.path.join(run_path, f"master_summary_{identifier}.csv"), os.path.join(run_path, "master_summary.csv")], store_command],
+                 inputs = store_code,
+                 outputs = [os.path.join(run_path, "master_summary.sqlite"), os.path.join(run_path, "master_summary_filtered_parsed.csv")],
+                 deps = [f"compile/{run}"]))
+
+    # phase 2
+    for network in networks:
+        for trait in traits:
+            raw_path = os.path.join(results_path_or, "results", "raw")
+            command, code = python_command(python, "scripts/phase2/dc_generate_or_statistics.py",
+                                           "--gene_set_path", os.path.join(study_path, trait) + "/",
+                                           "--master_summary_path", os.path.join(results_path_or, "master_summary.sqlite"),
+                                           "--trait", trait, "--module_path", os.path.join(module_path, f"{network}.txt"),
+                                           "--go_path", os.path.join(results_path_or, "GO_summaries", trait) + "/",
+                                           "--study", study, "--output_path", raw_path + "/", "--network", network,
+                                           "--go_index_path", os.path.join(results_path_or, f"go_index_{study}.npz"))
+            add(Task(f"or_statistics/{network}/{trait}", [command],
+                     inputs = code + [os.path.join(study_path, trait), os.path.join(module_path, f"{network}.txt")],
+                     outputs = [os.path.join(raw_path, f"{network}_{trait}_{network}_or_summary.csv"),
+                                os.path.join(raw_path, f"{network}_{trait}_{network}_or_fishnet_genes.csv")],
+                     deps = ["summary_store/original", "go_index/original"]))
+
+    if root_seed is None:
+        gene_set_path, seed_args = os.path.join(results_path_rr, "RPscores", study_random), []
+    else:
+        # permutations are regenerated from the unpermuted scores, no RPscores files exist
+        gene_set_path, seed_args = study_random_path, ["--root_seed", root_seed]
+    rp_deps = ["summary_store/permutation", "go_index/permutation"]
+    rank_matrix_args = []
+    if rank_matrix:
+        matrix_path = os.path.join(results_path_rr, f"rank_matrix_{study_random}.npy")
+        command, code = python_command(python, "scripts/phase2/dc_rank_matrix.py", "--gene_set_path", gene_set_path,
+                                       "--trait", study_random, "--num_permutations", num_permutations,
+                                       "--matrix_path", matrix_path, *seed_args)
+        add(Task("rank_matrix", [command], inputs = code,
+                 outputs = [matrix_path, os.path.splitext(matrix_path)[0] + "_genes.txt"], deps = ["phase1_permutation"]))
+        rank_matrix_args = ["--rank_matrix_path", matrix_path]
+        rp_deps.append("rank_matrix")
+
+    thresholds = rp_thresholds(num_tests(pval_file_path_rr))
+    raw_path_rr = os.path.join(results_path_rr, "results", "raw")
+    for network in networks:
+        # one task answers every threshold of a network from one pass over the permutations
+        command, code = python_command(python, "scripts/phase2/dc_generate_rp_statistics.py",
+                                       "--gene_set_path", gene_set_path,
+                                       "--master_summary_path", os.path.join(results_path_rr, "master_summary.sqlite"),
+                                       "--trait", study_random, "--module_path", os.path.join(module_path, f"{network}.txt"),
+                                       "--go_path", os.path.join(results_path_rr, "GO_summaries", study_random) + "/",
+                                       "--output_path", raw_path_rr + "/", "--network", network,
+                                       "--threshold", ",".join(str(threshold) for threshold in thresholds),
+                                       "--num_permutations", num_permutations,
+                                       "--go_index_path", os.path.join(results_path_rr, f"go_index_{study_random}.npz"),
+                                       *seed_args, *rank_matrix_args)
+        add(Task(f"rp_statistics/{network}", [command],
+                 inputs = code + [os.path.join(module_path, f"{network}.txt")],
+                 outputs = [os.path.join(raw_path_rr, f"{study_random}_{threshold}_{network}_rp_{kind}_{num_permutations}_permutations.csv")
+                            for threshold in thresholds for kind in ("mea_passing_across", "summary")],
+                 deps = rp_deps))
+
+    summary_path = os.path.join(results_path_or, "summary")
+    for network in networks:
+        for trait in traits:
+            command, code = python_command(python, "scripts/phase2/dc_summary_statistics_rp.py",
+                                           "--trait", trait, "--input_path", results_path, "--or_id", study,
+                                           "--rr_id", study_random, "--input_file_rr_id", study_random,
+                                           "--network", network, "--output_path", summary_path + "/",
+                                           "--num_permutations", num_permutations)
+            add(Task(f"summary/{network}/{trait}", [command], inputs = code,
+                     outputs = [os.path.join(summary_path, f"{trait}_{network}_summary_{num_permutations}_permutations.csv")],
+                     deps = [f"or_statistics/{network}/{trait}", f"rp_statistics/{network}"]))
+            command, code = python_command(python, "scripts/phase2/dc_identify_mea_passing_genes.py",
+                                           "--trait", trait, "--geneset_input", os.path.join(study_path, trait) + "/",
+                                           "--FDR_threshold", fdr_threshold, "--percentile_threshold", percentile_threshold,
+                                           "--network", network, "--input_path", results_path_or,
+                                           "--num_permutations", num_permutations)
+            # the genes files of identify are only written for thresholds with FISHNET genes, so none is required
+            add(Task(f"identify/{network}/{trait}", [command], inputs = code + [os.path.join(study_path, trait)],
+                     deps = [f"summary/{network}/{trait}", f"or_statistics/{network}/{trait}"]))
+    return tasks
+
+def task_fingerprint(task, state, dep_digests):
+    """Hash of the commands, input contents and dependency output fingerprints of a task."""
+    inputs = {path: state.path_hash(path) for path in task.inputs}
+    content = json.dumps({"commands": task.commands, "inputs": inputs,
+                          "deps": {dep: dep_digests[dep] for dep in task.deps}}, sort_keys = True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def output_fingerprint(task, state, fingerprint):
+    """Hash of the outputs of a task. A task without outputs is represented by its fingerprint."""
+    if not task.outputs:
+        return fingerprint
+    content = json.dumps({path: state.path_hash(path) for path in task.outputs}, sort_keys = True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def run_task(task, state, fingerprint, log_path, group_locks):
+    """Run the commands of a task, then record its fingerprints. Returns the output fingerprint."""
+    # a stale record must not survive a failed run
+    state.clear_record(task.name)
+    lock = group_locks.get(task.group)
+    if lock is not None:
+        lock.acquire()
+    try:
+        with open(log_path, "w") as log:
+            for command in task.commands:
+                log.write(f"$ {' '.join(shlex.quote(arg) for arg in command)}\n")
+                log.flush()
+                subprocess.run(command, cwd = ROOT_PATH, stdout = log, stderr = subprocess.STDOUT, check = True)
+    finally:
+        if lock is not None:
+            lock.release()
+    missing = [path for path in task.outputs if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"{task.name} did not write {', '.join(missing)}")
+    digest = output_fingerprint(task, state, fingerprint)
+    state.write_record(task.name, {"fingerprint": fingerprint, "output_fingerprint": digest})
+    state.save()
+    return digest
+
+def run_dag(tasks, state, jobs = 1, dry_run = False, force = (), log_dir = None):
+    """
+    Run the tasks that are not up to date, dependencies first.
+
+    Args:
+        tasks (dict): task name -> Task, output of build_dag
+        state (DagState): fingerprints of previous runs
+        jobs (int): maximum number of tasks running at once
+        dry_run (bool): only print the tasks that would run
+        force (iterable): fnmatch patterns of task names to run even if up to date
+        log_dir (str): directory of the task logs (default: ./logs/dag/)
+
+    Returns:
+        list of the names of the tasks that failed or were not run because a dependency failed
+    """
+    log_dir = os.path.join(ROOT_PATH, "logs", "dag") if log_dir is None else log_dir
+    os.makedirs(log_dir, exist_ok = True)
+    group_locks = {task.group: threading.Lock() for task in tasks.values() if task.group is not None}
+    pending = dict(tasks)
+    dep_digests = {}
+    failed = []
+    counts = {"up to date": 0, "run": 0}
+    with ThreadPoolExecutor(max_workers = jobs) as pool:
+        running = {}
+        while pending or running:
+            for name, task in list(pending.items()):
+                if any(dep in failed for dep in task.deps):
+                    print(f"[skipped] {name}: a dependency failed")
+                    failed.append(name)
+                    del pending[name]
+                    continue
+                if not all(dep in dep_digests for dep in task.deps):
+                    continue
+                del pending[name]
+                fingerprint = task_fingerprint(task, state, dep_digests)
+                record = state.record(name)
+                forced = any(fnmatch.fnmatch(name, pattern) for pattern in force)
+                if record is None:
+                    reason = "never completed"
+                elif record["fingerprint"] != fingerprint:
+                    reason = "inputs changed"
+                elif not all(os.path.exists(path) for path in task.outputs):
+                    reason = "outputs missing"
+                elif forced:
+                    reason = "forced"
+                else:
+                    counts["up to date"] += 1
+                    dep_digests[name] = record["output_fingerprint"]
+                    continue
+                counts["run"] += 1
+                print(f"[{'would run' if dry_run else 'run'}] {name}: {reason}")
+                if dry_run:
+                    # dependents of a task that would run are reported as changed
+                    dep_digests[name] = f"pending:{fingerprint}"
+                    continue
+                log_path = os.path.join(log_dir, name.replace("/", "__") + ".log")
+                running[pool.submit(run_task, task, state, fingerprint, log_path, group_locks)] = name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    dep_digests[name] = future.result()
+                    print(f"[done] {name}")
+                except Exception as e:
+                    print(f"[failed] {name}: {e}")
+                    failed.append(name)
+    state.save()
+    print(f"{counts['up to date']} tasks up to date, {counts['run']} {'to run' if dry_run else 'run'}, {len(failed)} failed or skipped")
+    return failed
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--study', '-study', help='directory of trait subdirectories with input summary statistics')
+    parser.add_argument('--study_random', '-study_random', help='directory of the uniform p-values of the permutations')
+    parser.add_argument('--modules', '-modules', help='directory of the network module files')
+    parser.add_argument('--num_permutations', '-num_permutations', type=int, default=200, help='number of permutations')
+    parser.add_argument('--FDR_threshold', '-FDR_threshold', type=float, default=0.05, help='FDR threshold cutoff')
+    parser.add_argument('--percentile_threshold', '-percentile_threshold', type=float, default=99, help='percentile threshold cutoff')
+    parser.add_argument('--nxf_config', '-nxf_config', default=os.path.join(ROOT_PATH, "conf", "fishnet.config"), help='nextflow config')
+    parser.add_argument('--nextflow_args', '-nextflow_args', default="", help='extra arguments of every Nextflow run')
+    parser.add_argument('--python', '-python', default="python3", help='command running python3 with the FISHNET dependencies')
+    parser.add_argument('--root_seed', '-root_seed', type=int, default=None, help='run virtual permutations from this root seed')
+    parser.add_argument('--rank_matrix', '-rank_matrix', action='store_true', help='build the rank matrix of the permutations')
+    parser.add_argument('--batch_traits', '-batch_traits', action='store_true', help='run the original run of every trait in one Nextflow run')
+    parser.add_argument('--jobs', '-jobs', type=int, default=1, help='maximum number of tasks running at once')
+    parser.add_argument('--dry_run', '-dry_run', action='store_true', help='print the tasks that would run')
+    parser.add_argument('--force', '-force', action='append', default=[], help='run the tasks matching this pattern even if up to date')
+    args = parser.parse_args()
+
+    tasks = build_dag(study_path = args.study, study_random_path = args.study_random, module_path = args.modules,
+                      num_permutations = args.num_permutations, fdr_threshold = args.FDR_threshold,
+                      percentile_threshold = args.percentile_threshold, nxf_config = args.nxf_config,
+                      python = shlex.split(args.python), nextflow_args = shlex.split(args.nextflow_args),
+                      root_seed = args.root_seed, rank_matrix = args.rank_matrix, batch_traits = args.batch_traits)
+    state = DagState(RESULTS_PATH)
+    # the driver is not run inside stageTelemetry: its record would span every task, count the CPU time of the tasks
+    # again (children included) and hide the critical path. The python tasks record their own stages with FISHNET_TELEMETRY
+    failed = run_dag(tasks, state, jobs = args.jobs, dry_run = args.dry_run, force = args.force)
+    sys.exit(1 if failed else 0)
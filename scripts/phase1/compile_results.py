@@ -1,34 +1,160 @@
-import pandas as pd
 import argparse
+import csv
+import heapq
+import math
 import os
+import shutil
+import tempfile
+from contextlib import ExitStack
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
 
 # after including Coexpression network in the pipeline, the number of summary slices causes some issue
 # hence, I decided to run this script separately after the pipeline is finished to generate a summary file.
+#
+# Slices are compiled as a streaming k-way merge: every slice is sorted on its own (one slice is one
+# trait x network, so it fits in memory), then at most FAN_IN sorted runs are merged at a time while writing.
+# Memory is bounded by one slice plus one row per open run, regardless of the number of slices.
+# The basenames of compiled slices are recorded next to the summary, so --append only merges new slices
+# into an existing summary.
+
+SORT_COLUMN = "moduleBonPval"
+FAN_IN = 256
+MANIFEST_SUFFIX = ".slices"
 
 def get_csv_files(dirPath):
     """Return a list of all csv files in the given directory path."""
     return [os.path.join(dirPath, filename) for filename in os.listdir(dirPath) if filename.endswith('.csv')]
 
-def concatenate_csv(dirPath, identifier:str, output_dir="."):
-    # List all CSV files in the given directory
-    file_paths = get_csv_files(dirPath)
+def sort_key(value:str):
+    """Ascending float order of a moduleBonPval field, missing values last."""
+    pval = float(value) if value != "" else math.nan
+    return (math.isnan(pval), pval)
+
+def read_header(file_path):
+    with open(file_path, newline="") as f:
+        return next(csv.reader(f), None)
+
+def iter_rows(file_path, stack:ExitStack):
+    """Stream the rows of a csv file after its header. The file is closed by stack."""
+    f = stack.enter_context(open(file_path, newline=""))
+    reader = csv.reader(f)
+    next(reader, None)
+    return reader
+
+def write_rows(output_path, header, rows):
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def sorted_run(file_path, key_index:int, run_dir:str):
+    """Return file_path if its rows are sorted by the sort column, else write a sorted copy into run_dir."""
+    with ExitStack() as stack:
+        rows = list(iter_rows(file_path, stack))
+    keys = [sort_key(row[key_index]) for row in rows]
+    if all(keys[i] <= keys[i+1] for i in range(len(keys) - 1)):
+        return file_path
+    order = sorted(range(len(rows)), key=keys.__getitem__)
+    run_path = os.path.join(run_dir, f"sorted_{os.path.basename(file_path)}")
+    write_rows(run_path, read_header(file_path), (rows[i] for i in order))
+    return run_path
+
+def merge_runs(run_paths, header, key_index:int, output_path:str):
+    """k-way merge of sorted runs into output_path. Ties keep the order of run_paths."""
+    with ExitStack() as stack:
+        runs = [iter_rows(run_path, stack) for run_path in run_paths]
+        write_rows(output_path, header, heapq.merge(*runs, key=lambda row: sort_key(row[key_index])))
+
+def compile_slices(slice_paths, output_path:str, existing_summary:str = None, fan_in:int = FAN_IN):
+    """
+    Merge summary slices (and an already compiled summary) into one summary sorted by moduleBonPval.
+
+    Args:
+        slice_paths (list): master_summary_slice csv files
+        output_path (str): path of the compiled summary. May be existing_summary itself.
+        existing_summary (str): previously compiled summary to merge the slices into, or None
+        fan_in (int): maximum number of runs merged at once, i.e. open files
 
-    # Read the CSV files and store them in a list
-    data_frames = [pd.read_csv(file_path) for file_path in file_paths]
+    Returns:
+        list of the slice paths that were compiled. Empty slice files are skipped.
+    """
+    fan_in = max(fan_in, 2)
+    runs = [existing_summary] if existing_summary is not None else []
+    compiled = []
+    header = read_header(existing_summary) if existing_summary is not None else None
+    run_dir = tempfile.mkdtemp(prefix=".compile_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        for slice_path in slice_paths:
+            slice_header = read_header(slice_path)
+            if slice_header is None:
+                print(f"\tSkipping empty slice {slice_path}")
+                continue
+            if header is None:
+                header = slice_header
+            elif slice_header != header:
+                raise ValueError(f"{slice_path} has columns {slice_header}, expected {header}")
+            runs.append(sorted_run(slice_path, header.index(SORT_COLUMN), run_dir))
+            compiled.append(slice_path)
+        if header is None:
+            raise ValueError("no summary slices to compile")
+        key_index = header.index(SORT_COLUMN)
 
-    # Concatenate the data frames vertically
-    concatenated_df = pd.concat(data_frames, ignore_index=True)
+        # merge passes until the remaining runs fit in one merge
+        merge_pass = 0
+        while len(runs) > fan_in:
+            merged = []
+            for start in range(0, len(runs), fan_in):
+                merged_path = os.path.join(run_dir, f"merge_{merge_pass}_{start // fan_in}.csv")
+                merge_runs(runs[start:start + fan_in], header, key_index, merged_path)
+                merged.append(merged_path)
+            runs = merged
+            merge_pass += 1
 
-    # Sort the concatenated dataframe by 'moduleBonPval' in ascending order
-    concatenated_df = concatenated_df.sort_values(by="moduleBonPval", ascending=True)
+        # written next to the output first, so an existing summary is only replaced once the merge succeeded
+        final_path = os.path.join(run_dir, "final.csv")
+        merge_runs(runs, header, key_index, final_path)
+        os.replace(final_path, output_path)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return compiled
+
+def read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return set()
+    with open(manifest_path) as f:
+        return set(line.strip() for line in f if line.strip())
+
+def concatenate_csv(dirPath, identifier:str, output_dir=".", append:bool = False, fan_in:int = FAN_IN):
+    # List all CSV files in the given directory
+    file_paths = sorted(get_csv_files(dirPath))
 
     # Define name of the output
     outputFileName = f"master_summary_{identifier}.csv"
-
-    # Save the concatenated data frame to an output CSV file
     outputFilePath = os.path.join(output_dir, f"{outputFileName}")
-    print(f"\tSaving results for run \"{identifier}\" to {outputFilePath}")
-    concatenated_df.to_csv(outputFilePath, index=False)
+    manifestPath = outputFilePath + MANIFEST_SUFFIX
+
+    existing_summary = None
+    # a summary without a manifest cannot tell which slices it holds, so it is recompiled
+    if append and os.path.exists(outputFilePath) and os.path.exists(manifestPath):
+        # only slices that are not in the compiled summary yet
+        compiledSlices = read_manifest(manifestPath)
+        file_paths = [file_path for file_path in file_paths if os.path.basename(file_path) not in compiledSlices]
+        if len(file_paths) == 0:
+            print(f"\tNo new slices for run \"{identifier}\", {outputFilePath} is up to date")
+            return
+        existing_summary = outputFilePath
+        print(f"\tAppending {len(file_paths)} slices for run \"{identifier}\" to {outputFilePath}")
+    else:
+        compiledSlices = set()
+        print(f"\tSaving results for run \"{identifier}\" to {outputFilePath}")
+
+    compiled = compile_slices(file_paths, outputFilePath, existing_summary, fan_in)
+    countRows("slices", len(file_paths))
+    with open(manifestPath, "w") as f:
+        for slice_name in sorted(compiledSlices.union(os.path.basename(file_path) for file_path in compiled)):
+            f.write(f"{slice_name}\n")
 
 if __name__ == "__main__":
     # Argument parsing
@@ -36,8 +162,9 @@ if __name__ == "__main__":
     parser.add_argument('--dirPath', type=str, help='path to a parent directory containing all the CSV files to be concatenated')
     parser.add_argument("--identifier", type=str, help='string to identify the run, ex) cmaLLFS, cmaFHS')
     parser.add_argument("--output", type=str, help="path to save results")
+    parser.add_argument("--append", action="store_true", help="merge only slices not compiled yet into the existing summary")
+    parser.add_argument("--fanIn", type=int, default=FAN_IN, help="maximum number of sorted slices merged at once")
     args = parser.parse_args()
-
-
-    # Call the concatenate_csv function with the read file paths
-    concatenate_csv(args.dirPath, args.identifier, args.output)
+    with stageTelemetry():
+        # Call the concatenate_csv function with the read file paths
+        concatenate_csv(args.dirPath, args.identifier, args.output, args.append, args.fanIn)
@@ -6,6 +6,9 @@ import os
 from pathlib import Path
 import math
 import scipy.stats as stats
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "nextflow", "bin"))
+from telemetry import stageTelemetry
 
 # python dc_rp_genes.py --genes_filepath /scratch/mblab/acharyas/fishnet/pipeline/data/pvals/maleWC/0-maleWC.csv
 
@@ -44,4 +47,5 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument('--genes_filepath', '-genes_filepath')
     args = parser.parse_args()
-    dc_rp_genes(genes_filepath = args.genes_filepath)
+    with stageTelemetry():
+        dc_rp_genes(genes_filepath = args.genes_filepath)
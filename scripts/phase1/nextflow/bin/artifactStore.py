@@ -0,0 +1,52 @@
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Content-addressed store of phase 1 intermediate files.
+# The Module and GO files of a network are the same for every permutation, and the GS file of a permutation is the
+# same for every network. Each distinct content is written once to <storeDir>/<hash[:2]>/<hash><extension>, and task
+# outputs are hardlinks to it, so the work and results directories hold one copy of every distinct file.
+# Hardlinks need the store on the same filesystem as the task directories; otherwise outputs fall back to copies.
+
+class ArtifactStore:
+
+    def __init__(self, storeDir:str):
+        self.storeDir = storeDir
+        self.written = 0
+        self.linked = 0
+        os.makedirs(storeDir, exist_ok=True)
+
+    def path(self, digest:str, extension:str) -> str:
+        return os.path.join(self.storeDir, digest[:2], f"{digest}{extension}")
+
+    def put(self, content:bytes, extension:str = "") -> str:
+        """Store content once and return its path in the store."""
+        digest = hashlib.sha256(content).hexdigest()
+        objectPath = self.path(digest, extension)
+        if os.path.exists(objectPath):
+            return objectPath
+        objectDir = os.path.dirname(objectPath)
+        os.makedirs(objectDir, exist_ok=True)
+        # concurrent tasks writing the same content replace it with identical bytes
+        fd, tmpPath = tempfile.mkstemp(dir=objectDir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.chmod(tmpPath, 0o444)
+        os.replace(tmpPath, objectPath)
+        self.written += 1
+        return objectPath
+
+    def write(self, OUTPUTPATH:str, text:str) -> None:
+        """Write text to OUTPUTPATH as a hardlink to its object in the store."""
+        objectPath = self.put(text.encode(), os.path.splitext(OUTPUTPATH)[1])
+        if os.path.lexists(OUTPUTPATH):
+            os.remove(OUTPUTPATH)
+        try:
+            os.link(objectPath, OUTPUTPATH)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copyfile(objectPath, OUTPUTPATH)
+        self.linked += 1
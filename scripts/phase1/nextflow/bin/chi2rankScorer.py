@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import chi2
+from telemetry import countRows
+
+# Rank-chi2 module scoring of many score vectors at once, as PascalX pathway.chi2rank(fuse=False).
+#
+# chi2rank ranks the gene p-values of one score file, turns the rank r (1 = most significant) of each of the
+# N scored genes into the uniform p-value r / (N + 1) (tied p-values ranked in the gene order of the score file),
+# and scores a module of n scored genes with
+#   pval = chi2.sf(sum over module genes of chi2.isf(r / (N + 1), df=1), df=n)
+# The chi2 statistic of a gene only depends on its rank, so it is looked up in a table of N values instead of
+# computed per gene and score vector. With a genes x vectors rank matrix, the module statistics of every vector are
+# one sparse (modules x genes) membership product, so all permutations of a trait are scored in one call.
+# Permutations shuffle the gene column of a trait, so they share the gene universe and the modules.
+#
+# validate_chi2rank.py in test/ compares the scores to PascalX on the test networks. It needs PascalX (the
+# jungwooseok/mea_pascal container). Until it has passed there, the pipeline does not use the matrix scorer: only
+# runPascal.py --scorer matrix, run by hand, does.
+
+def readScores(GSPATH:str) -> pd.Series:
+    """Gene p-values of a processed gene score file (gene, pval per line, no header). A repeated gene keeps its last pval, as PascalX."""
+    # gene symbols are read verbatim, e.g. NA is not a missing gene
+    df = pd.read_table(GSPATH, header=None, usecols=[0, 1], names=["gene", "pval"], dtype={"gene": str},
+                       keep_default_na=False, na_values={"pval": ["", "NA", "NaN", "nan"]})
+    return df.drop_duplicates("gene", keep="last").set_index("gene")["pval"]
+
+def readProcessedModules(MODULEPATH:str) -> List[Tuple[str, List[str]]]:
+    """(module name, genes) of a processed module file (module index, genes... per line)."""
+    modules = []
+    with open(MODULEPATH, "r") as f:
+        for line in f:
+            columns = line.rstrip("\n").split("\t")
+            if columns[0]:
+                modules.append((columns[0], [gene for gene in columns[1:] if gene]))
+    return modules
+
+def uniformRankPvals(numGenes:int) -> np.ndarray:
+    """Uniform p-value r / (N + 1) of every rank r = 1..N."""
+    return np.arange(1, numGenes + 1) / (numGenes + 1)
+
+def rankMatrix(scores:np.ndarray) -> np.ndarray:
+    """
+    0-based rank of every gene within each column of a genes x vectors p-value matrix, ties in gene order.
+
+    Args:
+        scores (np.ndarray): genes x vectors p-values
+
+    Returns:
+        np.ndarray of the same shape, rank 0 being the smallest p-value of the column
+    """
+    order = np.argsort(scores, axis=0, kind="stable")
+    ranks = np.empty(scores.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.arange(scores.shape[0], dtype=np.int64)[:, None], axis=0)
+    return ranks
+
+def moduleMembership(modules:List[Tuple[str, List[str]]], genes:List[str]) -> Tuple[sparse.csr_matrix, List[List[str]]]:
+    """
+    Sparse modules x genes membership of the scored genes of every module.
+
+    Returns:
+        (membership matrix, scored genes of every module in module order). A gene listed twice in a module counts once.
+    """
+    geneIds = {gene: i for i, gene in enumerate(genes)}
+    indptr = [0]
+    indices = []
+    scoredGenes = []
+    for moduleName, moduleGenes in modules:
+        scored = [gene for gene in dict.fromkeys(moduleGenes) if gene in geneIds]
+        indices.extend(geneIds[gene] for gene in scored)
+        indptr.append(len(indices))
+        scoredGenes.append(scored)
+    membership = sparse.csr_matrix((np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+                                   shape=(len(modules), len(genes)))
+    return membership, scoredGenes
+
+def scoreModules(scores:np.ndarray, membership:sparse.csr_matrix, geneIds:np.ndarray = None) -> np.ndarray:
+    """
+    chi2rank p-value of every module against every score vector.
+
+    Args:
+        scores (np.ndarray): genes x vectors p-values. Tied p-values are ranked in row order
+        membership (sparse.csr_matrix): modules x genes membership (moduleMembership)
+        geneIds (np.ndarray): membership column of every entry of scores, so every vector can keep the gene order of
+            its score file. The rows of scores are the membership columns if None
+
+    Returns:
+        np.ndarray of modules x vectors p-values. Modules without a scored gene get nan
+    """
+    scores = np.asarray(scores, dtype=float)
+    if scores.ndim == 1:
+        scores = scores[:, None]
+    statistic = chi2.isf(uniformRankPvals(scores.shape[0]), 1)[rankMatrix(scores)]
+    if geneIds is not None:
+        geneStatistic = np.empty_like(statistic)
+        np.put_along_axis(geneStatistic, np.asarray(geneIds).reshape(statistic.shape), statistic, axis=0)
+        statistic = geneStatistic
+    moduleStatistic = np.asarray(membership @ statistic)
+    moduleSizes = np.diff(membership.indptr)[:, None]
+    with np.errstate(invalid="ignore"):
+        pvals = chi2.sf(moduleStatistic, np.maximum(moduleSizes, 1))
+    pvals[np.broadcast_to(moduleSizes == 0, pvals.shape)] = np.nan
+    return pvals
+
+def scoreSeries(scores:List[pd.Series], modules:List[Tuple[str, List[str]]]) -> Tuple[np.ndarray, List[List[str]]]:
+    """
+    Score modules against score vectors of the same genes in one call.
+
+    Args:
+        scores (list): gene p-values indexed by gene, one pd.Series per score vector (e.g. permutation) in the gene
+            order of its score file, which breaks ties as a per-file ranking does
+        modules (list): (module name, genes) of every module
+
+    Returns:
+        (modules x vectors p-values, scored genes of every module)
+    """
+    genes = scores[0].index
+    membership, scoredGenes = moduleMembership(modules, list(genes))
+    geneIds = np.column_stack([genes.get_indexer(vector.index) for vector in scores])
+    if (geneIds < 0).any() or any(len(vector) != len(genes) for vector in scores):
+        raise ValueError("score vectors scored in one call must have the same genes")
+    countRows("modules", len(modules))
+    countRows("scoreVectors", len(scores))
+    return scoreModules(np.column_stack([vector.to_numpy(dtype=float) for vector in scores]), membership, geneIds), scoredGenes
+
+def moduleResultToJSON(moduleName:str, genes:List[str], pval:float) -> str:
+    """One module result in the JSON line format of runPascal.py --format jsonl."""
+    return json.dumps({"moduleIndex": int(str(moduleName).replace("'", "")),
+                       "genes": genes,
+                       "pval": None if np.isnan(pval) else float(pval)})
+
+def scorePairs(pairs:List[Tuple[str, str]], outputPath:str) -> List[str]:
+    """
+    Score (scoreFile, moduleFile) pairs, every group of score files with the same module file and the same genes
+    (e.g. the permutations of a trait) in one call, and write a runPascal.py jsonl output per score file.
+
+    Args:
+        pairs (list): (scoreFile, moduleFile) of pairScoreAndModuleFiles in runPascal.py
+        outputPath (str): path to the output directory
+
+    Returns:
+        list of the output file names
+    """
+    groups = {}
+    for scoreFile, moduleFile in pairs:
+        scores = readScores(scoreFile)
+        with open(moduleFile, "rb") as f:
+            moduleKey = hashlib.sha1(f.read()).hexdigest()
+        geneKey = hashlib.sha1("\n".join(sorted(scores.index)).encode()).hexdigest()
+        groups.setdefault((moduleKey, geneKey), (moduleFile, []))[1].append((scoreFile, scores))
+
+    fileNames = []
+    for moduleFile, scoreFiles in groups.values():
+        modules = readProcessedModules(moduleFile)
+        pvals, scoredGenes = scoreSeries([scores for _, scores in scoreFiles], modules)
+        for column, (scoreFile, _) in enumerate(scoreFiles):
+            fileName = os.path.basename(scoreFile).replace("tsv", "txt").replace("GS_", "")
+            with open(os.path.join(outputPath, fileName), "w") as f:
+                for row, (moduleName, _) in enumerate(modules):
+                    f.write(moduleResultToJSON(moduleName, scoredGenes[row], pvals[row, column]) + "\n")
+            fileNames.append(fileName)
+    return fileNames
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import numpy as np
+from telemetry import countRows, stageTelemetry
+
+# Compiled form of a network module file (module index, score, genes... per line).
+# <moduleFileDir>/.compiled/<network>/ holds
+#   genes.npy        interned gene symbols (fixed-width unicode), in order of first appearance
+#   moduleIndex.npy  module index of every module, in file order
+#   indptr.npy       CSR row pointers: genes of module i are indices[indptr[i]:indptr[i+1]]
+#   indices.npy      gene ids (rows of genes.npy) of every module, in file order
+#   source.json      size and mtime of the module file it was compiled from, and the format version
+# Every array is memory-mapped, so loading a network reads nothing up front, and only the modules a stage looks up
+# are turned into gene symbols.
+# loadNetwork returns None for a module file without an up to date compiled form, and callers parse the text file.
+
+COMPILED_DIR = ".compiled"
+# part of source.json, change it whenever the files of the compiled form change
+FORMAT_VERSION = 2
+
+def compiledNetworkPath(MODULEPATH:str) -> str:
+    """Directory of the compiled form of a module file. Symlinked module files resolve to their target."""
+    MODULEPATH = os.path.realpath(MODULEPATH)
+    network = os.path.splitext(os.path.basename(MODULEPATH))[0]
+    return os.path.join(os.path.dirname(MODULEPATH), COMPILED_DIR, network)
+
+def sourceStamp(MODULEPATH:str) -> dict:
+    stat = os.stat(MODULEPATH)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def compiledStamp(MODULEPATH:str) -> dict:
+    return dict(sourceStamp(MODULEPATH), format=FORMAT_VERSION)
+
+class CompiledNetwork:
+    """Memory-mapped modules of one network."""
+
+    def __init__(self, COMPILEDPATH:str):
+        self.genes = np.load(os.path.join(COMPILEDPATH, "genes.npy"), mmap_mode="r")
+        self.moduleIndex = np.load(os.path.join(COMPILEDPATH, "moduleIndex.npy"), mmap_mode="r")
+        self.indptr = np.load(os.path.join(COMPILEDPATH, "indptr.npy"), mmap_mode="r")
+        self.indices = np.load(os.path.join(COMPILEDPATH, "indices.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.moduleIndex)
+
+    def geneIds(self, row:int) -> np.ndarray:
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def moduleGenes(self, row:int) -> List[str]:
+        return self.genes[self.geneIds(row)].tolist()
+
+    def modules(self) -> Iterator[Tuple[int, List[str]]]:
+        """(module index, module genes) of every module in file order."""
+        # one gather of every module gene, then list slices, instead of one numpy scalar lookup per gene
+        genes = self.genes[self.indices].tolist()
+        bounds = self.indptr.tolist()
+        for row, moduleIndex in enumerate(self.moduleIndex.tolist()):
+            yield moduleIndex, genes[bounds[row]:bounds[row + 1]]
+
+    def modulesOf(self, moduleIndices:Iterable[int]) -> Iterator[Tuple[int, List[str]]]:
+        """(module index, module genes) of the modules with one of moduleIndices, in file order."""
+        rows = np.flatnonzero(np.isin(self.moduleIndex, np.fromiter((int(i) for i in moduleIndices), dtype=np.int64)))
+        for row in rows.tolist():
+            yield int(self.moduleIndex[row]), self.moduleGenes(row)
+
+    def moduleRows(self) -> Dict[int, int]:
+        """Module index -> row of every module. A repeated module index maps to its last row, as dict(modules())."""
+        return {moduleIndex: row for row, moduleIndex in enumerate(self.moduleIndex.tolist())}
+
+    def moduleMap(self) -> "ModuleGenes":
+        return ModuleGenes(self)
+
+    def rowOf(self, moduleIndex:int) -> Optional[int]:
+        rows = np.flatnonzero(self.moduleIndex == int(moduleIndex))
+        return int(rows[0]) if len(rows) > 0 else None
+
+    def geneSet(self) -> Set[str]:
+        """Genes in any module. Every interned gene is in at least one module."""
+        return set(self.genes.tolist())
+
+class ModuleGenes(Mapping):
+    """Module index -> module genes of a compiled network, as dict(modules()), gathering the genes of a module on access only."""
+
+    def __init__(self, network:CompiledNetwork):
+        self.network = network
+        self.rows = network.moduleRows()
+
+    def __getitem__(self, moduleIndex:int) -> List[str]:
+        return self.network.moduleGenes(self.rows[moduleIndex])
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+def compileNetwork(MODULEPATH:str) -> str:
+    """
+    Compile a module file into its memory-mappable form.
+
+    Args:
+        MODULEPATH (str): path to the module file (module index, score, genes...)
+
+    Returns:
+        path to the compiled network directory
+    """
+    geneIds = {}
+    moduleIndex, indptr, indices = [], [0], []
+    with open(MODULEPATH, "r") as f:
+        for line in f:
+            columns = line.split()
+            if len(columns) == 0:
+                continue
+            moduleIndex.append(int(columns[0]))
+            # column[1] is always 1.0, so dropped
+            indices.extend(geneIds.setdefault(gene, len(geneIds)) for gene in columns[2:])
+            indptr.append(len(indices))
+
+    COMPILEDPATH = compiledNetworkPath(MODULEPATH)
+    os.makedirs(COMPILEDPATH, exist_ok=True)
+    # source.json is written last, so an interrupted compile is never mistaken for an up to date one
+    stampPath = os.path.join(COMPILEDPATH, "source.json")
+    if os.path.exists(stampPath):
+        os.remove(stampPath)
+    np.save(os.path.join(COMPILEDPATH, "genes.npy"), np.array(list(geneIds), dtype=str))
+    np.save(os.path.join(COMPILEDPATH, "moduleIndex.npy"), np.array(moduleIndex, dtype=np.int64))
+    np.save(os.path.join(COMPILEDPATH, "indptr.npy"), np.array(indptr, dtype=np.int64))
+    np.save(os.path.join(COMPILEDPATH, "indices.npy"), np.array(indices, dtype=np.int32))
+    with open(stampPath, "w") as f:
+        json.dump(compiledStamp(MODULEPATH), f)
+    return COMPILEDPATH
+
+def loadNetwork(MODULEPATH:str) -> Optional[CompiledNetwork]:
+    """Compiled form of a module file, or None if it was not compiled or the module file changed since."""
+    COMPILEDPATH = compiledNetworkPath(MODULEPATH)
+    stampPath = os.path.join(COMPILEDPATH, "source.json")
+    if not os.path.exists(stampPath):
+        return None
+    with open(stampPath, "r") as f:
+        if json.load(f) != compiledStamp(MODULEPATH):
+            return None
+    return CompiledNetwork(COMPILEDPATH)
+
+def main():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description="Compile every network module file of a directory into its memory-mappable form.")
+
+    # Add arguments to parser
+    parser.add_argument("moduleFileDir", help="Path to the directory of network module files (.txt).")
+    parser.add_argument("--force", action="store_true", help="Recompile networks with an up to date compiled form.")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    for file in sorted(os.listdir(args.moduleFileDir)):
+        if not file.endswith(".txt"):
+            continue
+        MODULEPATH = os.path.join(args.moduleFileDir, file)
+        if not args.force and loadNetwork(MODULEPATH) is not None:
+            print(f"{file} is up to date")
+            continue
+        print(f"compiled {file} to {compileNetwork(MODULEPATH)}")
+        countRows("networksCompiled", 1)
+
+if __name__ == "__main__":
+    with stageTelemetry():
+        main()
@@ -3,6 +3,7 @@ import os
 import re
 from typing import List
 import pandas as pd
+from telemetry import countRows, stageTelemetry
 
 def countGOterms(DIRPATH:str)-> int:
     df = pd.read_csv(DIRPATH)
@@ -85,7 +86,9 @@ def main():
     df_merge.fillna("NA", inplace=True)
     mergedFileName = f"{study}_{trait}_{network}.csv"
     df_merge.to_csv(os.path.join(args.output_directory, mergedFileName), index=False)
+    countRows("mergedRows", df_merge.shape[0])
     
 
 if __name__ == "__main__":
-    main()
+    with stageTelemetry():
+        main()
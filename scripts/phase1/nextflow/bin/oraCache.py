@@ -0,0 +1,136 @@
+import hashlib
+import os
+import tempfile
+from typing import Iterable, Optional
+
+# Content-addressed cache of ORA summaries shared by every GO_ANALYSIS task of a study.
+# Permutations only shuffle pvals, so the background genes of a network and the genes of a module are the same in
+# every permutation a module comes up significant in. A summary is stored under the hash of everything it depends on:
+# module gene set, background gene set, annotation, database, method and its parameters.
+# Entries are written atomically, so concurrent tasks can share a cache directory. Every put appends the size change to
+# a journal (<cacheDir>/sizes.log), so the size of the cache is known without a stat of every entry. Only once the
+# journal exceeds the size limit are the entries scanned and the least recently used ones removed, down to a low-water
+# mark so the next tasks do not scan again right away. The scan also replaces the journal by the exact size.
+
+CACHE_EXTENSION = ".csv"
+SIZE_JOURNAL = "sizes.log"
+# fraction of the size limit left after an eviction
+LOW_WATER = 0.9
+
+def hashGeneSet(genes:Iterable[str]) -> str:
+    """Digest of a gene set, independent of gene order and duplicates."""
+    digest = hashlib.sha256()
+    for gene in sorted(set(genes)):
+        digest.update(gene.encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+def hashFile(FILEPATH:str) -> str:
+    digest = hashlib.sha256()
+    with open(FILEPATH, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ORACache:
+    """ORA summaries stored as <cacheDir>/<key[:2]>/<key>.csv."""
+
+    def __init__(self, cacheDir:str, maxBytes:int):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cacheDir, exist_ok=True)
+
+    @staticmethod
+    def key(moduleGenesHash:str, backgroundGenesHash:str, annotationHash:str, database:str, method:str) -> str:
+        """Cache key of one ORA call. method should also hold every parameter changing the result."""
+        return hashlib.sha256("\n".join([moduleGenesHash, backgroundGenesHash, annotationHash, database, method]).encode()).hexdigest()
+
+    def journalPath(self) -> str:
+        return os.path.join(self.cacheDir, SIZE_JOURNAL)
+
+    def path(self, key:str) -> str:
+        return os.path.join(self.cacheDir, key[:2], f"{key}{CACHE_EXTENSION}")
+
+    def get(self, key:str) -> Optional[bytes]:
+        """Cached summary of key, or None. A hit marks the entry as recently used."""
+        entryPath = self.path(key)
+        try:
+            with open(entryPath, "rb") as f:
+                content = f.read()
+            os.utime(entryPath)
+        except FileNotFoundError:
+            # never cached, or evicted by another task
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def put(self, key:str, content:bytes) -> None:
+        entryDir = os.path.dirname(self.path(key))
+        os.makedirs(entryDir, exist_ok=True)
+        # readers never see a partial entry
+        fd, tmpPath = tempfile.mkstemp(dir=entryDir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        try:
+            previousBytes = os.stat(self.path(key)).st_size
+        except FileNotFoundError:
+            previousBytes = 0
+        os.replace(tmpPath, self.path(key))
+        # one small O_APPEND write, so concurrent tasks do not interleave their lines
+        fd = os.open(self.journalPath(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, f"{len(content) - previousBytes}\n".encode())
+        finally:
+            os.close(fd)
+
+    def trackedBytes(self) -> Optional[int]:
+        """Size of the cache according to the journal, or None without a journal (a cache of an older version)."""
+        try:
+            with open(self.journalPath(), "r") as f:
+                return sum(int(line) for line in f if line.strip())
+        except FileNotFoundError:
+            return None
+
+    def evict(self) -> int:
+        """
+        Remove least recently used entries once the journal exceeds maxBytes, until the cache fits in LOW_WATER * maxBytes.
+        The journal is an estimate (puts of other tasks during a scan are not counted), so the scan measures the entries.
+
+        Returns:
+            the number of removed entries
+        """
+        trackedBytes = self.trackedBytes()
+        if trackedBytes is not None and trackedBytes <= self.maxBytes:
+            return 0
+        entries = []
+        totalBytes = 0
+        for entryDir in os.scandir(self.cacheDir):
+            if not entryDir.is_dir():
+                continue
+            for entry in os.scandir(entryDir.path):
+                if not entry.name.endswith(CACHE_EXTENSION):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                totalBytes += stat.st_size
+        removed = 0
+        for _, size, entryPath in sorted(entries):
+            if totalBytes <= self.maxBytes * LOW_WATER:
+                break
+            try:
+                os.remove(entryPath)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            totalBytes -= size
+        fd, tmpPath = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{totalBytes}\n")
+        os.replace(tmpPath, self.journalPath())
+        return removed
@@ -0,0 +1,276 @@
+import argparse
+import os
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.stats import hypergeom
+from oraCache import ORACache, hashFile, hashGeneSet
+from telemetry import countRows, stageTelemetry
+
+# Python over-representation analysis of significant modules against a local GO Biological Process snapshot.
+# It follows the ORA of WebGestaltR as called by ORA_cmd.R:
+#   - the reference (background) genes are the ones annotated in any term of the database, whatever the term size
+#   - the annotation is restricted to the reference genes, and terms with 10..500 reference genes are tested
+#   - interesting genes are the module genes that are reference genes
+#   - pValue is the hypergeometric upper tail, FDR is BH over every tested term, terms with FDR < 0.05 are reported
+#   - reported terms are reduced to the exemplars of affinity propagation on the Jaccard similarity of their overlaps
+# All modules of a GO background file are scored at once: overlaps are one sparse (modules x genes) @ (genes x terms) product.
+# With --cacheDir, summaries are looked up in a content-addressed cache (oraCache.py) first and only new modules are scored.
+
+DATABASE = "geneontology_Biological_Process"
+MIN_NUM = 10
+MAX_NUM = 500
+FDR_THRESHOLD = 0.05
+# part of the cache key, change it whenever the summaries of the same inputs change
+METHOD = f"ORA;minNum={MIN_NUM};maxNum={MAX_NUM};fdr={FDR_THRESHOLD};affinityPropagation;reference=annotatedInAnyTerm"
+SUMMARY_COLUMNS = ["geneSet", "description", "size", "overlap", "expect", "enrichmentRatio", "pValue", "FDR", "overlapId", "userId", "database"]
+
+def readGMT(GMTPATH:str) -> Tuple[List[str], List[str], List[List[str]]]:
+    """
+    Read a gene set snapshot in GMT format: term id, description (or link), genes... per line.
+
+    Returns:
+        term ids, term descriptions, genes of every term
+    """
+    terms, descriptions, termGenes = [], [], []
+    with open(GMTPATH, "r") as f:
+        for line in f:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) < 3:
+                continue
+            terms.append(columns[0])
+            descriptions.append(columns[1])
+            termGenes.append([gene for gene in columns[2:] if gene])
+    return terms, descriptions, termGenes
+
+class Annotation:
+    """GO snapshot as a sparse gene x term matrix, loaded once and shared by every background file."""
+
+    def __init__(self, GMTPATH:str):
+        self.terms, self.descriptions, termGenes = readGMT(GMTPATH)
+        geneIds = {}
+        rows, cols = [], []
+        for termIndex, genes in enumerate(termGenes):
+            for gene in set(genes):
+                rows.append(geneIds.setdefault(gene, len(geneIds)))
+                cols.append(termIndex)
+        self.genes = np.array(list(geneIds), dtype=object)
+        self.geneIds = geneIds
+        self.matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(geneIds), len(self.terms)))
+
+def readGeneList(FILEPATH:str) -> List[str]:
+    with open(FILEPATH, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def benjaminiHochberg(pvals:np.ndarray, numTests:int) -> np.ndarray:
+    """BH adjusted pvals of the given pvals out of numTests tests; the untested ones have pval 1 and cannot lower them."""
+    order = np.argsort(pvals, kind="mergesort")
+    ranked = pvals[order] * numTests / np.arange(1, len(pvals) + 1)
+    adjusted = np.empty_like(ranked)
+    adjusted[order] = np.minimum(1.0, np.minimum.accumulate(ranked[::-1])[::-1])
+    return adjusted
+
+def affinityPropagation(similarity:np.ndarray, preference:np.ndarray, damping:float = 0.9, maxIterations:int = 1000, convergenceIterations:int = 100) -> np.ndarray:
+    """
+    Exemplars of affinity propagation (Frey & Dueck 2007) with the defaults of the apcluster R package.
+
+    Args:
+        similarity (np.ndarray): n x n similarities
+        preference (np.ndarray): self-similarity of every point
+
+    Returns:
+        indices of the exemplars
+    """
+    n = similarity.shape[0]
+    S = similarity.astype(float).copy()
+    S[np.diag_indices(n)] = preference
+    R = np.zeros((n, n))
+    A = np.zeros((n, n))
+    unchanged = 0
+    exemplars = np.zeros(n, dtype=bool)
+    for _ in range(maxIterations):
+        # responsibilities
+        AS = A + S
+        best = np.argmax(AS, axis=1)
+        first = AS[np.arange(n), best]
+        AS[np.arange(n), best] = -np.inf
+        second = np.max(AS, axis=1)
+        newR = S - first[:, None]
+        newR[np.arange(n), best] = S[np.arange(n), best] - second
+        R = damping * R + (1 - damping) * newR
+        # availabilities
+        Rp = np.maximum(R, 0)
+        Rp[np.diag_indices(n)] = R[np.diag_indices(n)]
+        newA = np.sum(Rp, axis=0)[None, :] - Rp
+        diagonal = newA[np.diag_indices(n)].copy()
+        newA = np.minimum(newA, 0)
+        newA[np.diag_indices(n)] = diagonal
+        A = damping * A + (1 - damping) * newA
+
+        newExemplars = (np.diag(A) + np.diag(R)) > 0
+        unchanged = unchanged + 1 if np.array_equal(newExemplars, exemplars) else 0
+        exemplars = newExemplars
+        if unchanged >= convergenceIterations and exemplars.any():
+            break
+    if not exemplars.any():
+        return np.array([int(np.argmax(np.diag(A) + np.diag(R)))])
+    return np.flatnonzero(exemplars)
+
+def representativeTerms(overlapGenes:List[List[str]], pvals:np.ndarray) -> np.ndarray:
+    """Boolean mask of the exemplar terms among the reported terms, as ORA_cmd.R does with WebGestaltR::affinityPropagation."""
+    if len(overlapGenes) <= 1:
+        return np.ones(len(overlapGenes), dtype=bool)
+    geneSets = [set(genes) for genes in overlapGenes]
+    similarity = np.array([[len(a & b) / len(a | b) for b in geneSets] for a in geneSets])
+    minusLogP = -np.log(pvals)
+    minusLogP[np.isinf(minusLogP)] = -np.log(np.finfo(float).eps)
+    mask = np.zeros(len(overlapGenes), dtype=bool)
+    mask[affinityPropagation(similarity, minusLogP)] = True
+    return mask
+
+def oraForModules(annotation:Annotation, moduleGenes:Dict[str, List[str]], referenceGenes:List[str],
+                  minNum:int = MIN_NUM, maxNum:int = MAX_NUM, fdrThreshold:float = FDR_THRESHOLD) -> Dict[str, pd.DataFrame]:
+    """
+    ORA of every module against one reference gene list with sparse matrix products.
+
+    Args:
+        annotation (Annotation): GO snapshot
+        moduleGenes (dict): module name -> genes of the module
+        referenceGenes (list): background genes
+
+    Returns:
+        dict of module name -> summary of its reported terms (SUMMARY_COLUMNS), empty if none
+    """
+    # annotated reference genes and the terms with minNum..maxNum of them
+    referenceIds = np.array(sorted(set(annotation.geneIds[gene] for gene in referenceGenes if gene in annotation.geneIds)), dtype=np.int64)
+    reference = annotation.matrix[referenceIds]
+    # as WebGestaltR, the population is every reference gene annotated in the database, before the term size filter
+    isAnnotated = np.asarray(reference.sum(axis=1)).ravel() > 0
+    numReference = int(isAnnotated.sum())
+    sizes = np.asarray(reference.sum(axis=0)).ravel()
+    tested = np.flatnonzero((sizes >= minNum) & (sizes <= maxNum))
+    # genes of a term are one slice of the columns
+    termGenes = reference[:, tested].tocsc()
+    reference = termGenes.tocsr()
+    sizes = sizes[tested]
+    referenceGeneNames = annotation.genes[referenceIds]
+    position = {gene: i for i, gene in enumerate(referenceGeneNames)}
+
+    # modules x annotated reference genes
+    names = list(moduleGenes)
+    rows, cols = [], []
+    for row, name in enumerate(names):
+        for i in set(position[gene] for gene in moduleGenes[name] if gene in position):
+            if isAnnotated[i]:
+                rows.append(row)
+                cols.append(i)
+    modules = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(names), len(referenceIds)))
+    numInterest = np.asarray(modules.sum(axis=1)).ravel()
+    overlaps = (modules @ reference).tocsr()
+
+    summaries = {}
+    for row, name in enumerate(names):
+        start, end = overlaps.indptr[row], overlaps.indptr[row + 1]
+        termColumns = overlaps.indices[start:end]
+        overlap = overlaps.data[start:end].astype(np.int64)
+        if len(overlap) == 0 or numReference == 0:
+            summaries[name] = pd.DataFrame(columns=SUMMARY_COLUMNS)
+            continue
+        size = sizes[termColumns]
+        pValue = hypergeom.sf(overlap - 1, numReference, size, numInterest[row])
+        FDR = benjaminiHochberg(pValue, len(tested))
+        reported = FDR < fdrThreshold
+        if not reported.any():
+            summaries[name] = pd.DataFrame(columns=SUMMARY_COLUMNS)
+            continue
+        termColumns, overlap, size, pValue, FDR = termColumns[reported], overlap[reported], size[reported], pValue[reported], FDR[reported]
+        expect = size * numInterest[row] / numReference
+        moduleRow = modules[row].toarray().ravel().astype(bool)
+        overlapGenes = []
+        for column in termColumns:
+            genesOfTerm = termGenes.indices[termGenes.indptr[column]:termGenes.indptr[column + 1]]
+            overlapGenes.append(sorted(referenceGeneNames[genesOfTerm[moduleRow[genesOfTerm]]]))
+        termIndex = tested[termColumns]
+        summary = pd.DataFrame({"geneSet": [annotation.terms[i] for i in termIndex],
+                                "description": [annotation.descriptions[i] for i in termIndex],
+                                "size": size,
+                                "overlap": overlap,
+                                "expect": expect,
+                                "enrichmentRatio": overlap / expect,
+                                "pValue": pValue,
+                                "FDR": FDR,
+                                "overlapId": [";".join(genes) for genes in overlapGenes],
+                                "userId": [";".join(genes) for genes in overlapGenes],
+                                "database": DATABASE}, columns=SUMMARY_COLUMNS)
+        summary = summary.sort_values(["FDR", "pValue"], kind="mergesort").reset_index(drop=True)
+        summaries[name] = summary[representativeTerms([genes.split(";") for genes in summary["overlapId"]], summary["pValue"].to_numpy())].reset_index(drop=True)
+    return summaries
+
+def summaryCSV(summary:pd.DataFrame) -> bytes:
+    if summary.shape[0] == 0:
+        # same as write.csv(NULL, ...) in ORA_cmd.R
+        return b'""\n'
+    return summary.to_csv(index=False).encode()
+
+def writeSummary(content:bytes, OUTPUTPATH:str) -> None:
+    with open(OUTPUTPATH, "wb") as f:
+        f.write(content)
+
+def main():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description="ORA of every significant module of a directory against a local GO snapshot.")
+
+    # Add arguments to parser
+    parser.add_argument("--sigModuleDir", help="directory having significant modules (sig_*.txt)")
+    parser.add_argument("--backGroundGenesFile", help="file having background genes")
+    parser.add_argument("--summaryRoot", help="directory to save summary")
+    parser.add_argument("--annotation", help="GO Biological Process snapshot in GMT format")
+    parser.add_argument("--cacheDir", default=None, help="directory of the ORA summary cache shared across tasks. No cache if not given")
+    parser.add_argument("--cacheMaxSize", type=int, default=1024, help="size limit of the cache in MB")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if not os.path.exists(args.summaryRoot):
+        os.makedirs(args.summaryRoot)
+
+    moduleGenes = {}
+    for fileName in sorted(os.listdir(args.sigModuleDir)):
+        if fileName.startswith("sig_") and fileName.endswith(".txt"):
+            moduleGenes[fileName[:-len(".txt")]] = readGeneList(os.path.join(args.sigModuleDir, fileName))
+        elif fileName.startswith("dummy_") and fileName.endswith(".txt"):
+            writeSummary(summaryCSV(pd.DataFrame(columns=SUMMARY_COLUMNS)), os.path.join(args.summaryRoot, f"{fileName[:-len('.txt')]}.csv"))
+    referenceGenes = readGeneList(args.backGroundGenesFile)
+
+    # modules tested before, in any permutation, are copied from the cache
+    cache = None
+    cacheKeys = {}
+    if args.cacheDir is not None:
+        cache = ORACache(args.cacheDir, args.cacheMaxSize * 1024 * 1024)
+        backgroundHash = hashGeneSet(referenceGenes)
+        annotationHash = hashFile(args.annotation)
+        for name in list(moduleGenes):
+            cacheKeys[name] = ORACache.key(hashGeneSet(moduleGenes[name]), backgroundHash, annotationHash, DATABASE, METHOD)
+            content = cache.get(cacheKeys[name])
+            if content is not None:
+                writeSummary(content, os.path.join(args.summaryRoot, f"{name}.csv"))
+                del moduleGenes[name]
+
+    if len(moduleGenes) > 0:
+        annotation = Annotation(args.annotation)
+        summaries = oraForModules(annotation, moduleGenes, referenceGenes)
+        for name, summary in summaries.items():
+            content = summaryCSV(summary)
+            writeSummary(content, os.path.join(args.summaryRoot, f"{name}.csv"))
+            if cache is not None:
+                cache.put(cacheKeys[name], content)
+    print(f"ORA of {len(moduleGenes)} modules")
+    countRows("modulesTested", len(moduleGenes))
+    if cache is not None:
+        print(f"{cache.hits} modules from cache {args.cacheDir}, {cache.evict()} cache entries evicted")
+        countRows("modulesFromCache", cache.hits)
+
+if __name__ == "__main__":
+    with stageTelemetry():
+        main()
@@ -1,10 +1,15 @@
 import argparse
 import pandas as pd
 import os
+from typing import Dict, List
+from randomPermutation import permute_scores
+from artifactStore import ArtifactStore
+from compiledNetwork import loadNetwork
+from telemetry import countRows, stageTelemetry
 
 def extractGeneSetFromModuleFile(MODULEPATH:str):
     """
-    Read a module file and extract a set of genes in the file. 
+    Read a module file and extract a set of genes in the file.
     It assumes the input file is tsv format where the gene name starts to appear from the thrid column
 
     Args:
@@ -14,15 +19,82 @@ def extractGeneSetFromModuleFile(MODULEPATH:str):
         _type_: set of genes appear in the module file
     """
     ret = set()
+    for moduleIndex, genes in readModuleFile(MODULEPATH):
+        ret.update(genes)
+    return ret
+
+def readModuleFile(MODULEPATH:str) -> List[tuple]:
+    """
+    Tokenize a module file once, or read its compiled form (compiledNetwork.py) if up to date.
+
+    Args:
+        MODULEPATH (str): path to the module file (module index, score, genes...)
+
+    Returns:
+        list of (module index, list of module genes) in file order. Column[1] is always 1.0, so dropped
+    """
+    network = loadNetwork(MODULEPATH)
+    if network is not None:
+        return [(str(moduleIndex), genes) for moduleIndex, genes in network.modules()]
+    modules = []
     with open(MODULEPATH, "r") as f:
-        lines = f.readlines()
-        for line in lines:
+        for line in f:
             columns = line.split()
-            for column in columns[2:]:
-                ret.add(column)
-    return ret
+            modules.append((columns[0], columns[2:]))
+    return modules
+
+def writeOutput(OUTPUTPATH: str, text: str, store: ArtifactStore = None) -> None:
+    """Write a processed file, as a link to the artifact store if one is given."""
+    if store is not None:
+        store.write(OUTPUTPATH, text)
+    else:
+        with open(OUTPUTPATH, "w") as f:
+            f.write(text)
+
+def processGeneScoreAndModules(df_gs: pd.DataFrame, modules: Dict[str, List[tuple]], OUTPUTPATH: str, pipeline: str, trait: str, geneNameCol: str, pvalCol: str, store: ArtifactStore = None) -> None:
+    """
+    Process one gene score table against every parsed network, dropping genes that do not exist in both.
+    Writes a GS, GO and Module file per network with vectorized writes. These processed files will be used as input for Pascal module enrichment.
+
+    Args:
+        df_gs (pd.DataFrame): Gene scores.
+        modules (dict): Network name (module file name without extension) -> output of readModuleFile.
+        OUTPUTPATH (str): Path to the output directory.
+        pipeline (str): Name of the pipeline, e.g., twas, gwas, staar, or cma.
+        trait (str): Name of the trait, including the random permutation index.
+        geneNameCol (str): Column name for gene name in the gene score file.
+        pvalCol (str): Column name for the p-value in the gene score file.
+        store (ArtifactStore): Write every distinct file once to this store and link the outputs to it.
+
+    Returns:
+        None. The processed gene score files, processed module files, and the GO background set files are saved to OUTPUTPATH.
+    """
+    # the processed gene score file is the same for every network
+    gsText = df_gs[[geneNameCol, pvalCol]].to_csv(sep="\t", header=False, index=False)
+    genesWithScore = set(df_gs[geneNameCol])
+
+    for network, networkModules in modules.items():
+        genesInModule = set()
+        for moduleIndex, genes in networkModules:
+            genesInModule.update(genes)
+        intersectingGenes = genesWithScore.intersection(genesInModule)
+
+        # Output processed gene score file to be used for PASCAL
+        writeOutput(os.path.join(OUTPUTPATH, f"GS_{pipeline}_{trait}_{network}.tsv"), gsText, store)
 
-def pairwiseProcessGeneScoreAndModule(GSPATH: str, MODULEPATH: str, OUTPUTPATH: str, pipeline: str, trait: str, geneNameCol: str, pvalCol: str, sep: str = ',') -> None:
+        # Output GO background set file
+        goGenes = df_gs[geneNameCol][df_gs[geneNameCol].isin(intersectingGenes)]
+        if store is not None:
+            # permutations shuffle the gene column, sorting makes the background the same file for every permutation
+            goGenes = sorted(goGenes)
+        writeOutput(os.path.join(OUTPUTPATH, f"GO_{pipeline}_{trait}_{network}.txt"), "".join(f"{gene}\n" for gene in goGenes), store)
+
+        # Output processed module file after intersecting with the gene score file
+        writeOutput(os.path.join(OUTPUTPATH, f"Module_{pipeline}_{trait}_{network}.tsv"),
+                    "".join("\t".join([moduleIndex] + [gene for gene in genes if gene in intersectingGenes]) + "\n"
+                            for moduleIndex, genes in networkModules), store)
+
+def pairwiseProcessGeneScoreAndModule(GSPATH: str, MODULEPATH: str, OUTPUTPATH: str, pipeline: str, trait: str, geneNameCol: str, pvalCol: str, sep: str = ',', df_gs: pd.DataFrame = None) -> None:
     """
     Process a pair of gene score file and module file, dropping genes that do not exist in either file.
     Write a pair of processed files with the same name. These processed files will be used as input for Pascal module enrichment.
@@ -37,72 +109,79 @@ def pairwiseProcessGeneScoreAndModule(GSPATH: str, MODULEPATH: str, OUTPUTPATH:
         geneNameCol (str): Column name for gene name in the gene score file.
         pvalCol (str): Column name for the p-value in the gene score file.
         sep (str): Separator used in the gene score file. If the file is tab-separated, pass '\t'. The default is a comma (',').
+        df_gs (pd.DataFrame): Gene scores already in memory (e.g. a seed-addressable permutation). GSPATH is not read if given.
 
     Returns:
         None. The processed gene score file, processed module file, and the GO background set file are saved to the corresponding directories.
     """
-    
+
     # Read the gene score file
-    df_gs = pd.read_csv(GSPATH, sep=sep) 
-    genesWithScore = set(df_gs[geneNameCol])
-    genesInModule = extractGeneSetFromModuleFile(MODULEPATH)
-    intersectingGenes = genesWithScore.intersection(genesInModule)
-    
-    moduleFileName = MODULEPATH.split("/")[-1]
-    # Output processed gene score file to be used for PASCAL
-    with open(os.path.join(OUTPUTPATH, f"GS_{pipeline}_{trait}_{moduleFileName[:-4]}.tsv"), "w") as f:
-        for index, row in df_gs.iterrows():
-            f.write(row[geneNameCol] + "\t" + str(row[pvalCol]) + "\n")
-    
-    # Output GO background set file
-    with open(os.path.join(OUTPUTPATH, f"GO_{pipeline}_{trait}_{moduleFileName[:-4]}.txt"), "w") as f:
-        for index, row in df_gs.iterrows():
-            if row[geneNameCol] in intersectingGenes:
-                f.write(f"{row[geneNameCol]}\n")
-    
-    # Output processed module file after intersecting with the gene score file
-    with open(os.path.join(OUTPUTPATH, f"Module_{pipeline}_{trait}_{moduleFileName[:-4]}.tsv"), "w") as f:
-        with open(MODULEPATH, "r") as g:
-            droppedGeneCounter = 0
-            lines = g.readlines()
-            for line in lines:
-                columns = line.split()
-                f.write(columns[0])  # Write the module index
-                for column in columns[2:]:  # Column[1] is always 1.0, so dropped
-                    if column in intersectingGenes:
-                        f.write("\t" + column)
-                    else:
-                        droppedGeneCounter += 1
-                f.write("\n")
+    if df_gs is None:
+        df_gs = pd.read_csv(GSPATH, sep=sep)
+    moduleFileName = os.path.basename(MODULEPATH)
+    processGeneScoreAndModules(df_gs, {moduleFileName[:-4]: readModuleFile(MODULEPATH)}, OUTPUTPATH, pipeline, trait, geneNameCol, pvalCol)
 
 
 def main():
     # Create argument parser
-    parser = argparse.ArgumentParser(description="Preprocess a pair of GS and module file")
-    
+    parser = argparse.ArgumentParser(description="Preprocess a batch of GS files against every module file")
+
     # Add arguments to parser
-    parser.add_argument("scoreFile", help="Path to the scoreFile.")
+    parser.add_argument("scoreFile", nargs="+", help="Path to one or more scoreFiles ({rpIndex}-{trait}.csv).")
     parser.add_argument("moduleFileDir", help="Path to the moduleFile.")
     parser.add_argument("outputPath", help="Path to the output directory.")
     parser.add_argument("pipelineName", help="Name of the pipeline.")
-    parser.add_argument("traitName", help="Name of the trait.")
+    parser.add_argument("traitName", help="Name of the trait. Ignored with --traitFromFileName.")
     parser.add_argument("geneNameCol", help="Name of the column for gene name in the score file.")
     parser.add_argument("pvalCol", help="Name of the column for p-value in the score file.")
+    parser.add_argument("--permutationIndex", type=int, nargs="+", default=None, help="Regenerate these permutations of the scoreFile in memory (seed-addressable permutations).")
+    parser.add_argument("--rootSeed", type=int, default=None, help="Root seed of the seed-addressable permutation stream.")
+    parser.add_argument("--artifactStore", default=None, help="Content-addressed store directory. Outputs are hardlinks to one stored copy of every distinct file.")
+    parser.add_argument("--traitFromFileName", action="store_true", help="Name every scoreFile after itself ({rpIndex}-{trait}.csv), to preprocess the traits of a whole study in one batch.")
+
 
-    
     # Parse the arguments
     args = parser.parse_args()
-    rp_index = os.path.basename(args.scoreFile).split("-")[0]
-    traitWithRPIndex = f"{rp_index}-{args.traitName}"
+    if args.permutationIndex is not None:
+        if args.rootSeed is None:
+            parser.error("--permutationIndex requires --rootSeed")
+        if len(args.scoreFile) != 1:
+            parser.error("--permutationIndex requires a single unpermuted scoreFile")
+        if args.traitFromFileName:
+            parser.error("--permutationIndex cannot be combined with --traitFromFileName")
+
     # Check if the output directory exists, if not create it
     if not os.path.exists(args.outputPath):
         os.makedirs(args.outputPath)
-        
-    for file in os.listdir(args.moduleFileDir):
+
+    store = ArtifactStore(args.artifactStore) if args.artifactStore is not None else None
+
+    # parse every network once for the whole batch of score files
+    modules = {}
+    for file in sorted(os.listdir(args.moduleFileDir)):
         if file.endswith(".txt"):
-            filePath = os.path.join(args.moduleFileDir, file)
-            pairwiseProcessGeneScoreAndModule(args.scoreFile, filePath, args.outputPath, args.pipelineName, traitWithRPIndex, args.geneNameCol, args.pvalCol)
-    
-    
+            modules[file[:-4]] = readModuleFile(os.path.join(args.moduleFileDir, file))
+    countRows("networks", len(modules))
+
+    if args.permutationIndex is not None:
+        # permuted scores are regenerated from the unpermuted score file, which is read once
+        df_unpermuted = pd.read_csv(args.scoreFile[0])
+        for rp_index in args.permutationIndex:
+            df_gs = permute_scores(df_unpermuted, args.geneNameCol, rp_index, args.rootSeed)
+            processGeneScoreAndModules(df_gs, modules, args.outputPath, args.pipelineName, f"{rp_index}-{args.traitName}", args.geneNameCol, args.pvalCol, store)
+        countRows("scoreFiles", len(args.permutationIndex))
+    else:
+        for scoreFile in args.scoreFile:
+            rp_index, _, fileTrait = os.path.basename(scoreFile)[:-len(".csv")].partition("-")
+            trait = fileTrait if args.traitFromFileName else args.traitName
+            df_gs = pd.read_csv(scoreFile)
+            processGeneScoreAndModules(df_gs, modules, args.outputPath, args.pipelineName, f"{rp_index}-{trait}", args.geneNameCol, args.pvalCol, store)
+        countRows("scoreFiles", len(args.scoreFile))
+
+    if store is not None:
+        print(f"{store.linked} files linked to {store.written} new objects of {args.artifactStore}")
+
+
 if __name__ == "__main__":
-    main()
+    with stageTelemetry():
+        main()
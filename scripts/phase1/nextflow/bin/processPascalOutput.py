@@ -6,10 +6,12 @@ from typing import List
 import csv
 import functools as ft
 import ast
+import json
 from cmath import nan
+import numpy as np
 import pandas as pd
 import statsmodels.stats.multitest as smt
-from statsmodels.sandbox.stats.multicomp import multipletests
+from telemetry import countRows, stageTelemetry
 
 def countLinesInTSVfile(FILEPATH:str, sep ="\t"):
     line_count = 0
@@ -21,60 +23,49 @@ def countLinesInTSVfile(FILEPATH:str, sep ="\t"):
     print(f"{FILEPATH} has {line_count} lines (genes).")
     return line_count
 
-def extractGenesBasedOnPval(DIRPATH:str, pval:float):
+def saveSignificantModules(OUTPUTPATH:str, genes:List[str]) -> None:
+    with open(OUTPUTPATH, 'w') as f:
+        for gene in genes:
+            f.write(f'{gene}\n')
+def saveDummyModule(OUTPUTPATH:str) -> None:
+    with open(OUTPUTPATH, 'w') as f:
+        f.write(f'-1')
+def geneSignificanceTiers(DIRPATH:str, sigPvalThreshold:float, numTiers:int = 5) -> dict:
     """
-    Given a GeneScore file in tsv file format without header and a pvalue threshold, 
-    output list of genes with pval less than the threshold
+    Read a GeneScore file once and map every gene to its significance tier.
+    Tier k holds genes with pval < sigPvalThreshold * 10**k, so a gene of tier t is in every tier k >= t.
 
     Args:
         DIRPATH (str): Path to GS file in tsv format. ASSUMPTION: the first col is gene name and the second col is pval
-        pval (float): pvalue threshold
+        sigPvalThreshold (float): pvalue threshold of tier 0
+        numTiers (int): number of tiers
 
     Returns:
-        _type_: list of significant genes
+        _type_: dict of gene -> most significant tier of the gene. Genes outside every tier are left out
     """
     df = pd.read_table(DIRPATH, header=None)
-    return list(df[df[1] < pval][0])
+    # a gene listed more than once is in a tier if any of its pvals is
+    minPval = df.groupby(0, sort=False)[1].min()
+    boundaries = sigPvalThreshold * 10.0 ** np.arange(numTiers)
+    # number of boundaries <= pval is the first tier with pval < boundary
+    tiers = np.searchsorted(boundaries, minPval.to_numpy(), side='right')
+    inTier = tiers < numTiers
+    return dict(zip(minPval.index[inTier], tiers[inTier].tolist()))
 
-def saveSignificantModules(OUTPUTPATH:str, genes:List[str]) -> None:
-    with open(OUTPUTPATH, 'w') as f:
-        for gene in genes:
-            f.write(f'{gene}\n')
-def saveDummyModule(OUTPUTPATH:str) -> None:
-    with open(OUTPUTPATH, 'w') as f:
-        f.write(f'-1')
-def recordModulesFromPascalResult(result, OUTPUTPATH, sigGenesList, almostSigGenesList, sig4GenesList,
-                                             sig3GenesList, sig2GenesList, study, trait, network):
+def recordModulesFromPascalResult(result, OUTPUTPATH, geneToTier, study, trait, network, numTiers = 5):
     moduleIndexToSize = {}
     moduleIndexToModulePval = {}
     moduleIndexToCorrectedModulePval = {}
     moduleIndexToSigFlag = {}
-    moduleIndexSigGenes = {}
-    moduleIndexAlmostSigGenes = {}
-    moduleIndexToSig4Genes = {}
-    moduleIndexToSig3Genes = {}
-    moduleIndexToSig2Genes = {}
+    # one dict of module index -> tier genes per significance tier
+    moduleIndexToTierGenes = [{} for _ in range(numTiers)]
     # each item represents a module
     for item in result:
-        sigGenes = []
-        almostSigGenes = []
-        sig4Genes = []
-        sig3Genes = []
-        sig2Genes = []
-        moduleSizeCounter = 0
-        for gene in item[1]:
-            moduleSizeCounter += 1
-            if gene in sigGenesList:
-                sigGenes.append(gene)
-            if gene in almostSigGenesList:
-                almostSigGenes.append(gene)
-            if gene in sig4GenesList:
-                sig4Genes.append(gene)
-            if gene in sig3GenesList:
-                sig3Genes.append(gene)
-            if gene in sig2GenesList:
-                sig2Genes.append(gene)        
-                
+        # (gene, tier) of the few module genes within any tier, in module order
+        tieredGenes = [(gene, geneToTier[gene]) for gene in item[1] if gene in geneToTier]
+        # a gene of tier t is in every tier k >= t
+        tierGenes = [[gene for gene, tier in tieredGenes if tier <= k] for k in range(numTiers)]
+
         # assumes index of 2 represents bool indicating significance of the module
         if item[2]:
             moduleIndexToSigFlag[item[0]] = True
@@ -85,18 +76,53 @@ def recordModulesFromPascalResult(result, OUTPUTPATH, sigGenesList, almostSigGen
         else:
             moduleIndexToSigFlag[item[0]] = False
             # saveDummyModule(os.path.join(os.path.dirname(OUTPUTPATH), f"dummy_{study}_{trait}_{network}_{item[0]}.txt"))
-        moduleIndexToSize[item[0]] = moduleSizeCounter
+        moduleIndexToSize[item[0]] = len(item[1])
         moduleIndexToModulePval[item[0]] = item[4]
         moduleIndexToCorrectedModulePval[item[0]] = item[3]
-        moduleIndexSigGenes[item[0]] = sigGenes
-        moduleIndexAlmostSigGenes[item[0]] = almostSigGenes
-        moduleIndexToSig4Genes[item[0]] = sig4Genes
-        moduleIndexToSig3Genes[item[0]] = sig3Genes
-        moduleIndexToSig2Genes[item[0]] = sig2Genes
+        for k in range(numTiers):
+            moduleIndexToTierGenes[k][item[0]] = tierGenes[k]
 
-    return moduleIndexToSize, moduleIndexToModulePval, moduleIndexToCorrectedModulePval, moduleIndexToSigFlag, moduleIndexSigGenes, moduleIndexAlmostSigGenes, moduleIndexToSig4Genes, moduleIndexToSig3Genes, moduleIndexToSig2Genes
+    return (moduleIndexToSize, moduleIndexToModulePval, moduleIndexToCorrectedModulePval, moduleIndexToSigFlag, *moduleIndexToTierGenes)
                     
 
+def readPascalResultJSONL(DIRPATH:str):
+    """
+    Stream a pascal output file written by runPascal.py --format jsonl, one module per line.
+
+    Yields:
+        (module index, list of module genes, module uncorrected pval or None if the module lost all genes)
+    """
+    with open(DIRPATH, "r") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record["moduleIndex"], record["genes"], record["pval"]
+
+def readPascalResultRepr(DIRPATH:str):
+    """
+    Parse a legacy pascal output file holding python reprs of the PascalX result tuples.
+
+    Yields:
+        (module index, list of module genes, module uncorrected pval or None if the module lost all genes)
+    """
+    with open(DIRPATH, "r") as f:
+        results = f.read()
+        # flatten pval parts
+        results = results.replace(",\n", ",")
+        results = results.replace(" ", "")
+        # 0: module index, 1: module genes, 2: gene uniform pval, 3: module uncorrected pval
+        parsedResults = re.findall("\[(.+?),(.*?),array\((.*)\),(.*?)\]", results)
+        for parsedResult in parsedResults:
+            # ex) "'5'" -> 5, string list to list conversion via ast.literal_eval
+            yield (int(parsedResult[0].replace("'", "")), ast.literal_eval(parsedResult[1]),
+                   None if parsedResult[3] == "nan" else float(parsedResult[3]))
+
+def readPascalResult(DIRPATH:str):
+    """Stream module results of a pascal output file in either format, detected from its first character."""
+    with open(DIRPATH, "r") as f:
+        isJSONL = f.read(1) == "{"
+    return readPascalResultJSONL(DIRPATH) if isJSONL else readPascalResultRepr(DIRPATH)
+
 def processOnePascalOutput(DIRPATH:str, alpha:float, outputPATH:str):
     """
     Given a path to a pascal output file, extract module index, module genes, and BH-corrected module pvalue
@@ -109,46 +135,36 @@ def processOnePascalOutput(DIRPATH:str, alpha:float, outputPATH:str):
     Returns:
         _type_: list of processed module info, total number of significant pathways
     """
-    with open(DIRPATH, "r") as f:
-        results = f.read()
-        # flatten pval parts
-        results = results.replace(",\n", ",")
-        results = results.replace(" ", "")
-        # 0: module index, 1: module genes, 2: gene uniform pval, 3: module uncorrected pval
-        parsedResults = re.findall("\[(.+?),(.*?),array\((.*)\),(.*?)\]", results)
-        
-        pathwayIndexList = []
-        pathwayGenesList = []
-        pathwayPvalList = []
-        
-        for i in range(len(parsedResults)):
-            # if a module lost all genes due to missing gene score, exclude it from FDR
-            if parsedResults[i][3] != "nan": 
-                # ex) "'5'" -> 5
-                pathwayIndexList.append(int(parsedResults[i][0].replace("'", "")))
-                # string list to list conversion via ast.literal_eval
-                pathwayGenesList.append(ast.literal_eval(parsedResults[i][1]))
-                pathwayPvalList.append(float(parsedResults[i][3]))
-        
-        # FDR correction BH or Bonferroni
-        #correctedPathwayPvalList = smt.fdrcorrection(pathwayPvalList, alpha) # BH
-        correctedPathwayPvalList = multipletests(pathwayPvalList, alpha, method='bonferroni') #Bonferroni
-        
-        # output csv file 
-        df = pd.DataFrame(list(zip(pathwayIndexList, pathwayGenesList,
-                           pathwayPvalList, correctedPathwayPvalList[1])),
-                          columns=['moduleIndex', 'moduleGenes', 'modulePval', 'correctedModulePval'])
-        df.to_csv(outputPATH)
-        
-        result = []
-        
-        numSigPathway = sum(correctedPathwayPvalList[0])
-        for tup in zip(pathwayIndexList, pathwayGenesList,
-                       correctedPathwayPvalList[0], correctedPathwayPvalList[1], pathwayPvalList):
-            result.append(tup)
-        # sort by corrected module pvalue
-        result.sort(key=lambda x: x[-1])
-        return result, numSigPathway
+    pathwayIndexList = []
+    pathwayGenesList = []
+    pathwayPvalList = []
+    
+    for moduleIndex, moduleGenes, modulePval in readPascalResult(DIRPATH):
+        # if a module lost all genes due to missing gene score, exclude it from FDR
+        if modulePval is not None:
+            pathwayIndexList.append(moduleIndex)
+            pathwayGenesList.append(moduleGenes)
+            pathwayPvalList.append(modulePval)
+    
+    # FDR correction BH or Bonferroni
+    #correctedPathwayPvalList = smt.fdrcorrection(pathwayPvalList, alpha) # BH
+    correctedPathwayPvalList = smt.multipletests(pathwayPvalList, alpha, method='bonferroni') #Bonferroni
+    
+    # output csv file 
+    df = pd.DataFrame(list(zip(pathwayIndexList, pathwayGenesList,
+                       pathwayPvalList, correctedPathwayPvalList[1])),
+                      columns=['moduleIndex', 'moduleGenes', 'modulePval', 'correctedModulePval'])
+    df.to_csv(outputPATH)
+    
+    result = []
+    
+    numSigPathway = sum(correctedPathwayPvalList[0])
+    for tup in zip(pathwayIndexList, pathwayGenesList,
+                   correctedPathwayPvalList[0], correctedPathwayPvalList[1], pathwayPvalList):
+        result.append(tup)
+    # sort by corrected module pvalue
+    result.sort(key=lambda x: x[-1])
+    return result, numSigPathway
 
 def main():
     # Create argument parser
@@ -160,7 +176,7 @@ def main():
     parser.add_argument("outputPath", help="Path to the output directory.")
     parser.add_argument("geneScoreFilePath", help="Used to get total number of tests and extract significant genes at different levels.")
     parser.add_argument("significantModulesOutDir", help="Path to the output directory for significant modules.")
-    parser.add_argument("numTests", type=int, help="total number of genes before merging categories")
+    parser.add_argument("numTests", type=int, help="total number of genes before merging categories. 0 counts the genes of geneScoreFilePath, for runs scoring several traits")
     
     # Parse the arguments
     args = parser.parse_args()
@@ -170,7 +186,9 @@ def main():
     network = args.pascalOutputFile.split("_")[2].replace(".txt", "")
     rpIndex = trait.split("-")[0]
     
-    sigPvalThreshold = 0.05 / args.numTests
+    # the processed gene score file holds every gene of the score file, one per line
+    numTests = args.numTests if args.numTests > 0 else countLinesInTSVfile(args.geneScoreFilePath)
+    sigPvalThreshold = 0.05 / numTests
     
     # Check if the output directory exists, if not create it
     if not os.path.exists(args.outputPath):
@@ -197,16 +215,14 @@ def main():
     
     # create summary file for one pascal output file.
     result, numSigPathway = processOnePascalOutput(args.pascalOutputFile, args.alpha, os.path.join(args.outputPath, "pascalResult.csv"))
-    sigGenesList = extractGenesBasedOnPval(args.geneScoreFilePath,sigPvalThreshold)
-    sig1GenesList = extractGenesBasedOnPval(args.geneScoreFilePath, sigPvalThreshold*10)
-    sig2GenesList = extractGenesBasedOnPval(args.geneScoreFilePath, sigPvalThreshold*100)
-    sig3GenesList = extractGenesBasedOnPval(args.geneScoreFilePath, sigPvalThreshold*1000)
-    sig4GenesList = extractGenesBasedOnPval(args.geneScoreFilePath, sigPvalThreshold*10000)
+    # tiers 0-4: pval < sigPvalThreshold * 1, 10, 100, 1000, 10000
+    geneToTier = geneSignificanceTiers(args.geneScoreFilePath, sigPvalThreshold)
     sigModulesPath = os.path.join(args.significantModulesOutDir, args.pascalOutputFile)
     print(sigModulesPath)
     print(args.outputPath)
-    moduleToSize, moduleToPval, moduleToCorrectedPval, isModuleSig, sigGenesDict, sig1GenesDict, sig2GenesDict, sig3GenesDict, sig4GenesDict = recordModulesFromPascalResult(result, sigModulesPath, 
-                                                                                                          sigGenesList, sig1GenesList, sig2GenesList, sig3GenesList, sig4GenesList, study, trait, network)
+    moduleToSize, moduleToPval, moduleToCorrectedPval, isModuleSig, sigGenesDict, sig1GenesDict, sig2GenesDict, sig3GenesDict, sig4GenesDict = recordModulesFromPascalResult(result, sigModulesPath, geneToTier, study, trait, network)
+    countRows("modules", len(moduleToPval))
+    countRows("significantModules", numSigPathway)
     for moduleIndex in sigGenesDict.keys():
         summary_dict['study'].append(study)
         summary_dict['trait'].append(trait)
@@ -230,4 +246,5 @@ def main():
     
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with stageTelemetry():
+        main()
\ No newline at end of file
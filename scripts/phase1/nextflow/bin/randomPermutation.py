@@ -1,16 +1,38 @@
+import numpy as np
 import pandas as pd
 import argparse
 import os
+from telemetry import countRows, stageTelemetry
 
 """
 Given input_file_path, output_directory, columnToPermute, and seed, this function will:
 generate 1000 RP files in the output_directory. The RP files will have the same name as the input_file_path with the addition of the seed number. (ABI-1.csv, ABI-2.csv, ABI-3.csv, etc.)
 Seeds are integers from 1 to 1000.
 
+Seed-addressable permutations (--root_seed):
+Permutation i (1..numRP) is fully determined by (root_seed, i). Its row order is
+    np.random.default_rng(np.random.SeedSequence(root_seed, spawn_key=(i,))).permutation(numRows)
+i.e. the i-th child stream of SeedSequence(root_seed) driving a PCG64 generator. Any stage can regenerate the
+permuted scores in memory with permute_scores() instead of reading a materialized {i}-{trait}.csv file, and
+files written with --root_seed are identical to the in-memory permutations.
+
 Usage:
-python3 randomPermutation.py input_file_path output_directory columnToPermute 
+python3 randomPermutation.py input_file_path output_directory columnToPermute numRP [--root_seed SEED]
 """
 
+def permutation_order(num_rows, index, root_seed):
+    """Row order of permutation `index` in the seed-addressable stream of `root_seed`."""
+    rng = np.random.default_rng(np.random.SeedSequence(int(root_seed), spawn_key=(int(index),)))
+    return rng.permutation(num_rows)
+
+def permute_scores(df, columnToPermute, index, root_seed):
+    """Return a copy of df with columnToPermute shuffled by permutation `index` of the `root_seed` stream."""
+    df = df.copy()
+    df[columnToPermute] = df[columnToPermute].values[permutation_order(len(df), index, root_seed)]
+    if 'Unnamed: 0' in df.columns:
+        df = df.drop(columns=['Unnamed: 0'])
+    return df
+
 def permute_first_column(input_file_path, output_directory, columnToPermute, seed=None):
     # Step 1: Read the CSV file into a DataFrame
     df = pd.read_csv(input_file_path)
@@ -38,6 +60,7 @@ def main():
     parser.add_argument("output_directory", help="Directory to save the permuted CSV files.")
     parser.add_argument("column_name_to_permute", help="Name of the column to permute.")
     parser.add_argument("numRP", type=int, help="number of permutations")
+    parser.add_argument("--root_seed", type=int, default=None, help="write permutations of the seed-addressable stream of this root seed")
 
     
     # Parse the arguments
@@ -46,7 +69,16 @@ def main():
     # Check if the output directory exists, if not create it
     if not os.path.exists(args.output_directory):
         os.makedirs(args.output_directory)
+    countRows("permutations", args.numRP)
     
+    if args.root_seed is not None:
+        # read the input once and write every permutation of the seed-addressable stream
+        df = pd.read_csv(args.input_file_path)
+        base_name = os.path.splitext(os.path.basename(args.input_file_path))[0]
+        for i in range(1, args.numRP+1):
+            permute_scores(df, args.column_name_to_permute, i, args.root_seed).to_csv(os.path.join(args.output_directory, f"{i}-{base_name}.csv"), index=False)
+        return
+
     # Loop to generate 1000 permuted DataFrames
     for i in range(1, args.numRP+1):
         # Set seed for reproducibility
@@ -55,4 +87,5 @@ def main():
         permute_first_column(args.input_file_path, args.output_directory, args.column_name_to_permute,seed)
 
 if __name__ == "__main__":
-    main()
+    with stageTelemetry():
+        main()
@@ -1,39 +1,127 @@
 import argparse
+import copy
+import hashlib
+import json
+import math
 import os
 import glob
+from multiprocessing import Pool
 from typing import List
 
-from PascalX import pathway
-from PascalX import genescorer
+from chi2rankScorer import scorePairs
+from telemetry import countRows, stageTelemetry
+
+# modules parsed by PascalX, keyed by the content hash of the module file.
+# Module files of different permutations of a trait are identical, so each one is loaded once per process.
+_MODULE_CACHE = {}
+
+def pairScoreAndModuleFiles(scorePath:str, modulePath:str) -> List[tuple]:
+    """
+    Pair gene score files with their module files.
+
+    Args:
+        scorePath (str): a GS_*.tsv file or a directory of GS_*.tsv files
+        modulePath (str): a module file, or a directory holding Module_*.tsv files named after the GS files
+
+    Returns:
+        list of (scoreFile, moduleFile)
+    """
+    if os.path.isdir(scorePath):
+        scoreFiles = sorted(glob.glob(os.path.join(scorePath, "GS_*.tsv")))
+    else:
+        scoreFiles = [scorePath]
+    pairs = []
+    for scoreFile in scoreFiles:
+        if os.path.isdir(modulePath):
+            moduleFile = os.path.join(modulePath, os.path.basename(scoreFile).replace("GS_", "Module_", 1))
+        else:
+            moduleFile = modulePath
+        pairs.append((scoreFile, moduleFile))
+    return pairs
+
+def loadModules(Pscorer, moduleFile:str):
+    with open(moduleFile, "rb") as f:
+        key = hashlib.sha1(f.read()).hexdigest()
+    if key not in _MODULE_CACHE:
+        _MODULE_CACHE[key] = Pscorer.load_modules(moduleFile, ncol=0, fcol=1)
+    # scoring must not see modules modified by an earlier score file
+    return copy.deepcopy(_MODULE_CACHE[key])
+
+def pascalResultToJSON(r) -> str:
+    """
+    One PascalX module result [module name, module genes, gene pvals, module pval] as a JSON line.
+    A module pval of nan (module lost all genes) is written as null.
+    """
+    pval = float(r[3])
+    return json.dumps({"moduleIndex": int(str(r[0]).replace("'", "")),
+                       "genes": [str(gene) for gene in r[1]],
+                       "pval": None if math.isnan(pval) else pval})
+
+def scoreOnePair(scoreFile:str, moduleFile:str, outputPath:str, outputFormat:str = "jsonl") -> str:
+    """Score the modules of moduleFile with the gene scores of scoreFile and write the PascalX result."""
+    # PascalX is only needed by the pascalx scorer
+    from PascalX import pathway
+    from PascalX import genescorer
+    Scorer = genescorer.chi2sum()
+    Scorer.load_scores(scoreFile)
+    Pscorer = pathway.chi2rank(Scorer, fuse=False)
+    M = loadModules(Pscorer, moduleFile)
+    RESULT = Pscorer.score(M)
+    fileName = os.path.basename(scoreFile).replace("tsv", "txt").replace("GS_", "")
+    with open(os.path.join(outputPath, fileName), "w") as f:
+        for r in RESULT[0]:
+            if outputFormat == "jsonl":
+                f.write(pascalResultToJSON(r)+"\n")
+            else:
+                f.write(str(r)+"\n")
+    return fileName
+
+def _scoreOnePair(args):
+    return scoreOnePair(*args)
 
-        
 def main():
     # Create argument parser
-    parser = argparse.ArgumentParser(description="Randomly permute the first column of a CSV file.")
-    
+    parser = argparse.ArgumentParser(description="Score modules with PascalX for one or many gene score files.")
+
     # Add arguments to parser
-    parser.add_argument("scoreFile", help="Path to the scoreFile.")
-    parser.add_argument("moduleFile", help="Path to the moduleFile.")
+    parser.add_argument("scoreFile", help="Path to the scoreFile, or a directory of GS_*.tsv scoreFiles.")
+    parser.add_argument("moduleFile", help="Path to the moduleFile, or a directory of Module_*.tsv files named after the scoreFiles.")
     parser.add_argument("outputPath", help="Path to the output directory.")
     parser.add_argument("pipelineName", help="Name of the pipeline.")
     parser.add_argument("traitName", help="Name of the trait.")
-    
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes scoring files in parallel.")
+    parser.add_argument("--format", choices=["jsonl", "repr"], default="jsonl",
+                        help="jsonl: one {moduleIndex, genes, pval} record per module. repr: legacy python repr of the PascalX result.")
+    parser.add_argument("--scorer", choices=["pascalx", "matrix"], default="pascalx",
+                        help="pascalx: PascalX chi2rank per score file. matrix: rank-chi2 of every score file sharing a module file and its genes in one vectorized call (chi2rankScorer.py), experimental and not used by the pipeline until validated against PascalX (test/validate_chi2rank.py).")
+
     # Parse the arguments
     args = parser.parse_args()
-    
+    if args.scorer == "matrix" and args.format != "jsonl":
+        parser.error("--scorer matrix writes --format jsonl only")
+
     # Check if the output directory exists, if not create it
     if not os.path.exists(args.outputPath):
         os.makedirs(args.outputPath)
-    
-    #for moduleFile, scoreFile in zip(moduleFiles, scoreFiles):
-    Scorer = genescorer.chi2sum()
-    Scorer.load_scores(args.scoreFile)
-    Pscorer = pathway.chi2rank(Scorer, fuse=False)
-    M = Pscorer.load_modules(args.moduleFile, ncol=0, fcol=1)
-    RESULT = Pscorer.score(M)
-    fileName = os.path.basename(args.scoreFile).replace("tsv", "txt").replace("GS_", "")
-    f = open(os.path.join(args.outputPath, fileName), "w")
-    for r in RESULT[0]:
-        f.write(str(r)+"\n")
+
+    if args.scorer == "matrix":
+        pairs = pairScoreAndModuleFiles(args.scoreFile, args.moduleFile)
+        countRows("scoreFiles", len(pairs))
+        for fileName in scorePairs(pairs, args.outputPath):
+            print(f"scored {fileName}")
+        return
+
+    # PascalX is set up once and every score file is scored in this interpreter (or its worker pool)
+    pairs = [(scoreFile, moduleFile, args.outputPath, args.format) for scoreFile, moduleFile in pairScoreAndModuleFiles(args.scoreFile, args.moduleFile)]
+    countRows("scoreFiles", len(pairs))
+    if args.workers > 1 and len(pairs) > 1:
+        with Pool(min(args.workers, len(pairs))) as pool:
+            for fileName in pool.imap_unordered(_scoreOnePair, pairs):
+                print(f"scored {fileName}")
+    else:
+        for pair in pairs:
+            print(f"scored {scoreOnePair(*pair)}")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with stageTelemetry():
+        main()
@@ -0,0 +1,234 @@
+import argparse
+import bisect
+import json
+import os
+import resource
+import socket
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Per-task telemetry ledger of the FISHNET python entry points.
+# With FISHNET_TELEMETRY set to a directory, every entry point run inside stageTelemetry appends one JSON line to
+# <FISHNET_TELEMETRY>/<host>.<pid>.jsonl: stage, command line, SLURM job, start/end, wall and CPU time (children
+# included), peak RSS, bytes read/written, files opened for reading/writing and the row counts reported by
+# countRows. One ledger file per process, so concurrent tasks on a shared filesystem never append to the same file.
+# Without FISHNET_TELEMETRY nothing is recorded.
+#
+# python telemetry.py <ledgerDir> [--csv stages.csv]
+# aggregates the ledger into per-stage totals and the critical path derived from the start/end times of the tasks.
+
+LEDGER_ENV = "FISHNET_TELEMETRY"
+# interpreter and library files opened by imports are not task inputs
+IGNORED_PREFIXES = tuple(sorted({sys.prefix, sys.base_prefix, sys.exec_prefix, "/proc", "/sys", "/dev"}))
+IGNORED_SUFFIXES = (".py", ".pyc", ".so")
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND
+
+_active = None
+_hookInstalled = False
+
+class StageRecord:
+    """Files opened and rows counted while a stage runs."""
+
+    def __init__(self, stage:str):
+        self.stage = stage
+        self.filesRead = set()
+        self.filesWritten = set()
+        self.rows = {}
+
+def _auditOpen(event, args):
+    if event != "open" or _active is None:
+        return
+    path, mode, flags = args
+    if not isinstance(path, str) or path.startswith(IGNORED_PREFIXES) or path.endswith(IGNORED_SUFFIXES):
+        return
+    isWrite = any(c in mode for c in "wax+") if isinstance(mode, str) else bool((flags or 0) & WRITE_FLAGS)
+    (_active.filesWritten if isWrite else _active.filesRead).add(os.path.abspath(path))
+
+def countRows(name:str, count:int) -> None:
+    """Add count to the row counter name of the running stage. No-op outside stageTelemetry."""
+    if _active is not None:
+        _active.rows[name] = _active.rows.get(name, 0) + int(count)
+
+def ioBytes() -> Dict[str, int]:
+    """Bytes read and written by this process (Linux), empty elsewhere."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return {"read": int(counters["rchar"]), "written": int(counters["wchar"])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+def cpuSeconds() -> float:
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def peakRssMB() -> float:
+    # ru_maxrss is in kB on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+@contextmanager
+def stageTelemetry(stage:Optional[str] = None):
+    """
+    Record the telemetry of the code run in the context to the ledger of FISHNET_TELEMETRY.
+
+    Args:
+        stage (str): stage name, default: name of the script
+    """
+    global _active, _hookInstalled
+    ledgerDir = os.environ.get(LEDGER_ENV, "")
+    if not ledgerDir:
+        yield
+        return
+    stage = stage or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    if not _hookInstalled:
+        # audit hooks cannot be removed, the hook only records while a stage is active
+        sys.addaudithook(_auditOpen)
+        _hookInstalled = True
+    _active = record = StageRecord(stage)
+    start, wallStart, cpuStart, ioStart = time.time(), time.perf_counter(), cpuSeconds(), ioBytes()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _active = None
+        ioEnd = ioBytes()
+        entry = {
+            "stage": stage,
+            "argv": sys.argv[1:],
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "slurmJobId": os.environ.get("SLURM_JOB_ID"),
+            "slurmArrayTaskId": os.environ.get("SLURM_ARRAY_TASK_ID"),
+            "start": start,
+            "end": time.time(),
+            "wallSeconds": time.perf_counter() - wallStart,
+            "cpuSeconds": cpuSeconds() - cpuStart,
+            "peakRssMB": peakRssMB(),
+            "bytesRead": ioEnd["read"] - ioStart["read"] if ioEnd else None,
+            "bytesWritten": ioEnd["written"] - ioStart["written"] if ioEnd else None,
+            "filesRead": len(record.filesRead - record.filesWritten),
+            "filesWritten": len(record.filesWritten),
+            "rows": record.rows,
+            "status": status,
+        }
+        os.makedirs(ledgerDir, exist_ok=True)
+        with open(os.path.join(ledgerDir, f"{socket.gethostname()}.{os.getpid()}.jsonl"), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+def readLedger(ledgerDir:str) -> List[dict]:
+    entries = []
+    for file in sorted(os.listdir(ledgerDir)):
+        if file.endswith(".jsonl"):
+            with open(os.path.join(ledgerDir, file), "r") as f:
+                entries.extend(json.loads(line) for line in f if line.strip())
+    return entries
+
+def percentile(values:List[float], q:float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+def stageTotals(entries:List[dict]) -> List[dict]:
+    """Per-stage totals, in order of the first start of every stage."""
+    stages = {}
+    for entry in sorted(entries, key=lambda entry: entry["start"]):
+        stages.setdefault(entry["stage"], []).append(entry)
+    totals = []
+    for stage, stageEntries in stages.items():
+        rows = {}
+        for entry in stageEntries:
+            for name, count in entry["rows"].items():
+                rows[name] = rows.get(name, 0) + count
+        rss = [entry["peakRssMB"] for entry in stageEntries]
+        totals.append({
+            "stage": stage,
+            "tasks": len(stageEntries),
+            "failed": sum(entry["status"] != "ok" for entry in stageEntries),
+            "wallSeconds": sum(entry["wallSeconds"] for entry in stageEntries),
+            "cpuSeconds": sum(entry["cpuSeconds"] for entry in stageEntries),
+            "maxTaskWallSeconds": max(entry["wallSeconds"] for entry in stageEntries),
+            "spanSeconds": max(entry["end"] for entry in stageEntries) - min(entry["start"] for entry in stageEntries),
+            "p95PeakRssMB": percentile(rss, 95),
+            "maxPeakRssMB": max(rss),
+            "bytesRead": sum(entry["bytesRead"] or 0 for entry in stageEntries),
+            "bytesWritten": sum(entry["bytesWritten"] or 0 for entry in stageEntries),
+            "filesRead": sum(entry["filesRead"] for entry in stageEntries),
+            "filesWritten": sum(entry["filesWritten"] for entry in stageEntries),
+            "rows": ";".join(f"{name}={count}" for name, count in sorted(rows.items())),
+        })
+    return totals
+
+def criticalPath(entries:List[dict]) -> List[dict]:
+    """
+    Critical path of the recorded tasks, derived from their start/end intervals: starting at the task that ended last,
+    step back to the task that ended last before the current task started, which is the task it most likely waited for.
+
+    Returns:
+        tasks of the critical path, in order of their start
+    """
+    byEnd = sorted(entries, key=lambda entry: entry["end"])
+    ends = [entry["end"] for entry in byEnd]
+    path = [byEnd[-1]]
+    while True:
+        previous = bisect.bisect_right(ends, path[-1]["start"]) - 1
+        if previous < 0:
+            break
+        path.append(byEnd[previous])
+    return path[::-1]
+
+def main():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description="Aggregate a FISHNET telemetry ledger into per-stage totals and critical-path timing.")
+
+    # Add arguments to parser
+    parser.add_argument("ledgerDir", help="Path to the telemetry ledger directory (FISHNET_TELEMETRY).")
+    parser.add_argument("--csv", default=None, help="Also write the per-stage totals to this csv.")
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    entries = readLedger(args.ledgerDir)
+    if not entries:
+        print(f"no telemetry records in {args.ledgerDir}")
+        return
+    totals = stageTotals(entries)
+
+    columns = ["stage", "tasks", "failed", "wallSeconds", "cpuSeconds", "maxTaskWallSeconds", "spanSeconds", "p95PeakRssMB", "maxPeakRssMB",
+               "bytesRead", "bytesWritten", "filesRead", "filesWritten"]
+    widths = [max(len(column), *(len(f"{total[column]:.1f}" if isinstance(total[column], float) else str(total[column])) for total in totals)) for column in columns]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for total in totals:
+        print("  ".join((f"{total[column]:.1f}" if isinstance(total[column], float) else str(total[column])).rjust(width)
+                        for column, width in zip(columns, widths)))
+    print()
+    for total in totals:
+        if total["rows"]:
+            print(f"{total['stage']} rows: {total['rows']}")
+
+    path = criticalPath(entries)
+    pathSeconds = sum(entry["end"] - entry["start"] for entry in path)
+    elapsed = max(entry["end"] for entry in entries) - min(entry["start"] for entry in entries)
+    print(f"critical path: {len(path)} tasks, {pathSeconds:.1f}s running, {path[-1]['end'] - path[0]['start'] - pathSeconds:.1f}s between them (scheduling, non-python steps)")
+    # consecutive tasks of the same stage are shown once
+    steps = []
+    for entry in path:
+        if steps and steps[-1][0] == entry["stage"]:
+            steps[-1][1] += 1
+            steps[-1][2] += entry["end"] - entry["start"]
+        else:
+            steps.append([entry["stage"], 1, entry["end"] - entry["start"]])
+    print(" -> ".join(f"{stage}{f' x{count}' if count > 1 else ''} ({seconds:.1f}s)" for stage, count, seconds in steps))
+    print(f"elapsed from first start to last end: {elapsed:.1f}s, CPU total: {sum(total['cpuSeconds'] for total in totals):.1f}s")
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write(",".join(columns + ["rows"]) + "\n")
+            for total in totals:
+                f.write(",".join(str(total[column]) for column in columns + ["rows"]) + "\n")
+
+if __name__ == "__main__":
+    main()
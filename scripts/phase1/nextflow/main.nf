@@ -4,10 +4,13 @@ nextflow.enable.dsl=2
 
 include { WORKFLOW_ORIGINAL_RUN } from './subworkflows.nf'
 include { WORKFLOW_RANDOM_RUN } from './subworkflows.nf'
+include { WORKFLOW_STUDY_RUN } from './subworkflows.nf'
 
 workflow {
     if (params.random_permutation) {
         WORKFLOW_RANDOM_RUN()
+    } else if (params.studyDir) {
+        WORKFLOW_STUDY_RUN()
     } else {
         WORKFLOW_ORIGINAL_RUN()
     }
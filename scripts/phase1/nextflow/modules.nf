@@ -1,5 +1,11 @@
 nextflow.enable.dsl=2
 
+// trait of the GO summaries of a GO background file (GO_{pipeline}_{rpIndex}-{trait}_{network}.txt).
+// params.trait, except in study mode where one run scores every trait of params.studyDir
+def goSummaryTrait(goFile) {
+    return params.studyDir ? goFile.baseName.split('_')[2].split('-', 2)[1] : params.trait
+}
+
 process RANDOM_PERMUTATION {
 
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
@@ -30,7 +36,11 @@ process PREPROCESS_FOR_PASCAL {
         'quay.io/biocontainers/mulled-v2-9d836da785124bb367cbe6fbfc00dddd2107a4da:b033d6a4ea3a42a6f5121a82b262800f1219b382-0' }"
 
     label "process_low"
-    publishDir "./results/${params.pipeline}/", pattern: "pascalInput/*", mode: 'copy'
+    // with an artifact store, outputs are hardlinks to its objects and are published as links instead of copies
+    publishDir "./results/${params.pipeline}/", pattern: "pascalInput/*", mode: "${ params.artifactStore ? 'link' : 'copy' }"
+    containerOptions "${ !params.artifactStore ? '' : workflow.containerEngine == 'singularity' ?
+        "-B ${params.artifactStore}" :
+        "-v ${params.artifactStore}:${params.artifactStore}" }"
 
     input:
     path pvalFile
@@ -41,15 +51,56 @@ process PREPROCESS_FOR_PASCAL {
     path("pascalInput/GO_*"),       emit: go
 
     script:
+    def storeArgs = params.artifactStore ? "--artifactStore ${params.artifactStore}" : ""
+    // study mode: pvalFile is the 0-{trait}.csv of every trait, each named after its file
+    def traitArgs = params.studyDir ? "--traitFromFileName" : ""
     """
     python3 ${projectDir}/bin/preProcessForPascal.py \
         ${pvalFile} \
         ${params.moduleFileDir} \
         "pascalInput/" \
         ${params.pipeline} \
+        ${params.studyDir ? params.pipeline : params.trait} \
+        ${params.geneColName} \
+        ${params.pvalColName} ${storeArgs} ${traitArgs}
+    """
+}
+
+process PREPROCESS_FOR_PASCAL_PERMUTATION {
+
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/mulled-v2-9d836da785124bb367cbe6fbfc00dddd2107a4da:b033d6a4ea3a42a6f5121a82b262800f1219b382-0' :
+        'quay.io/biocontainers/mulled-v2-9d836da785124bb367cbe6fbfc00dddd2107a4da:b033d6a4ea3a42a6f5121a82b262800f1219b382-0' }"
+
+    label "process_low"
+    // with an artifact store, outputs are hardlinks to its objects and are published as links instead of copies
+    publishDir "./results/${params.pipeline}/", pattern: "pascalInput/*", mode: "${ params.artifactStore ? 'link' : 'copy' }"
+    containerOptions "${ !params.artifactStore ? '' : workflow.containerEngine == 'singularity' ?
+        "-B ${params.artifactStore}" :
+        "-v ${params.artifactStore}:${params.artifactStore}" }"
+
+    input:
+    val rpIndex
+
+    output:
+    path("pascalInput/GS_*"),       emit: gs
+    path("pascalInput/Module_*"),   emit: module
+    path("pascalInput/GO_*"),       emit: go
+
+    script:
+    def storeArgs = params.artifactStore ? "--artifactStore ${params.artifactStore}" : ""
+    // permutations rpIndex are regenerated in memory from the seed-addressable stream of params.rootSeed
+    """
+    python3 ${projectDir}/bin/preProcessForPascal.py \
+        ${params.pvalFileName} \
+        ${params.moduleFileDir} \
+        "pascalInput/" \
+        ${params.pipeline} \
         ${params.trait} \
         ${params.geneColName} \
-        ${params.pvalColName}
+        ${params.pvalColName} \
+        --permutationIndex ${rpIndex.join(' ')} \
+        --rootSeed ${params.rootSeed} ${storeArgs}
     """
 }
 
@@ -60,23 +111,26 @@ process RUN_PASCAL {
     publishDir "./results/${params.pipeline}/", pattern: "pascalOutput/*", mode: 'copy'
 
     input:
-    path(geneScoreFile)
-    path(moduleFile)
-    path(goFile)
+    path(geneScoreFile, stageAs: "gs/*")
+    path(moduleFile, stageAs: "modules/*")
+    path(goFile, stageAs: "go/*")
 
     output:
-    path("pascalOutput/*"), emit: pascaloutput
-    path(geneScoreFile),    emit: genescorefile
-    path(goFile),           emit:gofile
+    path("pascalOutput/*"),                 emit: pascaloutput
+    path("gs/*", includeInputs: true),      emit: genescorefile
+    path("go/*", includeInputs: true),      emit: gofile
 
     script:
+    // one task scores a chunk of params.pascalBatchSize score files (in study mode, every trait of one network)
+    // with a single PascalX setup
     """
     python3 ${projectDir}/bin/runPascal.py \
-        ${geneScoreFile} \
-        ${moduleFile} \
+        gs/ \
+        modules/ \
         "pascalOutput/" \
         ${params.pipeline} \
-        ${params.trait}
+        ${params.studyDir ? params.pipeline : params.trait} \
+        --workers ${task.cpus}
     """
 }
 
@@ -90,9 +144,8 @@ process POSTPROCESS_PASCAL_OUTPUT {
     publishDir "./results/${params.pipeline}/", pattern: "significantModules/*", mode: 'copy'
 
     input:
-    path(pascalOutputFile)
-    path(geneScoreFilePascalInput) // used to decide number of tests
-    path(goFile)
+    // {pipeline}_{rpIndex}-{trait}_{network} stem of the three files
+    tuple val(key), path(pascalOutputFile), path(geneScoreFilePascalInput), path(goFile) // score file used to decide number of tests
 
     output:
     path("masterSummaryPiece/master_summary_slice_*"),  emit:summaryslice
@@ -106,14 +159,14 @@ process POSTPROCESS_PASCAL_OUTPUT {
         "masterSummaryPiece/" \
         ${geneScoreFilePascalInput} \
         "significantModules/" \
-        ${params.numTests}
+        ${params.studyDir ? 0 : params.numTests}
     """
 }
 
 process GO_ANALYSIS {
 
     container 'jungwooseok/r-webgestaltr:1.0' // TODO: add to biocontainers
-    publishDir "./results/${params.pipeline}/", pattern: "${params.GO_summaries_path}/${params.trait}/*", mode: 'copy' // copy ORA results to current location.
+    publishDir "./results/${params.pipeline}/", pattern: "${params.GO_summaries_path}/*/*", mode: 'copy' // copy ORA results to current location.
     label "process_low"
 
     input:
@@ -123,11 +176,11 @@ process GO_ANALYSIS {
 
     output:
     path(masterSummarySlice),   emit: mastersummaryslice
-    path("${params.GO_summaries_path}/${params.trait}/GO_summaries_${goFile.baseName.split('_')[2]}_${goFile.baseName.split('_')[3]}/"),   emit: gosummaries
+    path("${params.GO_summaries_path}/${goSummaryTrait(goFile)}/GO_summaries_${goFile.baseName.split('_')[2]}_${goFile.baseName.split('_')[3]}/"),   emit: gosummaries
     path(goFile),               emit: gofile
 
     script:
-    def oraSummaryDir = "${params.GO_summaries_path}/${params.trait}/GO_summaries_${goFile.baseName.split('_')[2]}_${goFile.baseName.split('_')[3]}/"
+    def oraSummaryDir = "${params.GO_summaries_path}/${goSummaryTrait(goFile)}/GO_summaries_${goFile.baseName.split('_')[2]}_${goFile.baseName.split('_')[3]}/"
     """
     Rscript ${projectDir}/bin/ORA_cmd.R --sigModuleDir ${sigModuleDir} --backGroundGenesFile ${goFile} \
         --summaryRoot "${oraSummaryDir}" --reportRoot "GO_reports/"
@@ -135,6 +188,39 @@ process GO_ANALYSIS {
     """
 }
 
+process GO_ANALYSIS_PYTHON {
+
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/mulled-v2-9d836da785124bb367cbe6fbfc00dddd2107a4da:b033d6a4ea3a42a6f5121a82b262800f1219b382-0' :
+        'quay.io/biocontainers/mulled-v2-9d836da785124bb367cbe6fbfc00dddd2107a4da:b033d6a4ea3a42a6f5121a82b262800f1219b382-0' }"
+    publishDir "./results/${params.pipeline}/", pattern: "${params.GO_summaries_path}/*/*", mode: 'copy' // copy ORA results to current location.
+    label "process_low"
+    // the ORA cache lives outside the work directory and is shared by every task
+    containerOptions "${ !params.oraCacheDir ? '' : workflow.containerEngine == 'singularity' ?
+        "-B ${params.oraCacheDir}" :
+        "-v ${params.oraCacheDir}:${params.oraCacheDir}" }"
+
+    input:
+    path(masterSummarySlice)
+    path(sigModuleDir)
+    path(goFile)
+    path(goAnnotation)
+
+    output:
+    path(masterSummarySlice),   emit: mastersummaryslice
+    path("${params.GO_summaries_path}/${goSummaryTrait(goFile)}/GO_summaries_${goFile.baseName.split('_')[2]}_${goFile.baseName.split('_')[3]}/"),   emit: gosummaries
+    path(goFile),               emit: gofile
+
+    script:
+    def oraSummaryDir = "${params.GO_summaries_path}/${goSummaryTrait(goFile)}/GO_summaries_${goFile.baseName.split('_')[2]}_${goFile.baseName.split('_')[3]}/"
+    def cacheArgs = params.oraCacheDir ? "--cacheDir ${params.oraCacheDir} --cacheMaxSize ${params.oraCacheMaxSize}" : ""
+    """
+    python3 ${projectDir}/bin/oraEngine.py --sigModuleDir ${sigModuleDir} --backGroundGenesFile ${goFile} \
+        --summaryRoot "${oraSummaryDir}" --annotation ${goAnnotation} ${cacheArgs}
+
+    """
+}
+
 process MERGE_RESULTS {
 
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
@@ -2,11 +2,23 @@ nextflow.enable.dsl=2
 
 include { RANDOM_PERMUTATION } from './modules.nf'
 include { PREPROCESS_FOR_PASCAL } from './modules.nf'
+include { PREPROCESS_FOR_PASCAL_PERMUTATION } from './modules.nf'
 include { RUN_PASCAL } from './modules.nf'
 include { POSTPROCESS_PASCAL_OUTPUT } from './modules.nf'
 include { GO_ANALYSIS } from './modules.nf'
+include { GO_ANALYSIS_PYTHON } from './modules.nf'
 include { MERGE_RESULTS } from './modules.nf'
 
+// network of a preprocessed file ({GS,Module,GO}_{pipeline}_{rpIndex}-{trait}_{network}.{tsv,txt})
+def networkOf(file) {
+    return file.baseName.split('_')[3]
+}
+
+// {pipeline}_{rpIndex}-{trait}_{network} stem shared by a score file, its GO file and its PascalX output
+def pascalKey(file) {
+    return file.baseName.replaceFirst(/^(GS|GO)_/, '')
+}
+
 workflow SUBWORKFLOW_MODULE_ENRICHMENT {
 
     take:
@@ -15,28 +27,69 @@ workflow SUBWORKFLOW_MODULE_ENRICHMENT {
     go
 
     main:
+    if (params.studyDir) {
+        // one task per network scores every trait of the study, loading the network once
+        scoring = (gs | flatten | map { file -> [networkOf(file), file] } | groupTuple)
+            .join(module | flatten | map { file -> [networkOf(file), file] } | groupTuple)
+            .join(go | flatten | map { file -> [networkOf(file), file] } | groupTuple)
+            .multiMap { network, gsFiles, moduleFiles, goFiles ->
+                gs: gsFiles
+                module: moduleFiles
+                go: goFiles
+            }
+        scoringGs = scoring.gs
+        scoringModule = scoring.module
+        scoringGo = scoring.go
+    } else {
+        scoringGs = gs | flatten | buffer(size: params.pascalBatchSize, remainder: true)
+        scoringModule = module | flatten | buffer(size: params.pascalBatchSize, remainder: true)
+        scoringGo = go | flatten | buffer(size: params.pascalBatchSize, remainder: true)
+    }
+
     RUN_PASCAL (
-        gs | flatten,
-        module | flatten,
-        go | flatten
+        scoringGs,
+        scoringModule,
+        scoringGo
     )
 
+    // a batched task emits its files in glob order, so outputs are paired with their score and GO files by name
+    scored = (RUN_PASCAL.out.pascaloutput | flatten | map { file -> [pascalKey(file), file] })
+        .join(RUN_PASCAL.out.genescorefile | flatten | map { file -> [pascalKey(file), file] }, remainder: true)
+        .join(RUN_PASCAL.out.gofile | flatten | map { file -> [pascalKey(file), file] }, remainder: true)
+        .map { row ->
+            // unmatched files are padded with null by remainder: true
+            if (row.size() != 4 || row.contains(null)) {
+                error "RUN_PASCAL has no PascalX output, score file or GO file for ${row[0]}"
+            }
+            row
+        }
+
     POSTPROCESS_PASCAL_OUTPUT (
-        RUN_PASCAL.out.pascaloutput | flatten,
-        RUN_PASCAL.out.genescorefile | flatten,
-        RUN_PASCAL.out.gofile | flatten
+        scored
     )
 
-    GO_ANALYSIS (
-        POSTPROCESS_PASCAL_OUTPUT.out.summaryslice | flatten,
-        POSTPROCESS_PASCAL_OUTPUT.out.sigmodules | flatten,
-        POSTPROCESS_PASCAL_OUTPUT.out.gofile | flatten
-    )
+    if (params.oraEngine == 'python') {
+        // ORA against a local GO snapshot instead of WebGestaltR
+        GO_ANALYSIS_PYTHON (
+            POSTPROCESS_PASCAL_OUTPUT.out.summaryslice | flatten,
+            POSTPROCESS_PASCAL_OUTPUT.out.sigmodules | flatten,
+            POSTPROCESS_PASCAL_OUTPUT.out.gofile | flatten,
+            file(params.goAnnotation)
+        )
+        ora = GO_ANALYSIS_PYTHON.out
+    } else {
+        GO_ANALYSIS (
+            POSTPROCESS_PASCAL_OUTPUT.out.summaryslice | flatten,
+            POSTPROCESS_PASCAL_OUTPUT.out.sigmodules | flatten,
+            POSTPROCESS_PASCAL_OUTPUT.out.gofile | flatten
+        )
+        ora = GO_ANALYSIS.out
+    }
 
     MERGE_RESULTS (
-        GO_ANALYSIS.out.mastersummaryslice  | flatten,
-        GO_ANALYSIS.out.gosummaries | flatten,
-        GO_ANALYSIS.out.gofile | flatten
+        ora.mastersummaryslice  | flatten,
+        ora.gosummaries | flatten,
+        ora.gofile | flatten
     )
 }
 
@@ -54,12 +107,11 @@ workflow WORKFLOW_ORIGINAL_RUN {
 
 }
 
-workflow WORKFLOW_RANDOM_RUN {
-
-    RANDOM_PERMUTATION ()
+workflow WORKFLOW_STUDY_RUN {
 
+    // every trait of the study ({studyDir}/{trait}/0-{trait}.csv) is preprocessed in one task, parsing every network once
     PREPROCESS_FOR_PASCAL (
-        RANDOM_PERMUTATION.out.rp_scores | flatten
+        Channel.fromPath("${params.studyDir}/*/0-*.csv").collect()
     )
 
     SUBWORKFLOW_MODULE_ENRICHMENT (
@@ -67,4 +119,34 @@ workflow WORKFLOW_RANDOM_RUN {
         PREPROCESS_FOR_PASCAL.out.module,
         PREPROCESS_FOR_PASCAL.out.go
     )
+
+}
+
+workflow WORKFLOW_RANDOM_RUN {
+
+    if (params.virtual_permutations) {
+        // permutations are identified by their index only, no RPscores files are written
+        PREPROCESS_FOR_PASCAL_PERMUTATION (
+            Channel.of(params.permutationStart..params.numRP).buffer(size: params.preprocessBatchSize, remainder: true)
+        )
+
+        SUBWORKFLOW_MODULE_ENRICHMENT (
+            PREPROCESS_FOR_PASCAL_PERMUTATION.out.gs,
+            PREPROCESS_FOR_PASCAL_PERMUTATION.out.module,
+            PREPROCESS_FOR_PASCAL_PERMUTATION.out.go
+        )
+    } else {
+        RANDOM_PERMUTATION ()
+
+        // preprocess a batch of permutations per task, parsing every network once per batch
+        PREPROCESS_FOR_PASCAL (
+            RANDOM_PERMUTATION.out.rp_scores | flatten | buffer(size: params.preprocessBatchSize, remainder: true)
+        )
+
+        SUBWORKFLOW_MODULE_ENRICHMENT (
+            PREPROCESS_FOR_PASCAL.out.gs,
+            PREPROCESS_FOR_PASCAL.out.module,
+            PREPROCESS_FOR_PASCAL.out.go
+        )
+    }
 }
@@ -24,4 +24,7 @@ nextflow run ./scripts/phase1/nextflow/main.nf \
     --geneColName $GENECOLNAME \
     --pvalColName $PVALCOLNAME  \
     --bonferroni_alpha $BONFERRONI_ALPHA \
+    ${ORA_ARGS:-} \
+    ${ARTIFACT_STORE_ARGS:-} \
+    ${TELEMETRY_ARGS:-} \
     -c $NXF_CONFIG
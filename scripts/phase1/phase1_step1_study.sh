@@ -0,0 +1,25 @@
+#!/bin/bash
+
+#SBATCH -J fishnet_phase1_step1_study
+#SBATCH --mem-per-cpu=4G
+#SBATCH --cpus-per-task=1
+#SBATCH -o ./logs/fishnet_phase1_step1_study_%j.out
+
+# study mode: a single Nextflow run preprocesses and scores every trait of $STUDY_PATH,
+# parsing and loading every network once for all traits
+
+MASTER_DIR=$1
+
+cd $MASTER_DIR # move to master script directory (important to set proper nextflow launchDir)
+
+nextflow run ./scripts/phase1/nextflow/main.nf \
+    --studyDir $STUDY_PATH \
+    --moduleFileDir $MODULE_FILE_PATH \
+    --pipeline $STUDY \
+    --geneColName $GENECOLNAME \
+    --pvalColName $PVALCOLNAME  \
+    --bonferroni_alpha $BONFERRONI_ALPHA \
+    ${ORA_ARGS:-} \
+    ${ARTIFACT_STORE_ARGS:-} \
+    ${TELEMETRY_ARGS:-} \
+    -c $NXF_CONFIG
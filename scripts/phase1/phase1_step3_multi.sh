@@ -10,6 +10,12 @@ cd $1 # move to master script directory (important to set proper nextflow launch
 PVALFILEPATHRR="${STUDY_RANDOM_PATH}/${STUDY_RANDOM}.csv"
 NUMTESTS=$(( $(wc -l < "$PVALFILEPATHRR") - 1 ))
 
+VIRTUAL_PERMUTATION_ARGS=""
+if [ "$VIRTUAL_PERMUTATIONS" = true ]; then
+    # adaptive permutation rounds run permutations PERMUTATION_START..NUM_PERMUTATIONS
+    VIRTUAL_PERMUTATION_ARGS="--virtual_permutations --rootSeed $ROOT_SEED --permutationStart ${PERMUTATION_START:-1}"
+fi
+
 nextflow run ./scripts/phase1/nextflow/main.nf \
     --trait $STUDY_RANDOM \
     --moduleFileDir $MODULE_FILE_PATH \
@@ -19,8 +25,12 @@ nextflow run ./scripts/phase1/nextflow/main.nf \
     --geneColName $GENECOLNAME \
     --pvalColName $PVALCOLNAME  \
     --bonferroni_alpha $BONFERRONI_ALPHA \
+    ${ORA_ARGS:-} \
+    ${ARTIFACT_STORE_ARGS:-} \
+    ${TELEMETRY_ARGS:-} \
     --random_permutation \
     --numRP $NUM_PERMUTATIONS \
+    $VIRTUAL_PERMUTATION_ARGS \
     --GO_summaries_path "GO_summaries" \
     --masterSummaries_path "masterSummaries" \
     -c $NXF_CONFIG \
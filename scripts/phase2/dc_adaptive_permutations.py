@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import os
+from dc_mea_engine import load_rp_matrix
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import stageTelemetry
+
+
+# python dc_adaptive_permutations.py
+#   --study_path /scratch/mblab/acharyas/fishnet/pipeline/data/pvals/twasLLFSORKB/
+#   --input_path /scratch/mblab/acharyas/fishnet/pipeline/results/
+#   --or_id twasLLFSORKB --rr_id twasLLFSRR --input_file_rr_id twasLLFSRR
+#   --networks ker_based_1,ker_based_2
+#   --num_permutations 100 --max_permutations 1000 --percentile_threshold 99
+#   --status_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSORKB/summary/adaptive_status.csv
+#   --undecided_path /scratch/mblab/acharyas/fishnet/pipeline/tmp/undecided_networks.txt
+#
+# Curtailed (Besag-Clifford) stopping rule for adaptive permutation testing.
+# A rank is called by dc_identify_mea_passing_genes.py only if its original_run_percentile over the full
+# permutation budget reaches percentile_threshold. After k of max_permutations permutations, the percentile at
+# the budget is at most the value reached if every remaining permutation falls below the original count.
+# Once that upper bound is under the threshold the rank can no longer be called, whatever the remaining
+# permutations, so its permutations stop there. A rank that may still pass runs the whole budget (its FDR
+# uses the mean of every permutation), so the genes called are the same as with a fixed permutation count.
+# A network needs more permutations while any rank of any trait is undecided.
+
+def rank_percentile(below, ties, num_permutations):
+    """stats.percentileofscore(kind='rank') from the counts of permutations below and equal to the score."""
+    return (2 * below + ties + (ties > 0)) * (50.0 / num_permutations)
+
+def curtailed_decisions(rp_matrix, original_counts, percentile_threshold, max_permutations):
+    """
+    Apply the curtailed stopping rule to the permutations run so far, in permutation index order.
+
+    Args:
+        rp_matrix (np.ndarray): ranks x permutations MEA-passing gene counts of the first permutations
+        original_counts (np.ndarray): MEA-passing gene count of the original run at every rank
+        percentile_threshold (float): original_run_percentile cutoff of dc_identify_mea_passing_genes.py
+        max_permutations (int): permutation budget
+
+    Returns:
+        pd.DataFrame with one row per rank:
+            permutations_used: permutations needed to decide the rank, or every permutation run if undecided
+            decided: True once the rank cannot pass at the budget
+            percentile_lower, percentile_upper: range of the original_run_percentile still possible at the budget
+    """
+    original_counts = np.asarray(original_counts)[:, None]
+    num_run = rp_matrix.shape[1]
+    run = np.arange(1, num_run + 1)
+    ties = np.cumsum(rp_matrix == original_counts, axis=1)
+    below = np.cumsum(rp_matrix < original_counts, axis=1)
+
+    # every remaining permutation below (upper) or above (lower) the original count
+    percentile_upper = rank_percentile(below + (max_permutations - run), ties, max_permutations)
+    percentile_lower = rank_percentile(below, ties, max_permutations)
+    cannot_pass = percentile_upper < float(percentile_threshold)
+
+    decided = cannot_pass.any(axis=1) if num_run > 0 else np.zeros(rp_matrix.shape[0], dtype=bool)
+    stop = np.where(decided, np.argmax(cannot_pass, axis=1), num_run - 1)
+    rows = np.arange(rp_matrix.shape[0])
+    return pd.DataFrame({"permutations_used": stop + 1 if num_run > 0 else np.zeros(rp_matrix.shape[0], dtype=int),
+                         "decided": decided,
+                         "percentile_lower": percentile_lower[rows, stop] if num_run > 0 else 0.0,
+                         "percentile_upper": percentile_upper[rows, stop] if num_run > 0 else 100.0})
+
+def adaptive_status(study_path, input_path, or_id, rr_id, input_file_rr_id, networks, num_permutations, max_permutations, percentile_threshold):
+    """
+    Decisions of every (trait, network, rank) after the first num_permutations permutations.
+
+    Returns:
+        pd.DataFrame of trait, network, Ranks and the curtailed_decisions columns
+    """
+    traits = sorted(d for d in os.listdir(study_path) if os.path.isdir(os.path.join(study_path, d)))
+    statuses = []
+    for network in networks:
+        for trait in traits:
+            original_run_summary_filepath = os.path.join(input_path, or_id, "results", "raw", f"{network}_0-{trait}_{network}_or_summary.csv")
+            if not os.path.exists(original_run_summary_filepath):
+                print(f"FILE-NOT-FOUND: {original_run_summary_filepath}")
+                continue
+            original_run_summary_df = pd.read_csv(original_run_summary_filepath)
+            original_counts = dict(zip(original_run_summary_df["threshold"].astype(int), original_run_summary_df["mea_passing_genes"]))
+            # permutation files are named after the permutation budget
+            ranks, rp_matrix = load_rp_matrix(input_path, rr_id, input_file_rr_id, network, max_permutations, list(original_counts))
+            if len(ranks) == 0:
+                continue
+            status = curtailed_decisions(rp_matrix[:, :int(num_permutations)], np.array([original_counts[rank] for rank in ranks]),
+                                         percentile_threshold, int(max_permutations))
+            status.insert(0, "Ranks", ranks)
+            status.insert(0, "network", network)
+            status.insert(0, "trait", trait)
+            statuses.append(status)
+    if len(statuses) == 0:
+        return pd.DataFrame(columns = ["trait", "network", "Ranks", "permutations_used", "decided", "percentile_lower", "percentile_upper"])
+    return pd.concat(statuses, ignore_index=True)
+
+def undecided_networks(status, networks, num_permutations, max_permutations):
+    """Networks that need more permutations: any undecided rank, or no status yet, while under the budget."""
+    if int(num_permutations) >= int(max_permutations):
+        return []
+    decided = status.groupby("network")["decided"].all()
+    return [network for network in networks if not decided.get(network, False)]
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--study_path', '-study_path', help='study directory with one subdirectory per trait')
+    parser.add_argument('--input_path', '-input_path')
+    parser.add_argument('--or_id', '-or_id')
+    parser.add_argument('--rr_id', '-rr_id')
+    parser.add_argument('--input_file_rr_id', '-input_file_rr_id')
+    parser.add_argument('--networks', '-networks', help='comma-separated networks still running permutations')
+    parser.add_argument('--num_permutations', '-num_permutations', type=int, help='permutations run so far')
+    parser.add_argument('--max_permutations', '-max_permutations', type=int, help='permutation budget')
+    parser.add_argument('--percentile_threshold', '-percentile_threshold', type=float)
+    parser.add_argument('--status_path', '-status_path', help='csv of the decision of every trait, network and rank')
+    parser.add_argument('--undecided_path', '-undecided_path', help='file listing the networks that need more permutations')
+    args = parser.parse_args()
+    with stageTelemetry():
+        networks = args.networks.split(",")
+        status = adaptive_status(args.study_path, args.input_path, args.or_id, args.rr_id, args.input_file_rr_id, networks,
+                                 args.num_permutations, args.max_permutations, args.percentile_threshold)
+        # statuses of networks that stopped in an earlier round are kept
+        if os.path.exists(args.status_path):
+            previous_status = pd.read_csv(args.status_path)
+            status = pd.concat([previous_status[~previous_status["network"].isin(networks)], status], ignore_index=True)
+        status_dir = os.path.dirname(args.status_path)
+        if status_dir:
+            os.makedirs(status_dir, exist_ok=True)
+        status.to_csv(args.status_path, index=False)
+
+        remaining = undecided_networks(status[status["network"].isin(networks)], networks, args.num_permutations, args.max_permutations)
+        with open(args.undecided_path, "w") as f:
+            for network in remaining:
+                f.write(f"{network}\n")
+        print(f"\t{len(networks) - len(remaining)} of {len(networks)} networks decided after {args.num_permutations} permutations")
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import sys
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from compiledNetwork import sourceStamp
+from telemetry import countRows, stageTelemetry
+
+
+# python dc_edge_store.py
+#   --network_connections_path /scratch/mblab/acharyas/fishnet/data/networks/
+#   [--network ppi]
+#
+# Compiles a network edge table ({network}.txt with Source, Target and Score columns) into
+# {network_connections_path}/.compiled_edges/{network}/ holding
+#   genes.txt          interned gene symbols, one per line
+#   source.npy         gene id of the Source of every edge, in file order
+#   target.npy         gene id of the Target of every edge, in file order
+#   score.npy          Score of every edge, in file order
+#   first.npy          whether an edge is the first of its undirected (min, max) gene id pair, i.e. kept by dedup
+#   indptr.npy         CSR adjacency: the edges of gene g are edge[indptr[g]:indptr[g+1]]
+#   edge.npy           edge ids of the CSR adjacency, an edge is listed under both of its genes
+#   stamp.json         size and mtime of the edge table it was compiled from
+# The induced subgraphs of every significant module are then extracted in one vectorized pass over the
+# adjacency of the module genes, instead of filtering and deduplicating the whole edge table per module.
+
+COMPILED_EDGES_DIR = ".compiled_edges"
+
+def compiled_edges_path(edges_path):
+    edges_path = os.path.realpath(edges_path)
+    network = os.path.splitext(os.path.basename(edges_path))[0]
+    return os.path.join(os.path.dirname(edges_path), COMPILED_EDGES_DIR, network)
+
+class EdgeStore:
+    """Undirected adjacency of one network edge table."""
+
+    def __init__(self, genes, source, target, score, first, indptr, edge):
+        self.genes = genes
+        self.gene_index = pd.Index(genes)
+        self.source = source
+        self.target = target
+        self.score = score
+        self.first = first
+        self.indptr = indptr
+        self.edge = edge
+
+    def induced_edges(self, modules):
+        """
+        Edges between genes of the same module, for every module at once.
+
+        Args:
+            modules (list): genes of every module
+
+        Returns:
+            list of edge id arrays in file order, one per module. A repeated undirected edge keeps its first occurrence
+        """
+        num_genes, num_edges = len(self.genes), len(self.source)
+        # gene ids of every module gene at once, then every (module, gene id) once
+        sizes = [len(module_genes) for module_genes in modules]
+        all_genes = [gene for module_genes in modules for gene in module_genes]
+        all_ids = self.gene_index.get_indexer(all_genes) if all_genes else np.zeros(0, dtype=np.int64)
+        all_modules = np.repeat(np.arange(len(modules), dtype=np.int64), sizes)
+        in_store = all_ids >= 0
+        members = np.unique(all_modules[in_store] * num_genes + all_ids[in_store])
+        member_module, member_gene = members // num_genes, members % num_genes
+        starts = self.indptr[member_gene]
+        counts = self.indptr[member_gene + 1] - starts
+        if counts.sum() == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in modules]
+
+        # every adjacency entry (module, edge, other gene of the edge) of the module genes
+        entry_module = np.repeat(member_module, counts)
+        entry_edge = self.edge[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        other_gene = self.source[entry_edge] + self.target[entry_edge] - np.repeat(member_gene, counts)
+
+        # keep the first occurrence of every edge whose other gene is in the same module
+        member_keys = np.sort(member_module * num_genes + member_gene)
+        other_keys = entry_module * num_genes + other_gene
+        position = np.minimum(np.searchsorted(member_keys, other_keys), len(member_keys) - 1)
+        keep = (member_keys[position] == other_keys) & self.first[entry_edge]
+        module_edges = np.unique(entry_module[keep] * num_edges + entry_edge[keep])
+
+        boundaries = np.searchsorted(module_edges // num_edges, np.arange(len(modules) + 1))
+        return [module_edges[boundaries[k]:boundaries[k + 1]] % num_edges for k in range(len(modules))]
+
+    def edge_table(self, edge_ids):
+        """Source, Target and Score of edges as in the edge table."""
+        genes = np.asarray(self.genes, dtype=object)
+        return pd.DataFrame({"Source": genes[self.source[edge_ids]],
+                             "Target": genes[self.target[edge_ids]],
+                             "Score": self.score[edge_ids]})
+
+def build_edge_store(edges_path):
+    """Intern an edge table and build its adjacency and dedup flags."""
+    edges = pd.read_table(edges_path, usecols=["Source", "Target", "Score"], dtype={"Source": str, "Target": str},
+                          keep_default_na=False, na_values={"Score": ["", "NA", "NaN", "nan"]})
+    codes, genes = pd.factorize(pd.concat([edges["Source"], edges["Target"]], ignore_index=True))
+    num_edges = edges.shape[0]
+    source, target = codes[:num_edges].astype(np.int64), codes[num_edges:].astype(np.int64)
+
+    # first occurrence of every undirected gene pair, as drop_duplicates(keep="first") of the module edges
+    low, high = np.minimum(source, target), np.maximum(source, target)
+    first = np.zeros(num_edges, dtype=bool)
+    first[np.unique(low * len(genes) + high, return_index=True)[1]] = True
+
+    # an edge is listed under both of its genes, a self loop once
+    endpoints = np.concatenate([source, target[source != target]])
+    edge_ids = np.concatenate([np.arange(num_edges), np.flatnonzero(source != target)])
+    order = np.argsort(endpoints, kind="stable")
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(endpoints, minlength=len(genes)))])
+    countRows("edges", num_edges)
+    return EdgeStore(list(genes), source, target, edges["Score"].to_numpy(), first, indptr, edge_ids[order])
+
+def edge_store_up_to_date(compiled_path, edges_path):
+    stamp_path = os.path.join(compiled_path, "stamp.json")
+    try:
+        with open(stamp_path, "r") as f:
+            return json.load(f) == sourceStamp(edges_path)
+    except FileNotFoundError:
+        return False
+
+def save_edge_store(store, edges_path, replace = True):
+    """
+    Write the compiled form of an edge table into a temporary sibling directory and move it into place, so jobs that
+    memory-mapped the previous compiled form keep reading complete files.
+
+    Args:
+        replace (bool): replace an up to date compiled form written meanwhile by another job
+    """
+    compiled_path = compiled_edges_path(edges_path)
+    edges_dir = os.path.dirname(compiled_path)
+    os.makedirs(edges_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=edges_dir, prefix=f".{os.path.basename(compiled_path)}.", suffix=".tmp")
+    try:
+        with open(os.path.join(tmp_path, "genes.txt"), "w") as f:
+            f.write("".join(f"{gene}\n" for gene in store.genes))
+        for name in ["source", "target", "first", "indptr", "edge"]:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(store, name))
+        score = store.score if store.score.dtype != object else store.score.astype(str)
+        np.save(os.path.join(tmp_path, "score.npy"), score)
+        with open(os.path.join(tmp_path, "stamp.json"), "w") as f:
+            json.dump(sourceStamp(edges_path), f)
+        if not replace and edge_store_up_to_date(compiled_path, edges_path):
+            shutil.rmtree(tmp_path)
+            return compiled_path
+        # a directory cannot replace a non-empty one: move the previous compiled form aside first. Its files stay
+        # readable by the jobs that mapped them until they unmap them
+        previous_path = None
+        if os.path.exists(compiled_path):
+            previous_path = tempfile.mkdtemp(dir=edges_dir, prefix=f".{os.path.basename(compiled_path)}.", suffix=".old")
+            os.replace(compiled_path, os.path.join(previous_path, "compiled"))
+        os.replace(tmp_path, compiled_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    if previous_path is not None:
+        shutil.rmtree(previous_path, ignore_errors=True)
+    return compiled_path
+
+def load_edge_store(edges_path, compile_missing = True):
+    """
+    Edge store of an edge table, memory-mapped from its compiled form.
+
+    Args:
+        edges_path (str): {network_connections_path}{network}.txt
+        compile_missing (bool): compile the edge table if it has no up to date compiled form. Built in memory if the
+            compiled form cannot be written next to the edge table
+
+    Returns:
+        EdgeStore
+    """
+    compiled_path = compiled_edges_path(edges_path)
+    if edge_store_up_to_date(compiled_path, edges_path):
+        try:
+            with open(os.path.join(compiled_path, "genes.txt"), "r") as f:
+                genes = f.read().splitlines()
+            arrays = {name: np.load(os.path.join(compiled_path, f"{name}.npy"), mmap_mode="r")
+                      for name in ["source", "target", "score", "first", "indptr", "edge"]}
+            return EdgeStore(genes, **arrays)
+        except FileNotFoundError:
+            # moved aside by another job replacing the compiled form while it was read
+            pass
+    store = build_edge_store(edges_path)
+    if compile_missing:
+        try:
+            # parallel jobs compile a missing edge table at the same time, the first one to finish is kept
+            save_edge_store(store, edges_path, replace = False)
+        except OSError as e:
+            print(f"could not save the compiled edges of {edges_path}: {e}")
+    return store
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--network_connections_path', '-network_connections_path', help='directory of the network edge tables ({network}.txt)')
+    parser.add_argument('--network', '-network', default=None, help='only compile this network (default: every network)')
+    args = parser.parse_args()
+    with stageTelemetry():
+        networks = [args.network] if args.network is not None else sorted(file[:-len(".txt")] for file in os.listdir(args.network_connections_path) if file.endswith(".txt"))
+        for network in networks:
+            edges_path = os.path.join(args.network_connections_path, f"{network}.txt")
+            print(f"compiled {edges_path} to {save_edge_store(build_edge_store(edges_path), edges_path)}")
@@ -4,58 +4,69 @@ import ast
 import os
 import math
 import scipy.stats as stats
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
+from compiledNetwork import loadNetwork
 
 
 # python dc_fishnet_background_genes.py 
 #   --genes_filepath /scratch/mblab/acharyas/fishnet/pipeline/data/pvals/llfsTWASRR/llfsTWASRR.csv 
 #   --module_filepath /scratch/mblab/acharyas/fishnet/pipeline/data/modules/ker_based/ 
 #   --output_filepath /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSORKB/
+#
+# several studies at once:
+#   --genes_filepath {study1}.csv {study2}.csv --output_filepath results/{study1}/ results/{study2}/
+
+# Every network module file is tokenized once into its gene set and every study score file is read once, so one
+# invocation can write the backgrounds of several studies (--genes_filepath and --output_filepath paired in order).
 
 def dc_fishnet_background_genes(genes_filepath, module_filepath, output_filepath ):
-    networks = []
-    for files in os.listdir(module_filepath):
-        genes = background_set(os.path.join(module_filepath,files), genes_filepath)
-        moduleAlgo = os.path.normpath(module_filepath)
-        moduleAlgo = os.path.basename(moduleAlgo)
+    genes_filepaths = [genes_filepath] if isinstance(genes_filepath, str) else list(genes_filepath)
+    output_filepaths = [output_filepath] if isinstance(output_filepath, str) else list(output_filepath)
+    if len(genes_filepaths) != len(output_filepaths):
+        raise ValueError(f"{len(genes_filepaths)} gene score files but {len(output_filepaths)} output paths")
+
+    moduleAlgo = os.path.normpath(module_filepath)
+    moduleAlgo = os.path.basename(moduleAlgo)
+    network_genes = {}
+    for files in sorted(os.listdir(module_filepath)):
+        if not files.endswith(".txt"):
+            # e.g. the .compiled directory of compiled networks
+            continue
+        network_genes[files] = network_gene_set(os.path.join(module_filepath,files))
+    countRows("networks", len(network_genes))
+
+    for genes_filepath, output_filepath in zip(genes_filepaths, output_filepaths):
+        summary_genes = summary_gene_set(genes_filepath)
         output_dir = os.path.join(output_filepath,"background_genes")
         os.makedirs(output_dir, exist_ok = True)
-        with open(os.path.join(output_dir,f"{moduleAlgo}-{files}"), 'w') as file:
-            # Write each gene to a new line
-            for gene in genes:
-                file.write(f"{gene}\n")
+        for files, genes in network_genes.items():
+            intersecting_genes = summary_genes.intersection(genes)
+            countRows("backgroundGenes", len(intersecting_genes))
+            with open(os.path.join(output_dir,f"{moduleAlgo}-{files}"), 'w') as file:
+                # Write each gene to a new line
+                file.write("".join(f"{gene}\n" for gene in sorted(intersecting_genes)))
 
-def background_set(network_path, genes_filepath):
-    Index = []
-    Network = []
-    Genes = []
-    #coex
+def network_gene_set(network_path):
+    """Genes in any module of a module file (index, score, genes... per line), or of its compiled form."""
+    compiled_network = loadNetwork(network_path)
+    if compiled_network is not None:
+        return compiled_network.geneSet()
+    genes = set()
     with open(network_path, 'r') as file:
-            for line in file:
-                # Split the line into components
-                parts = line.strip().split()
-                # The first element is the ID
-                Index.append(parts[0])
-
-                # The second element is the Attribute
-                Network.append(parts[1])
+        for line in file:
+            genes.update(line.split()[2:])  # skip the first two columns (module_index and score)
+    return genes
 
-                # The rest are genes
-                Genes.append('\t'.join(parts[2:]))
+def summary_gene_set(genes_filepath):
+    """Genes of a summary statistics file (Genes column)."""
+    return set(pd.read_csv(genes_filepath, usecols = ["Genes"])["Genes"])
 
-            # Create a DataFrame from the lists
-    
-    modules_df= pd.DataFrame({
-        'ID': Index,
-        'Network': Network,
-        'Genes': Genes
-    })
-    genes_list = modules_df['Genes'].str.split('\t').sum()
-    genes_summary_df = pd.read_csv(genes_filepath)
-    genes_summary_list = genes_summary_df["Genes"]
-
-    intersecting_genes = set(genes_summary_list).intersection(genes_list)
-    print(len(intersecting_genes))
-    return intersecting_genes    
+def background_set(network_path, genes_filepath):
+    intersecting_genes = summary_gene_set(genes_filepath).intersection(network_gene_set(network_path))
+    countRows("backgroundGenes", len(intersecting_genes))
+    return intersecting_genes
 
 def get_key_from_value(dictionary, value):
     for key, val in dictionary.items():
@@ -67,10 +78,11 @@ def get_key_from_value(dictionary, value):
 if __name__ == "__main__":
     from argparse import ArgumentParser   
     parser = ArgumentParser()
-    parser.add_argument('--genes_filepath', '-genes', help='genes')
+    parser.add_argument('--genes_filepath', '-genes', nargs='+', help='genes, one summary statistics file per study')
     parser.add_argument('--module_filepath', '-module_filepath')
-    parser.add_argument('--output_filepath', '-output_filepath')
+    parser.add_argument('--output_filepath', '-output_filepath', nargs='+', help='output path of every study, in the order of --genes_filepath')
     args = parser.parse_args()
-    dc_fishnet_background_genes(genes_filepath = args.genes_filepath, module_filepath = args.module_filepath, output_filepath = args.output_filepath)
-
-
+    if len(args.genes_filepath) != len(args.output_filepath):
+        parser.error("--genes_filepath and --output_filepath need one path per study each")
+    with stageTelemetry():
+        dc_fishnet_background_genes(genes_filepath = args.genes_filepath, module_filepath = args.module_filepath, output_filepath = args.output_filepath)
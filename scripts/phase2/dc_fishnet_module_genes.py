@@ -4,6 +4,11 @@ import ast
 import os
 import math
 import scipy.stats as stats
+import sys
+from multiprocessing import Pool
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
+from compiledNetwork import loadNetwork
 
 
 # python dc_fishnet_module_genes.py 
@@ -11,83 +16,84 @@ import scipy.stats as stats
 #   --module_filepath /scratch/mblab/acharyas/fishnet/pipeline/data/modules/ker_based/ 
 #   --master_summary_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSORKB/ 
 #   --study twasLLFSORKB
+#   [--workers 4]
 
 
-def dc_fishnet_module_genes(genes_filepath, module_filepath, master_summary_path, study ):
+# The master summary is read and filtered once, every network module file is streamed once and every enriched
+# module of the study is written as it is read, optionally one worker process per network (--workers).
+
+def dc_fishnet_module_genes(genes_filepath, module_filepath, master_summary_path, study, workers = 1):
     module_network_pair = extract_modules(master_summary_path, study)
-    extract_module_genes(study, genes_filepath, module_filepath, module_network_pair, master_summary_path)
+    extract_module_genes(study, genes_filepath, module_filepath, module_network_pair, master_summary_path, workers)
 
-def extract_modules(master_summary_path, study):    
-    final_module_network_pair = pd.DataFrame(columns = ["moduleIndex", "network", "trait", "Study"])
+def extract_modules(master_summary_path, study):
     master_summary_df = pd.read_csv(os.path.join(master_summary_path,"master_summary.csv"))
     master_summary_df = master_summary_df[["study", "trait", "network", "moduleIndex", "isModuleSig", "modulePval", "moduleBonPval", "size"]]
     master_summary_df = master_summary_df[master_summary_df["moduleBonPval"] <= 0.25]
     master_summary_df.to_csv(os.path.join(master_summary_path,"master_summary_alternate.csv"), index = False)
 
-    final_module_network_pair = pd.DataFrame(columns = ["moduleIndex", "network", "trait", "Study"])
-
-    for networks in master_summary_df["network"].unique():
-        for traits in master_summary_df["trait"].unique():
-            temp_master_summary_df = master_summary_df[(master_summary_df["trait"] == traits) &
-                                                        (master_summary_df["network"] == networks)]
-            temp_master_summary_df = temp_master_summary_df[["moduleIndex", "network", "trait"]]
-            temp_master_summary_df["Study"] = study
-            final_module_network_pair = pd.concat([final_module_network_pair,temp_master_summary_df], ignore_index = True )
+    # rows grouped by network, then by trait, each in order of first appearance
+    order = np.lexsort((pd.factorize(master_summary_df["trait"])[0], pd.factorize(master_summary_df["network"])[0]))
+    final_module_network_pair = master_summary_df.iloc[order][["moduleIndex", "network", "trait"]].reset_index(drop = True)
+    final_module_network_pair["Study"] = study
     final_module_network_pair.to_csv(os.path.join(master_summary_path,f"{study}.txt"), index = False)
     final_module_network_pair = final_module_network_pair[["moduleIndex", "network"]]
     filtered_final_module_network_pair = final_module_network_pair.drop_duplicates(subset=['moduleIndex', 'network'], ignore_index = True)
     return filtered_final_module_network_pair
- 
-def save_module_genes(modules_df, study, genes_filepath, master_summary_path):
-    for index, rows in modules_df.iterrows():
-        genes = rows["Genes"]
-        module_id = rows["ID"]
-        network = rows["Network_type"]
-        module_genes = genes.split("\t")
-        
-        #take intersection of module genes and summary stats genes
-        gene_summary_df = pd.read_csv(genes_filepath)
-        genes_summary = gene_summary_df["Genes"]
-        final_genes = set(genes_summary).intersection(set(module_genes))
-        output_dir = os.path.join(master_summary_path,"enriched_modules",f"{study}-{network}")
-        os.makedirs(output_dir, exist_ok=True)
 
+def read_network_modules(module_file, module_indices):
+    """Stream (module index, genes) of the modules with one of module_indices of a module file, or of its compiled form."""
+    compiled_network = loadNetwork(module_file)
+    if compiled_network is not None:
+        yield from compiled_network.modulesOf(module_indices)
+        return
+    with open(module_file, 'r') as file:
+        for line in file:
+            # module index, score, genes...
+            parts = line.strip().split()
+            if parts and int(parts[0]) in module_indices:
+                yield int(parts[0]), parts[2:]
+
+def save_module_genes(study, network, module_file, module_indices, master_summary_path):
+    """
+    Write the genes of the enriched modules of one network, one gene per line, in a single pass over its module file.
+
+    Args:
+        module_file (str): path to the module file of the network
+        module_indices (set): enriched module indices of the network
+
+    Returns:
+        number of module gene files written
+    """
+    output_dir = os.path.join(master_summary_path,"enriched_modules",f"{study}-{network}")
+    num_written = 0
+    for module_id, genes in read_network_modules(module_file, module_indices):
+        os.makedirs(output_dir, exist_ok=True)
         with open(os.path.join(output_dir,f"sig_{study}-{network}-{module_id}.txt"), 'w') as file:
-            for item in genes.split("\t"):
-                file.write(f"{item}\n") 
-
-def extract_module_genes(study, genes_filepath, module_filepath, module_network_pair, master_summary_path):
-    Index = []
-    Network = []
-    Genes = []
-
-    for files in os.listdir(module_filepath):
-        network_modules = module_network_pair[module_network_pair["network"] == files.split(".")[0]]["moduleIndex"]
-        if(network_modules.shape[0] == 0):
-            continue
-        with open(os.path.join(module_filepath,files), 'r') as file:
-                for line in file:
-                    # Split the line into components
-                    parts = line.strip().split()
-                    # The first element is the ID
-                    Index.append(parts[0])
-
-                    # The second element is the Attribute
-                    Network.append(parts[1])
-
-                    # The rest are genes
-                    Genes.append('\t'.join(parts[2:]))
-
-        # Create a DataFrame from the lists
-        modules_df = pd.DataFrame({
-            'ID': Index,
-            'Network': Network,
-            'Genes': Genes
-        })
-        modules_df["ID"] = modules_df["ID"].astype(int)
-        modules_df = modules_df[modules_df["ID"].isin(network_modules)]
-        modules_df.loc[:, "Network_type"] = files.split(".")[0]        
-        save_module_genes(modules_df, study, genes_filepath, master_summary_path)
+            file.write("".join(f"{item}\n" for item in genes))
+        num_written += 1
+    return num_written
+
+def _save_module_genes(args):
+    return save_module_genes(*args)
+
+def extract_module_genes(study, genes_filepath, module_filepath, module_network_pair, master_summary_path, workers = 1):
+    # genes_filepath is kept for the command line: module files list every module gene, not only the scored ones
+    network_modules = module_network_pair.groupby("network")["moduleIndex"].agg(lambda indices: set(indices.astype(int))).to_dict()
+    tasks = []
+    for files in sorted(os.listdir(module_filepath)):
+        network = files.split(".")[0]
+        if network in network_modules and os.path.isfile(os.path.join(module_filepath,files)):
+            tasks.append((study, network, os.path.join(module_filepath,files), network_modules[network], master_summary_path))
+    countRows("networks", len(tasks))
+
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            num_written = sum(pool.imap_unordered(_save_module_genes, tasks))
+    else:
+        num_written = sum(save_module_genes(*task) for task in tasks)
+    countRows("modules", num_written)
+    return num_written
 
 
 if __name__ == "__main__":
@@ -97,8 +103,8 @@ if __name__ == "__main__":
     parser.add_argument('--module_filepath', '-module_filepath')
     parser.add_argument('--master_summary_path', '-master_summary_path')
     parser.add_argument('--study', '-study')
+    parser.add_argument('--workers', '-workers', type=int, default=1, help='number of networks exported in parallel')
 
     args = parser.parse_args()
-    dc_fishnet_module_genes(genes_filepath = args.genes_filepath, module_filepath = args.module_filepath, master_summary_path =  args.master_summary_path, study = args.study)
-
-
+    with stageTelemetry():
+        dc_fishnet_module_genes(genes_filepath = args.genes_filepath, module_filepath = args.module_filepath, master_summary_path =  args.master_summary_path, study = args.study, workers = args.workers)
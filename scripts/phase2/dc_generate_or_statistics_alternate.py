@@ -3,6 +3,9 @@ import pandas as pd
 import ast
 import os
 import math
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import stageTelemetry
 
 #Usage in generate_or_statistics.sbatch
 
@@ -116,6 +119,5 @@ if __name__ == "__main__":
     parser.add_argument('--output_path', '-output_path', help = "directory to store the parsed MMAP output")
     parser.add_argument('--network', '-network', help = "network type")
     args = parser.parse_args()
-    generate_or_statistics(gene_set_path = args.gene_set_path, master_summary_path = args.master_summary_path, trait = args.trait, module_path = args.module_path, go_path = args.go_path, study = args.study, output_path = args.output_path, network = args.network)
-
-
+    with stageTelemetry():
+        generate_or_statistics(gene_set_path = args.gene_set_path, master_summary_path = args.master_summary_path, trait = args.trait, module_path = args.module_path, go_path = args.go_path, study = args.study, output_path = args.output_path, network = args.network)
@@ -3,11 +3,19 @@ import pandas as pd
 import ast
 import os
 import math
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
+from randomPermutation import permute_scores
+from dc_mea_engine import go_summary_filepath, read_module_genes, enriched_go_genes, eligible_mea_genes, mea_passing_by_threshold, mea_passing_counts_of_ranked_ids
+from dc_go_index import load_go_index, go_genes_lookup
+from dc_summary_store import load_master_summary
+from dc_rank_matrix import load_rank_matrix
 
 
 #Usage in generate_rp_statistics.sbatch
 
-def generate_rp_statistics(gene_set_path, master_summary_path, trait, module_path, go_path, output_path, threshold, network, num_permutations ):
+def generate_rp_statistics(gene_set_path, master_summary_path, trait, module_path, go_path, output_path, threshold, network, num_permutations, go_index_path = None, root_seed = None, max_permutations = None, rank_matrix_path = None, permutation_start = 1 ):
     #print("Started")
     #print(gene_set_path)
     #print(master_summary_path)
@@ -16,155 +24,137 @@ def generate_rp_statistics(gene_set_path, master_summary_path, trait, module_pat
     #print(output_path)
     #print(threshold)
     #print(network)
-    final_df = pd.DataFrame(columns = ["threshold", "avg_mea_passing", "avgFraction_mea_passing", "FP_in_XXXX"])
-    threshold = int(threshold)
 
-    individual_stat_df = pd.DataFrame(columns = ["Rank", "MEA_passing_genes"])
-    #iterate through multiple threshold of gene ranks
+    #one or more comma-separated thresholds of gene ranks, all answered from the same pass over the permutations
+    thresholds = [int(t) for t in str(threshold).split(",")]
 
-    #save mea_passing genes and the fraction of mea-passing genes
-    mea_passing_genes_count_list= []
-    fraction_of_mea_passing_genes_count_list = []
+    #adaptive rounds only run permutations permutation_start..num_permutations, earlier ones are read from the previous round
+    permutation_start = int(permutation_start)
 
-    #read master summary files
-    master_summary = pd.read_csv(master_summary_path)
-    #print(master_summary.columns)
-    master_summary = master_summary[(master_summary["network"] == network)]    
+    #save mea_passing genes for every permutation (rows) and threshold (columns)
+    mea_passing_genes_counts = np.zeros((int(num_permutations) - permutation_start + 1, len(thresholds)), dtype=int)
 
-    #read modules
-    data = []
+    #read the significant modules of every permutation of the trait in this network once, grouped by permuted trait
+    master_summary = load_master_summary(master_summary_path, network = network, base_trait = trait, columns = ["trait", "moduleIndex"])
+    module_indices_of_trait = {permuted_trait: group["moduleIndex"] for permuted_trait, group in master_summary.groupby("trait", sort=False)}
+    no_modules = pd.Series([], dtype=np.int64)
 
-    with open(module_path, 'r') as file:
-        for line in file:
-            data.append(line.strip().split('\t'))
-    
-    # Convert the list of lists into a DataFrame
-    module_df = pd.DataFrame(data)
-    module_df.set_index(0, inplace=True)
-    module_df.index = module_df.index.astype(int)  # Ensure the index is -an integer
+    #read modules
+    module_genes = read_module_genes(module_path)
+
+    #enriched GO genes of each module, from the compiled GO index when available
+    go_index = load_go_index(go_index_path, network) if go_index_path is not None and os.path.exists(go_index_path) else None
+
+    #ranked genes of every permutation from the memory-mapped rank matrix (dc_rank_matrix.py) when available
+    rank_matrix = None
+    if rank_matrix_path is not None and os.path.exists(rank_matrix_path):
+        rank_matrix_genes, rank_matrix = load_rank_matrix(rank_matrix_path)
+        if rank_matrix.shape[0] < int(num_permutations):
+            print(f"{rank_matrix_path} has {rank_matrix.shape[0]} of {num_permutations} permutations, reading permutations instead")
+            rank_matrix = None
+        else:
+            rank_matrix_genes = pd.Series(rank_matrix_genes)
+            has_duplicates = len(rank_matrix_genes) < rank_matrix.shape[1]
+            num_genes = rank_matrix.shape[1]
+
+    #seed-addressable permutations are regenerated in memory from the unpermuted scores ({gene_set_path}/{trait}.csv)
+    if rank_matrix is None and root_seed is not None:
+        unpermuted_gene_set_df = pd.read_csv(os.path.join(gene_set_path,f"{trait}.csv"))
+        if 'Unnamed: 0' in unpermuted_gene_set_df.columns:
+            unpermuted_gene_set_df = unpermuted_gene_set_df.drop(columns=['Unnamed: 0'])
 
     #iterate through permutation files
     #change this to 5000 after testing the pipeline
-    for index in list(range(1,int(num_permutations)+1)):
+    for index in list(range(permutation_start,int(num_permutations)+1)):
         if(index % 100 == 0):
             print(index)
-        gene_set_df = pd.read_csv(os.path.join(gene_set_path,f"{index}-{trait}.csv"))
-        gene_set_df.columns = ["Gene", "pval"]
-        gene_set_df = gene_set_df.sort_values(by = ["pval"])
-        temp_gene_set_df = gene_set_df.head(threshold)
-        gene_set_series = temp_gene_set_df["Gene"]
+        if rank_matrix is None:
+            if root_seed is not None:
+                #the gene name column is permuted, as in RANDOM_PERMUTATION
+                gene_set_df = permute_scores(unpermuted_gene_set_df, unpermuted_gene_set_df.columns[0], index, root_seed)
+            else:
+                gene_set_df = pd.read_csv(os.path.join(gene_set_path,f"{index}-{trait}.csv"))
+            gene_set_df.columns = ["Gene", "pval"]
+            gene_set_df = gene_set_df.sort_values(by = ["pval"])
+            num_genes = gene_set_df.shape[0]
         permuted_trait = str(index) + "-" + trait
     
-        #process master summary file
-        temp_master_summary = master_summary[master_summary["trait"] == permuted_trait]
-        temp_master_summary = temp_master_summary.reset_index(drop=True)
-    
-        #get the number of MEA passing genes from the queried gene set
-        temp_mea_passing_genes_count = MEA_passing(module_df, permuted_trait, temp_master_summary, go_path,  gene_set_series, network )
-        
-        # save the outputs to the list
-        mea_passing_genes_count_list.append(temp_mea_passing_genes_count)
-        fraction_of_mea_passing_genes_count_list.append(temp_mea_passing_genes_count/threshold)
-
-    #save all individual permutation mea-passing genes
-    temp_stat_df = pd.DataFrame(columns = ["Rank", "MEA_passing_genes"])
-    temp_stat_df["Rank"] = [threshold] * len(mea_passing_genes_count_list)
-    temp_stat_df["MEA_passing_genes"] = mea_passing_genes_count_list
-    #individual_stat_df = individual_stat_df.append(temp_stat_df)
-    individual_stat_df = pd.concat([individual_stat_df, temp_stat_df], ignore_index=True)
-
-    #calculate the summary statistics and save in the final df     
-    average_mea_passing_genes_count_list = sum(mea_passing_genes_count_list)/ len(mea_passing_genes_count_list)
-    average_fraction_of_mea_passing_genes_count_list = sum(fraction_of_mea_passing_genes_count_list)/len(fraction_of_mea_passing_genes_count_list)
-    true_negatives = gene_set_df.shape[0] - average_mea_passing_genes_count_list
-    FPR = average_mea_passing_genes_count_list/(average_mea_passing_genes_count_list + true_negatives)
-    
-    if(FPR > 0):
-        FP_in_XXXX = 1/FPR
-    else:
-        FP_in_XXXX = -1
-    
-    final_df.loc[len(final_df.index)] = [threshold, average_mea_passing_genes_count_list, average_fraction_of_mea_passing_genes_count_list, FP_in_XXXX]
+        #significant modules of this permutation
+        module_indices = module_indices_of_trait.get(permuted_trait, no_modules)
+
+        #genes that lie in an enriched module and in an enriched GO term of that module for this permutation
+        if go_index is not None:
+            go_genes_of_module = go_genes_lookup(go_index, go_path, trait, permuted_trait, network)
+        else:
+            go_genes_of_module = lambda module_index: enriched_go_genes(go_summary_filepath(go_path, trait, permuted_trait, network, module_index))
+        eligible_genes = eligible_mea_genes(module_genes, module_indices, go_genes_of_module)
+
+        #get the number of MEA passing genes from the queried gene set at every threshold
+        if rank_matrix is not None:
+            mea_passing_genes_counts[index - permutation_start] = mea_passing_counts_of_ranked_ids(rank_matrix[index - 1], rank_matrix_genes.isin(eligible_genes).to_numpy(), thresholds, has_duplicates)
+        else:
+            mea_passing_genes_counts[index - permutation_start] = mea_passing_by_threshold(gene_set_df["Gene"], eligible_genes, thresholds)[0]
+    countRows("permutations", int(num_permutations) - permutation_start + 1)
+    countRows("thresholds", len(thresholds))
+    countRows("significantModules", master_summary.shape[0])
 
-    #write final df to the output directory
     if not os.path.exists(output_path):
         os.makedirs(output_path, exist_ok=True)
-    individual_stat_df.to_csv(os.path.join(output_path,f"{trait}_{threshold}_{network}_rp_mea_passing_across_{num_permutations}_permutations.csv"), index = None)
-    final_df.to_csv(os.path.join(output_path,f"{trait}_{threshold}_{network}_rp_summary_{num_permutations}_permutations.csv"), index = None)
-    #print("Completed")
-
-def extract_module_genes_by_index(module_df, index):
-    #print(index)
-    genes_row = module_df.loc[index].dropna().tolist()
 
-    # Exclude the first two columns (index and second column, assuming it's not a gene)
-    genes = genes_row[2:]
-    return genes
+    #adaptive permutations run the first num_permutations of a budget of max_permutations, output files are named after the budget
+    permutations_label = num_permutations if max_permutations is None else max_permutations
+
+    for column, threshold in enumerate(thresholds):
+        mea_passing_genes_count_list = mea_passing_genes_counts[:, column].tolist()
+        individual_stat_filepath = os.path.join(output_path,f"{trait}_{threshold}_{network}_rp_mea_passing_across_{permutations_label}_permutations.csv")
+        if permutation_start > 1:
+            previous_counts = pd.read_csv(individual_stat_filepath)["MEA_passing_genes"].tolist()
+            if len(previous_counts) != permutation_start - 1:
+                raise ValueError(f"{individual_stat_filepath} has {len(previous_counts)} permutations, expected {permutation_start - 1}")
+            mea_passing_genes_count_list = previous_counts + mea_passing_genes_count_list
+        fraction_of_mea_passing_genes_count_list = [count/threshold for count in mea_passing_genes_count_list]
+
+        #save all individual permutation mea-passing genes
+        individual_stat_df = pd.DataFrame({"Rank": [threshold] * len(mea_passing_genes_count_list),
+                                           "MEA_passing_genes": mea_passing_genes_count_list})
+
+        #calculate the summary statistics and save in the final df     
+        average_mea_passing_genes_count_list = sum(mea_passing_genes_count_list)/ len(mea_passing_genes_count_list)
+        average_fraction_of_mea_passing_genes_count_list = sum(fraction_of_mea_passing_genes_count_list)/len(fraction_of_mea_passing_genes_count_list)
+        true_negatives = num_genes - average_mea_passing_genes_count_list
+        FPR = average_mea_passing_genes_count_list/(average_mea_passing_genes_count_list + true_negatives)
+        
+        if(FPR > 0):
+            FP_in_XXXX = 1/FPR
+        else:
+            FP_in_XXXX = -1
+        
+        final_df = pd.DataFrame(columns = ["threshold", "avg_mea_passing", "avgFraction_mea_passing", "FP_in_XXXX"])
+        final_df.loc[len(final_df.index)] = [threshold, average_mea_passing_genes_count_list, average_fraction_of_mea_passing_genes_count_list, FP_in_XXXX]
 
-def get_GO_genes(go_df):
-    go_df = go_df[["geneSet", "description", "size", "overlap", "FDR", "userId"]]
-    go_df = go_df.sort_values(by = ["FDR"])
-    
-    #FDR threshold is set to 0.05
-    go_df = go_df[go_df["FDR"] <= 0.05]
-
-    #filter for genes annoted in enriched GO Term 
-    all_go_genes = []
-    for index, row in go_df.iterrows():
-        temp_go_set = row["userId"].split(";")
-        all_go_genes.extend(temp_go_set)
-    all_go_genes_set = set(all_go_genes)
-    return all_go_genes_set
-
-def MEA_passing(module_df, permuted_trait, temp_master_summary, go_path, gene_set, network):
-    if (temp_master_summary.shape[0]) > 0:
-        mea_passing_genes = []
-        for index in temp_master_summary.index:
-     
-            #find the genes that lie in enriched modules
-            module_index = temp_master_summary["moduleIndex"][index]
-            module_index = int(module_index)
-            module_genes = extract_module_genes_by_index(module_df, module_index)
-
-            #genes intersecting between the first criteria and the second criteria for MEA-passing genes for a given module
-            module_genes_intersection_gene_set = set(gene_set).intersection(set(module_genes))
-
-            #find the genes that also lie in enriched GO Term for the enriched module        
-            go_directory = "GO_summaries_" + permuted_trait + "_" + network
-            trait = permuted_trait.split("-")[1]
-            go_file = "sig_" + trait + "_" + permuted_trait + "_" + network + "_" + str(module_index) + ".csv"
-            go_df = pd.read_csv(os.path.join(go_path,go_directory,go_file))
-
-
-            if (go_df.shape[0] > 0):
-                all_go_genes_set = get_GO_genes(go_df)
-                set_qualifying_genes = module_genes_intersection_gene_set.intersection(all_go_genes_set)
-                mea_passing_genes.extend(list(set_qualifying_genes))
-
-
-        #return the count of the number of MEA_passing genes
-        set_mea_passing_genes = set(mea_passing_genes)
-        # if len(set(mea_passing_genes)) > 0:
-        #     print("module genes:" + str(module_genes))
-        #     print("module index:" + str(module_index))
-        #     print("go_genes:" + str(all_go_genes_set))
-        #     print("mea_passing_genes: " + str(set(mea_passing_genes)))
-        return len(set_mea_passing_genes)
-    else:
-        return 0
+        #write final df to the output directory
+        individual_stat_df.to_csv(individual_stat_filepath, index = None)
+        final_df.to_csv(os.path.join(output_path,f"{trait}_{threshold}_{network}_rp_summary_{permutations_label}_permutations.csv"), index = None)
+    #print("Completed")
 
 if __name__ == "__main__":
     from argparse import ArgumentParser   
     parser = ArgumentParser()
     parser.add_argument('--gene_set_path', '-gene_set_path', help='the path to the file that has genes and pvalues for a given trait')
-    parser.add_argument('--master_summary_path', '-master_summary_path', help='the path to the master summary file')
+    parser.add_argument('--master_summary_path', '-master_summary_path', help='the path to the master summary store (dc_summary_store.py) or filtered master summary file')
     parser.add_argument('--trait', '-trait', help='trait')
     parser.add_argument('--module_path', '-module_path', help='path to the module genes')
     parser.add_argument('--go_path', '-go_path', help='path to enriched go terms')
     parser.add_argument('--output_path', '-output_path', help = "directory to store the output")
-    parser.add_argument('--threshold', '-threshold', help = "top X genes to look at")
+    parser.add_argument('--threshold', '-threshold', help = "top X genes to look at (comma-separated to compute several thresholds in one pass)")
     parser.add_argument('--network', '-network', help = "network type")
     parser.add_argument('--num_permutations', help='number of permutations')
+    parser.add_argument('--go_index_path', '-go_index_path', help = "compiled GO index (dc_go_index.py); GO summary CSVs are read when absent")
+    parser.add_argument('--max_permutations', '-max_permutations', default=None, help = "permutation budget of adaptive permutations, used to name the output files (default: num_permutations)")
+    parser.add_argument('--root_seed', '-root_seed', type=int, default=None, help = "regenerate seed-addressable permutations of {gene_set_path}/{trait}.csv in memory instead of reading permutation files")
+    parser.add_argument('--rank_matrix_path', '-rank_matrix_path', default=None, help = "rank matrix of the permutations (dc_rank_matrix.py); permutations are read or regenerated when absent")
+    parser.add_argument('--permutation_start', '-permutation_start', type=int, default=1, help = "first permutation to run; the counts of the earlier ones are read from the mea_passing_across file of the previous adaptive round")
 
     args = parser.parse_args()
-    generate_rp_statistics(gene_set_path = args.gene_set_path, master_summary_path = args.master_summary_path, trait = args.trait, module_path = args.module_path, go_path = args.go_path, output_path = args.output_path, threshold = args.threshold, network = args.network, num_permutations = args.num_permutations)
+    with stageTelemetry():
+        generate_rp_statistics(gene_set_path = args.gene_set_path, master_summary_path = args.master_summary_path, trait = args.trait, module_path = args.module_path, go_path = args.go_path, output_path = args.output_path, threshold = args.threshold, network = args.network, num_permutations = args.num_permutations, go_index_path = args.go_index_path, root_seed = args.root_seed, max_permutations = args.max_permutations, rank_matrix_path = args.rank_matrix_path, permutation_start = args.permutation_start)
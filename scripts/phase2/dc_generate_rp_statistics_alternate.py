@@ -3,6 +3,9 @@ import pandas as pd
 import ast
 import os
 import math
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import stageTelemetry
 
 
 #Usage in generate_rp_statistics.sbatch
@@ -146,4 +149,5 @@ if __name__ == "__main__":
     parser.add_argument('--network', '-network', help = "network type")
 
     args = parser.parse_args()
-    generate_rp_statistics(gene_set_path = args.gene_set_path, master_summary_path = args.master_summary_path, trait = args.trait, module_path = args.module_path, go_path = args.go_path, output_path = args.output_path, threshold = args.threshold, network = args.network)
+    with stageTelemetry():
+        generate_rp_statistics(gene_set_path = args.gene_set_path, master_summary_path = args.master_summary_path, trait = args.trait, module_path = args.module_path, go_path = args.go_path, output_path = args.output_path, threshold = args.threshold, network = args.network)
@@ -0,0 +1,109 @@
+import numpy as np
+import os
+from dc_mea_engine import enriched_go_genes, go_summary_filepath
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
+
+
+# python dc_go_index.py
+#   --go_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSORKB/GO_summaries/
+#   --output_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSORKB/go_index_twasLLFSORKB.npz
+#
+# Compiles every GO summary (sig_{study}_{trait}_{network}_{moduleIndex}.csv) written by GO_ANALYSIS into a
+# single .npz file mapping (trait, network, moduleIndex) to the genes of GO terms with FDR <= fdr_threshold.
+# Genes are interned into one table and the per-module gene lists are stored as CSR indptr/indices arrays,
+# so phase 2 reads one file instead of one CSV per significant module, threshold and permutation.
+
+def build_go_index(go_path, output_path, fdr_threshold = 0.05):
+    traits = []
+    networks = []
+    module_indices = []
+    indptr = [0]
+    indices = []
+    gene_ids = {}
+
+    for root, dirs, files in os.walk(go_path):
+        dirs.sort()
+        for file in sorted(files):
+            if not (file.startswith("sig_") and file.endswith(".csv")):
+                continue
+            # study, trait and network names do not contain '_'
+            fields = file[:-len(".csv")].split("_")
+            if len(fields) != 5:
+                raise ValueError(f"{file} is not sig_{{study}}_{{trait}}_{{network}}_{{moduleIndex}}.csv; study, trait and network names must not contain '_'")
+            study, trait, network, module_index = fields[1:]
+            go_genes = enriched_go_genes(os.path.join(root, file), fdr_threshold)
+
+            traits.append(trait)
+            networks.append(network)
+            module_indices.append(int(module_index))
+            for gene in sorted(go_genes):
+                indices.append(gene_ids.setdefault(gene, len(gene_ids)))
+            indptr.append(len(indices))
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    np.savez(output_path,
+             genes = np.array(list(gene_ids), dtype=str),
+             trait = np.array(traits, dtype=str),
+             network = np.array(networks, dtype=str),
+             module_index = np.array(module_indices, dtype=np.int64),
+             indptr = np.array(indptr, dtype=np.int64),
+             indices = np.array(indices, dtype=np.int32),
+             fdr_threshold = np.array(fdr_threshold))
+    print(f"\tSaved enriched GO genes of {len(module_indices)} modules to {output_path}")
+    countRows("modules", len(module_indices))
+
+def load_go_index(index_path, network = None):
+    """
+    Load a GO index written by build_go_index.
+
+    Args:
+        index_path (str): path to the .npz GO index
+        network (str): only load the modules of this network. Loads every network if None.
+
+    Returns:
+        dict of (trait, network, moduleIndex) -> set of genes in enriched GO terms of the module
+    """
+    with np.load(index_path, allow_pickle=False) as index:
+        genes = index["genes"]
+        traits = index["trait"]
+        networks = index["network"]
+        module_indices = index["module_index"]
+        indptr = index["indptr"]
+        indices = index["indices"]
+
+    go_index = {}
+    for i in np.flatnonzero(networks == network) if network is not None else range(len(traits)):
+        go_genes = set(genes[indices[indptr[i]:indptr[i+1]]].tolist())
+        go_index[(str(traits[i]), str(networks[i]), int(module_indices[i]))] = go_genes
+    return go_index
+
+def go_genes_lookup(go_index, go_path, study, trait, network):
+    """
+    module index -> enriched GO genes of a module of (trait, network), from the GO index.
+
+    A module missing from the index (e.g. an index built before every GO_ANALYSIS task finished) is read from its
+    GO summary, which fails if the summary does not exist either.
+    """
+    def go_genes_of_module(module_index):
+        key = (trait, network, int(module_index))
+        if key in go_index:
+            return go_index[key]
+        go_filepath = go_summary_filepath(go_path, study, trait, network, module_index)
+        print(f"{key} is not in the GO index, reading {go_filepath}")
+        return enriched_go_genes(go_filepath)
+    return go_genes_of_module
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--go_path', '-go_path', help='path to the GO summaries directory of a study')
+    parser.add_argument('--output_path', '-output_path', help='path to the .npz GO index to write')
+    parser.add_argument('--FDR_threshold', '-FDR_threshold', type=float, default=0.05, help='FDR cutoff for enriched GO terms')
+    args = parser.parse_args()
+    with stageTelemetry():
+        build_go_index(go_path = args.go_path, output_path = args.output_path, fdr_threshold = args.FDR_threshold)
@@ -4,6 +4,9 @@ import ast
 import os
 import math
 import scipy.stats as stats
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import stageTelemetry
 
 
 def identify_mea_passing_genes(trait, geneset_input, FDR_threshold, percentile_threshold, network, input_path, num_permutations ):
@@ -85,6 +88,5 @@ if __name__ == "__main__":
     parser.add_argument("--num_permutations")
     
     args = parser.parse_args()
-    identify_mea_passing_genes(trait = args.trait, geneset_input = args.geneset_input, FDR_threshold = args.FDR_threshold, percentile_threshold = args.percentile_threshold, network = args.network, input_path = args.input_path, num_permutations = args.num_permutations)
-
-
+    with stageTelemetry():
+        identify_mea_passing_genes(trait = args.trait, geneset_input = args.geneset_input, FDR_threshold = args.FDR_threshold, percentile_threshold = args.percentile_threshold, network = args.network, input_path = args.input_path, num_permutations = args.num_permutations)
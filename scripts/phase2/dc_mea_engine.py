@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from compiledNetwork import loadNetwork
+
+# Shared MEA-passing counting engine used by dc_generate_or_statistics.py and dc_generate_rp_statistics.py
+#
+# A gene is MEA-passing at rank k if it is among the top-k genes of the trait AND it lies in an enriched
+# module AND it is annotated in an enriched GO term (FDR <= 0.05) of that module. The last two criteria do
+# not depend on k, so the union of (module genes & enriched GO genes) over the significant modules of a
+# (trait, network) pair is built once and every threshold is answered from one cumulative sum over the
+# ranked gene list.
+
+
+def rank_thresholds(num_genes):
+    """Gene rank thresholds used in phase 2: every 10 genes up to the top 25% of the ranked genes."""
+    end_point = int((num_genes * 0.25)//1)
+    thresholds_range = list(range(10,end_point,10))
+    if thresholds_range[-1] != end_point:
+        thresholds_range.append(end_point)
+    return thresholds_range
+
+def go_summary_filepath(go_path, study, trait, network, module_index):
+    """Path to the ORA summary written by GO_ANALYSIS for one significant module."""
+    go_directory = "GO_summaries_" + trait + "_" + network
+    go_file = "sig_" + study + "_" + trait + "_" + network + "_" + str(module_index) + ".csv"
+    return os.path.join(go_path, go_directory, go_file)
+
+def read_module_genes(module_path):
+    """
+    Read a module file (index, score, genes...) into a dict of module index -> list of module genes.
+    For a compiled network, a mapping that only gathers the genes of the modules looked up.
+    """
+    network = loadNetwork(module_path)
+    if network is not None:
+        return network.moduleMap()
+    module_genes = {}
+    with open(module_path, 'r') as file:
+        for line in file:
+            parts = line.strip().split('\t')
+            module_genes[int(parts[0])] = parts[2:]  # skip the first two columns (module_index and score)
+    return module_genes
+
+def enriched_go_genes(go_filepath, fdr_threshold = 0.05):
+    """Set of genes annotated in the GO terms of one ORA summary with FDR <= fdr_threshold."""
+    go_df = pd.read_csv(go_filepath)
+    if go_df.shape[0] == 0:
+        return set()
+    go_df = go_df[go_df["FDR"] <= fdr_threshold]
+    return set(";".join(go_df["userId"].astype(str)).split(";")) if go_df.shape[0] > 0 else set()
+
+def eligible_mea_genes(module_genes, module_indices, go_genes_of_module):
+    """
+    Union over the significant modules of (module genes & enriched GO genes of the module).
+
+    Args:
+        module_genes (dict): module index -> list of module genes
+        module_indices (iterable): indices of the significant modules of the (trait, network) pair
+        go_genes_of_module (callable): module index -> set of genes in enriched GO terms of the module
+
+    Returns:
+        set of genes that pass the module and GO criteria of MEA
+    """
+    eligible_genes = set()
+    for module_index in module_indices:
+        module_index = int(module_index)
+        go_genes = go_genes_of_module(module_index)
+        if len(go_genes) > 0:
+            eligible_genes.update(go_genes.intersection(module_genes.get(module_index, [])))
+    return eligible_genes
+
+def mea_passing_by_threshold(ranked_genes, eligible_genes, thresholds):
+    """
+    Count MEA-passing genes among the top-k ranked genes for every k in thresholds with one cumulative sum.
+
+    Args:
+        ranked_genes (sequence): genes sorted by ascending p-value
+        eligible_genes (set): output of eligible_mea_genes
+        thresholds (sequence): gene rank thresholds
+
+    Returns:
+        (np.ndarray of MEA-passing gene counts per threshold, list of MEA-passing gene lists per threshold)
+    """
+    ranked_genes = pd.Series(ranked_genes).reset_index(drop=True)
+    # a gene counts once even if it appears more than once in the score file
+    is_passing = ranked_genes.isin(eligible_genes).to_numpy() & ~ranked_genes.duplicated().to_numpy()
+    cumulative_passing = np.concatenate([[0], np.cumsum(is_passing)])
+    thresholds = np.minimum(np.asarray(thresholds, dtype=int), len(ranked_genes))
+    counts = cumulative_passing[thresholds]
+
+    passing_genes_in_rank_order = ranked_genes[is_passing].tolist()
+    passing_genes = [passing_genes_in_rank_order[:count] for count in counts]
+    return counts, passing_genes
+
+def mea_passing_counts_of_ranked_ids(ranked_ids, is_eligible, thresholds, has_duplicates = False):
+    """
+    mea_passing_by_threshold counts of one row of a rank matrix (dc_rank_matrix.py).
+
+    Args:
+        ranked_ids (np.ndarray): gene ids sorted by ascending p-value
+        is_eligible (np.ndarray): bool per gene id, True for the genes of eligible_mea_genes
+        thresholds (sequence): gene rank thresholds
+        has_duplicates (bool): a gene id may appear more than once in ranked_ids
+
+    Returns:
+        np.ndarray of MEA-passing gene counts per threshold
+    """
+    is_passing = is_eligible[ranked_ids]
+    if has_duplicates:
+        # a gene counts once, at its first rank
+        first_rank = np.zeros(len(ranked_ids), dtype=bool)
+        first_rank[np.unique(ranked_ids, return_index=True)[1]] = True
+        is_passing &= first_rank
+    cumulative_passing = np.concatenate([[0], np.cumsum(is_passing)])
+    return cumulative_passing[np.minimum(np.asarray(thresholds, dtype=int), len(ranked_ids))]
+
+def load_rp_matrix(input_path, rr_id, input_file_rr_id, network, num_permutations, ranks):
+    """
+    Load the MEA-passing gene counts of every permutation at every rank into one matrix.
+
+    Returns:
+        (list of ranks with a permutation file, ranks x permutations int matrix)
+    """
+    found_ranks = []
+    rows = []
+    for rank in ranks:
+        rp_file = os.path.join(input_path, rr_id, "results/raw", f"{input_file_rr_id}_{rank}_{network}_rp_mea_passing_across_{num_permutations}_permutations.csv")
+        if os.path.exists(rp_file):
+            # columns: Rank, MEA_passing_genes
+            rows.append(np.loadtxt(rp_file, delimiter=",", skiprows=1, usecols=1, dtype=np.int64, ndmin=1))
+            found_ranks.append(rank)
+        else:
+            print(f"FILE-NOT-FOUND: {rp_file}")
+    if len(set(len(row) for row in rows)) > 1:
+        raise ValueError(f"permutation files of {input_file_rr_id} {network} differ in number of permutations")
+    return found_ranks, np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.int64)
@@ -4,29 +4,17 @@ import ast
 import os
 import math
 import scipy.stats as stats
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import stageTelemetry
+from dc_edge_store import load_edge_store
+from dc_mea_engine import read_module_genes
 
 
 #New inputs
 #network_connections_path -- points to the network connection input by the user in the web platform
 #module_path -- module path points to data/modules/
 
-def extract_genes_from_module(module_index, module_path, network):
-    genes = []
-
-    with open(module_path + network + ".txt", 'r') as file:
-        for line in file:
-            parts = line.strip().split('\t')
-            if int(parts[0]) == module_index:
-                genes = parts[2:]  # skip the first two columns (module_index and score)
-                break
-    return genes    
-
-def concat_strings(row):
-    if row['Source'].lower() < row['Target'].lower():
-        return row['Source'] + row['Target']
-    else:
-        return row['Target'] + row['Source']
-
 def identify_mea_passing_genes(trait, geneset_input, network, input_path, network_connections_path, module_path):
     trait = "0-" + trait
     #initialize output df
@@ -78,20 +66,16 @@ def identify_mea_passing_genes(trait, geneset_input, network, input_path, networ
         significant_modules_df = significant_modules_df[(significant_modules_df["trait"] == trait) &
                                                      (significant_modules_df["network"] == network)]
         if significant_modules_df.shape[0] > 0:
-            network_connections = pd.read_table(network_connections_path + network + ".txt")
+            # edges of every significant module from one pass over the compiled adjacency of their genes
+            edge_store = load_edge_store(network_connections_path + network + ".txt")
             significant_modules = significant_modules_df["moduleIndex"].tolist()
+            module_genes = read_module_genes(module_path + network + ".txt")
+            module_edges = edge_store.induced_edges([module_genes.get(int(module_index), []) for module_index in significant_modules])
 
-            for module_index in significant_modules:
-                module_genes = extract_genes_from_module(module_index, module_path, network) 
-
-                network_temp = network_connections[(network_connections["Source"].isin(module_genes)) &
-                                                     (network_connections["Target"].isin(module_genes))]
-                if(network_temp.shape[0] > 0):
-                    network_temp['concatenated_col'] = network_temp.apply(concat_strings, axis=1)
-                    if network_temp['concatenated_col'].unique().shape[0] < network_temp.shape[0]:
-                        network_temp.drop_duplicates(subset='concatenated_col', keep='first', inplace=True)
+            for module_index, edge_ids in zip(significant_modules, module_edges):
+                if len(edge_ids) > 0:
                     os.makedirs(input_path + "significant_module_connections", exist_ok=True)
-                    network_temp = network_temp[["Source", "Target", "Score"]]
+                    network_temp = edge_store.edge_table(edge_ids)
                     network_temp.to_csv(input_path + "significant_module_connections/" + trait + "_" + network + "_" + str(module_index) + ".txt", sep = "\t", index = None)
 
 if __name__ == "__main__":
@@ -105,6 +89,5 @@ if __name__ == "__main__":
     parser.add_argument("--module_path", '-module_path')
     
     args = parser.parse_args()
-    identify_mea_passing_genes(trait = args.trait, geneset_input = args.geneset_input, network = args.network, input_path = args.input_path, network_connections_path = args.network_connections_path,module_path = args.module_path )
-
-
+    with stageTelemetry():
+        identify_mea_passing_genes(trait = args.trait, geneset_input = args.geneset_input, network = args.network, input_path = args.input_path, network_connections_path = args.network_connections_path,module_path = args.module_path )
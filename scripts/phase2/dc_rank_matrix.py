@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
+from randomPermutation import permutation_order
+
+
+# python dc_rank_matrix.py
+#   --gene_set_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSRR/RPscores/twasLLFSRR/
+#   --trait twasLLFSRR
+#   --num_permutations 1000
+#   --matrix_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSRR/rank_matrix_twasLLFSRR.npy
+#   [--root_seed 42]
+#   [--permutation_start 101 --max_permutations 1000]
+#
+# Ranked genes of every permutation as one permutations x genes int32 matrix of gene ids: row i-1 lists the genes
+# of permutation i by ascending pval, as the sort_values of dc_generate_rp_statistics.py. Gene symbols are in
+# {matrix}_genes.txt. The matrix is built once per trait, and every (threshold, network) task of the RP statistics
+# memory-maps it, so the top k genes of a permutation are a slice instead of a csv parse and a sort.
+# Seed-addressable permutations only shuffle the gene column, so their pval order is computed once.
+# Adaptive permutation rounds allocate max_permutations rows in the first round and each later round fills only the
+# rows of its own permutations (permutation_start..num_permutations) in place.
+
+def genes_filepath(matrix_path):
+    return os.path.splitext(matrix_path)[0] + "_genes.txt"
+
+def build_rank_matrix(gene_set_path, trait, num_permutations, matrix_path, root_seed = None, permutation_start = 1, max_permutations = None):
+    """
+    Write the rank matrix of permutations 1..num_permutations of a trait.
+
+    Args:
+        gene_set_path (str): directory of the {index}-{trait}.csv permutation files, or of {trait}.csv with root_seed
+        trait (str): trait of the permutations
+        num_permutations (int): number of permutations
+        matrix_path (str): .npy file to write
+        root_seed (int): regenerate seed-addressable permutations of {trait}.csv instead of reading permutation files
+        permutation_start (int): first permutation to write. Rows of earlier permutations are kept from the existing matrix
+        max_permutations (int): rows of the matrix when it is created (default: num_permutations)
+    """
+    num_permutations = int(num_permutations)
+    permutation_start = int(permutation_start)
+    num_rows = num_permutations if max_permutations is None else int(max_permutations)
+    gene_ids = {}
+    matrix = None
+    if permutation_start > 1:
+        # gene ids of the existing matrix stay valid, new genes are appended
+        genes, matrix = load_rank_matrix(matrix_path, mode = "r+")
+        gene_ids = {gene: i for i, gene in enumerate(genes)}
+        if matrix.shape[0] < num_permutations:
+            raise ValueError(f"{matrix_path} has {matrix.shape[0]} rows, fewer than {num_permutations} permutations")
+    if root_seed is not None:
+        unpermuted_gene_set_df = pd.read_csv(os.path.join(gene_set_path, f"{trait}.csv"))
+        if 'Unnamed: 0' in unpermuted_gene_set_df.columns:
+            unpermuted_gene_set_df = unpermuted_gene_set_df.drop(columns=['Unnamed: 0'])
+        unpermuted_gene_set_df = unpermuted_gene_set_df.iloc[:, :2]
+        unpermuted_gene_set_df.columns = ["Gene", "pval"]
+        ids = np.array([gene_ids.setdefault(gene, len(gene_ids)) for gene in unpermuted_gene_set_df["Gene"]], dtype=np.int32)
+        # the pval column is never permuted
+        pval_order = unpermuted_gene_set_df.sort_values(by = ["pval"]).index.to_numpy()
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.int32, shape=(num_rows, len(ids)))
+        for index in range(permutation_start, num_permutations + 1):
+            matrix[index - 1] = ids[permutation_order(len(ids), index, root_seed)][pval_order]
+    else:
+        for index in range(permutation_start, num_permutations + 1):
+            gene_set_df = pd.read_csv(os.path.join(gene_set_path, f"{index}-{trait}.csv"))
+            gene_set_df.columns = ["Gene", "pval"]
+            ranked_genes = gene_set_df.sort_values(by = ["pval"])["Gene"]
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.int32, shape=(num_rows, len(ranked_genes)))
+            matrix[index - 1] = [gene_ids.setdefault(gene, len(gene_ids)) for gene in ranked_genes]
+    matrix.flush()
+    countRows("permutations", num_permutations - permutation_start + 1)
+    with open(genes_filepath(matrix_path), "w") as f:
+        f.write("".join(f"{gene}\n" for gene in gene_ids))
+    print(f"\tSaved ranked genes of permutations {permutation_start}-{num_permutations} of {trait} to {matrix_path}")
+
+def load_rank_matrix(matrix_path, mode = "r"):
+    """(np.ndarray of gene symbols by gene id, memory-mapped permutations x genes rank matrix)"""
+    with open(genes_filepath(matrix_path), "r") as f:
+        genes = np.array(f.read().splitlines(), dtype=object)
+    return genes, np.load(matrix_path, mmap_mode=mode)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--gene_set_path', '-gene_set_path', help='directory of the permutation files, or of the unpermuted scores with --root_seed')
+    parser.add_argument('--trait', '-trait', help='trait')
+    parser.add_argument('--num_permutations', '-num_permutations', type=int, help='number of permutations')
+    parser.add_argument('--matrix_path', '-matrix_path', help='.npy rank matrix to write')
+    parser.add_argument('--root_seed', '-root_seed', type=int, default=None, help='regenerate seed-addressable permutations in memory instead of reading permutation files')
+    parser.add_argument('--permutation_start', '-permutation_start', type=int, default=1, help='first permutation to write into an existing matrix (adaptive rounds)')
+    parser.add_argument('--max_permutations', '-max_permutations', type=int, default=None, help='rows of the matrix when it is created (default: num_permutations)')
+    args = parser.parse_args()
+    with stageTelemetry():
+        build_rank_matrix(gene_set_path = args.gene_set_path, trait = args.trait, num_permutations = args.num_permutations, matrix_path = args.matrix_path, root_seed = args.root_seed,
+                          permutation_start = args.permutation_start, max_permutations = args.max_permutations)
@@ -0,0 +1,92 @@
+import math
+import os
+from dc_generate_rp_statistics import generate_rp_statistics
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
+
+
+# python dc_rp_statistics_tasks.py
+#   --pairs_path /scratch/mblab/acharyas/fishnet/pipeline/tmp/tmp.threshold_network_pairs
+#   --shard 3/40
+#   --module_path /scratch/mblab/acharyas/fishnet/pipeline/data/modules/ker_based/
+#   --gene_set_path ... --master_summary_path ... --trait ... --go_path ... --output_path ... --num_permutations ...
+#   [--go_index_path ...] [--root_seed ...] [--max_permutations ...] [--rank_matrix_path ...] [--permutation_start ...]
+#
+# Packed execution of dc_generate_rp_statistics.py: one SLURM array element runs a shard of the
+# (threshold, network) pairs instead of a single pair. Pairs of the same network in a shard go to one
+# generate_rp_statistics call, so the master summary, modules, GO index and permutations are loaded once per
+# network of the shard, and every threshold is answered from the same pass over the permutations.
+
+def parse_shard(shard):
+    """'i/N' -> (i, N) with 1 <= i <= N."""
+    index, num_shards = (int(part) for part in str(shard).split("/"))
+    if not 1 <= index <= num_shards:
+        raise ValueError(f"shard {shard} is not in 1/{num_shards}..{num_shards}/{num_shards}")
+    return index, num_shards
+
+def read_pairs(pairs_path):
+    """(threshold, network) pairs of a tab-delimited file written by fishnet.sh."""
+    pairs = []
+    with open(pairs_path, "r") as f:
+        for line in f:
+            if line.strip():
+                threshold, network = line.rstrip("\n").split("\t")
+                pairs.append((threshold, network))
+    return pairs
+
+def shard_pairs(pairs, index, num_shards):
+    """Contiguous block of pairs of shard index (1-based), so a shard spans as few networks as possible."""
+    block = math.ceil(len(pairs) / num_shards)
+    return pairs[(index - 1) * block:index * block]
+
+def run_rp_statistics_shard(pairs_path, shard, module_path, **rp_statistics_args):
+    """
+    Run generate_rp_statistics for every pair of one shard.
+
+    Args:
+        pairs_path (str): tab-delimited (threshold, network) pairs
+        shard (str): 'i/N', the i-th of N shards
+        module_path (str): directory of the network module files
+        rp_statistics_args: the other arguments of generate_rp_statistics
+    """
+    index, num_shards = parse_shard(shard)
+    pairs = shard_pairs(read_pairs(pairs_path), index, num_shards)
+
+    thresholds_of_network = {}
+    for threshold, network in pairs:
+        thresholds_of_network.setdefault(network, []).append(threshold)
+
+    print(f"shard {index}/{num_shards}: {len(pairs)} pairs of {len(thresholds_of_network)} networks")
+    countRows("pairs", len(pairs))
+    for network, thresholds in thresholds_of_network.items():
+        print(f"{network}: thresholds {thresholds[0]}..{thresholds[-1]}")
+        generate_rp_statistics(module_path = os.path.join(module_path, f"{network}.txt"), threshold = ",".join(thresholds),
+                               network = network, **rp_statistics_args)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--pairs_path', '-pairs_path', help='tab-delimited file of (threshold, network) pairs')
+    parser.add_argument('--shard', '-shard', default='1/1', help='i/N: run the i-th of N blocks of pairs (default: every pair)')
+    parser.add_argument('--module_path', '-module_path', help='directory of the network module files')
+    parser.add_argument('--gene_set_path', '-gene_set_path', help='the path to the file that has genes and pvalues for a given trait')
+    parser.add_argument('--master_summary_path', '-master_summary_path', help='the path to the master summary store (dc_summary_store.py) or filtered master summary file')
+    parser.add_argument('--trait', '-trait', help='trait')
+    parser.add_argument('--go_path', '-go_path', help='path to enriched go terms')
+    parser.add_argument('--output_path', '-output_path', help = "directory to store the output")
+    parser.add_argument('--num_permutations', help='number of permutations')
+    parser.add_argument('--go_index_path', '-go_index_path', help = "compiled GO index (dc_go_index.py); GO summary CSVs are read when absent")
+    parser.add_argument('--max_permutations', '-max_permutations', default=None, help = "permutation budget of adaptive permutations, used to name the output files (default: num_permutations)")
+    parser.add_argument('--root_seed', '-root_seed', type=int, default=None, help = "regenerate seed-addressable permutations of {gene_set_path}/{trait}.csv in memory instead of reading permutation files")
+    parser.add_argument('--rank_matrix_path', '-rank_matrix_path', default=None, help = "rank matrix of the permutations (dc_rank_matrix.py); permutations are read or regenerated when absent")
+    parser.add_argument('--permutation_start', '-permutation_start', type=int, default=1, help = "first permutation to run; the counts of the earlier ones are read from the mea_passing_across file of the previous adaptive round")
+
+    args = parser.parse_args()
+    with stageTelemetry():
+        run_rp_statistics_shard(pairs_path = args.pairs_path, shard = args.shard, module_path = args.module_path,
+                                gene_set_path = args.gene_set_path, master_summary_path = args.master_summary_path, trait = args.trait,
+                                go_path = args.go_path, output_path = args.output_path, num_permutations = args.num_permutations,
+                                go_index_path = args.go_index_path, root_seed = args.root_seed, max_permutations = args.max_permutations,
+                                rank_matrix_path = args.rank_matrix_path, permutation_start = args.permutation_start)
@@ -4,9 +4,60 @@ import ast
 import os
 import math
 import scipy.stats as stats
+from dc_mea_engine import load_rp_matrix
+from dc_adaptive_permutations import curtailed_decisions
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
 
 
-def summary_statistics_rp(trait, input_path, or_id, input_file_rr_id, rr_id, network, output_path, num_permutations):
+def rank_permutation_statistics(ranks, rp_matrix, original_counts):
+    """
+    Summary statistics of every rank at once, computed along the permutation axis.
+
+    Args:
+        ranks (list): gene rank thresholds, one per row of rp_matrix
+        rp_matrix (np.ndarray): ranks x permutations MEA-passing gene counts
+        original_counts (np.ndarray): MEA-passing gene count of the original run at every rank
+
+    Returns:
+        pd.DataFrame with one row per rank
+    """
+    summary_columns = ["Ranks", "Average", "Median", "sd", "confidence_interval_95", "90_percentile", "95_percentile", "FDR", "num_MEA_passing", "original_run_percentile"]
+    if len(ranks) == 0:
+        return pd.DataFrame(columns = summary_columns)
+    num_permutations = rp_matrix.shape[1]
+    mean = np.mean(rp_matrix, axis=1)
+
+    #calculate confidence interval
+    confidence_level = 0.95
+    ci_low, ci_high = stats.t.interval(confidence_level, num_permutations - 1, mean, stats.sem(rp_matrix, axis=1))
+
+    #calculate 90 percent and 95 percent confidence interval
+    ninety_percentile, ninety_five_percentile = np.percentile(rp_matrix, [90, 95], axis=1)
+
+    #calculate FDR
+    original_counts = np.asarray(original_counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        FDR = np.where(original_counts != 0, mean / original_counts, np.nan)
+
+    #calculate original run percentile, as stats.percentileofscore(kind='rank') of each row
+    below = np.sum(rp_matrix < original_counts[:, None], axis=1)
+    below_or_equal = np.sum(rp_matrix <= original_counts[:, None], axis=1)
+    or_percentile = (below + below_or_equal + (below < below_or_equal)) * (50.0 / num_permutations)
+
+    return pd.DataFrame({"Ranks": ranks,
+                         "Average": mean,
+                         "Median": np.median(rp_matrix, axis=1),
+                         "sd": np.std(rp_matrix, axis=1),
+                         "confidence_interval_95": [str(low) + ":" + str(high) for low, high in zip(ci_low, ci_high)],
+                         "90_percentile": ninety_percentile,
+                         "95_percentile": ninety_five_percentile,
+                         "FDR": FDR,
+                         "num_MEA_passing": original_counts,
+                         "original_run_percentile": or_percentile}, columns = summary_columns)
+
+def summary_statistics_rp(trait, input_path, or_id, input_file_rr_id, rr_id, network, output_path, num_permutations, percentile_threshold = None):
     #load original and rp_all_output dataframes
     trait = "0-" + trait
     original_run_summary_filepath = os.path.join(input_path,or_id,"results","raw",f"{network}_{trait}_{network}_or_summary.csv")
@@ -15,65 +66,24 @@ def summary_statistics_rp(trait, input_path, or_id, input_file_rr_id, rr_id, net
     else:
         print(f"FILE-NOT-FOUND: {original_run_summary_filepath}")
         return     
-    summary_df = pd.DataFrame(columns = ["Ranks", "Average", "Median", "sd", "confidence_interval_95", "90_percentile", "95_percentile", "FDR", "num_MEA_passing", "original_run_percentile"])
-
-    #rp_all_output_df["Rank"].unique()
-    for rank in original_run_summary_df["threshold"]:
-        # rank = (rank // 5) * 5 
-
-        rank = int(rank)
-        rp_file = os.path.join(input_path, rr_id, "results/raw", f"{input_file_rr_id}_{rank}_{network}_rp_mea_passing_across_{num_permutations}_permutations.csv")
-        if os.path.exists(rp_file):
-            rp_all_output_df = pd.read_csv(rp_file)
-        else:
-            print(f"FILE-NOT-FOUND: {rp_file}")
-            continue
 
-        temp_data = np.array(rp_all_output_df["MEA_passing_genes"]) 
-        new_row = [rank]
-        #calculate mean, median, sd
-        mean = np.mean(temp_data)
-        new_row.append(mean)
-        median = np.median(temp_data)
-        new_row.append(median)
-        std_dev = np.std(temp_data)
-        new_row.append(std_dev)
-        #calculate confidence interval
-        confidence_level = 0.95
-        degrees_freedom = len(temp_data) - 1
-        sample_mean = np.mean(temp_data)
-        sample_standard_error = stats.sem(temp_data)
-        confidence_interval = stats.t.interval(
-            confidence_level,
-            degrees_freedom,
-            sample_mean,
-            sample_standard_error
-        )
-        new_row.append(str(confidence_interval[0]) + ":" + str(confidence_interval[1]))
+    #load every rank into one ranks x permutations matrix and summarize all ranks at once
+    original_counts = dict(zip(original_run_summary_df["threshold"].astype(int), original_run_summary_df["mea_passing_genes"]))
+    ranks, rp_matrix = load_rp_matrix(input_path, rr_id, input_file_rr_id, network, num_permutations, list(original_counts))
+    summary_df = rank_permutation_statistics(ranks, rp_matrix, np.array([original_counts[rank] for rank in ranks], dtype=np.int64))
 
-        #calculate 90 percent and 95 percent confidence interval
-        ninety_percentile = np.percentile(temp_data, 90)
-        new_row.append(ninety_percentile)
-        ninety_five_percentile = np.percentile(temp_data, 95)
-        new_row.append(ninety_five_percentile)
-
-        #calculate original run percentile
-        original_number_MEA_passing_genes = original_run_summary_df[original_run_summary_df["threshold"] == rank]["mea_passing_genes"].tolist()[0]
-        #calculate FDR
-        if (original_number_MEA_passing_genes != 0):
-            FDR = mean/original_number_MEA_passing_genes
-        else:
-            FDR = np.nan
-        new_row.append(FDR)
-        new_row.append(original_number_MEA_passing_genes)
-        or_percentile = stats.percentileofscore(temp_data, original_number_MEA_passing_genes)
-        new_row.append(or_percentile)
-        # print(len(new_row))
-        summary_df.loc[len(summary_df.index)] = new_row
+    #adaptive permutations: a network may stop before num_permutations, record the precision achieved at every rank
+    if percentile_threshold is not None and len(ranks) > 0:
+        precision = curtailed_decisions(rp_matrix, summary_df["num_MEA_passing"].to_numpy(), percentile_threshold, int(num_permutations))
+        summary_df["permutations_run"] = rp_matrix.shape[1]
+        summary_df["decided"] = precision["decided"].to_numpy()
+        summary_df["percentile_lower"] = precision["percentile_lower"].to_numpy()
+        summary_df["percentile_upper"] = precision["percentile_upper"].to_numpy()
 
     if not os.path.exists(output_path):
         os.makedirs(output_path)
     summary_df.to_csv(os.path.join(output_path,f"{trait}_{network}_summary_{num_permutations}_permutations.csv"), index = None)
+    countRows("ranks", summary_df.shape[0])
 
 if __name__ == "__main__":
     from argparse import ArgumentParser   
@@ -86,8 +96,8 @@ if __name__ == "__main__":
     parser.add_argument('--network', '-network')
     parser.add_argument('--output_path', '-output_path')
     parser.add_argument("--num_permutations")
+    parser.add_argument("--percentile_threshold", type=float, default=None, help="adaptive permutations: record the precision of original_run_percentile against this cutoff")
     
     args = parser.parse_args()
-    summary_statistics_rp(trait = args.trait, input_path = args.input_path, or_id = args.or_id, input_file_rr_id = args.input_file_rr_id, rr_id = args.rr_id, network = args.network, output_path = args.output_path, num_permutations = args.num_permutations)
-
-
+    with stageTelemetry():
+        summary_statistics_rp(trait = args.trait, input_path = args.input_path, or_id = args.or_id, input_file_rr_id = args.input_file_rr_id, rr_id = args.rr_id, network = args.network, output_path = args.output_path, num_permutations = args.num_permutations, percentile_threshold = args.percentile_threshold)
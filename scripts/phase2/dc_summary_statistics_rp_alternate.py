@@ -4,6 +4,9 @@ import ast
 import os
 import math
 import scipy.stats as stats
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import stageTelemetry
 
 
 def summary_statistics_rp(trait, input_path, or_id, input_file_rr_id, rr_id, network, output_path ):
@@ -83,6 +86,5 @@ if __name__ == "__main__":
     parser.add_argument('--output_path', '-output_path')
     
     args = parser.parse_args()
-    summary_statistics_rp(trait = args.trait, input_path = args.input_path, or_id = args.or_id, input_file_rr_id = args.input_file_rr_id, rr_id = args.rr_id, network = args.network, output_path = args.output_path)
-
-
+    with stageTelemetry():
+        summary_statistics_rp(trait = args.trait, input_path = args.input_path, or_id = args.or_id, input_file_rr_id = args.input_file_rr_id, rr_id = args.rr_id, network = args.network, output_path = args.output_path)
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import os
+import sqlite3
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase1", "nextflow", "bin"))
+from telemetry import countRows, stageTelemetry
+
+
+# python dc_summary_store.py
+#   --summary_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSORKB/master_summary_twasLLFSORKB.csv
+#   --store_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSORKB/master_summary.sqlite
+#   --filtered_csv_path /scratch/mblab/acharyas/fishnet/pipeline/results/twasLLFSORKB/master_summary_filtered_parsed.csv
+#
+# Builds the significant modules of a compiled master summary into an SQLite file with typed columns,
+# indexed by (study, network, base trait, permutation index). A permuted trait "{rpIndex}-{trait}" is split
+# into its permutation index and base trait, so phase 2 jobs read only the rows of their network and trait,
+# and every permutation of a trait in one query, instead of parsing the whole summary CSV per job.
+# load_master_summary reads either the store or a master_summary_filtered_parsed.csv.
+
+SUMMARY_COLUMNS = ["study", "trait", "network", "moduleIndex", "isModuleSig", "modulePval", "moduleBonPval", "size"]
+SUMMARY_DTYPES = {"study": str, "trait": str, "network": str, "moduleIndex": np.int64,
+                  "isModuleSig": bool, "modulePval": np.float64, "moduleBonPval": np.float64, "size": np.int64}
+STORE_EXTENSIONS = (".sqlite", ".db")
+
+def split_trait(trait):
+    """'{rpIndex}-{trait}' -> (trait, rpIndex). Traits without a permutation index get None."""
+    prefix, sep, base_trait = str(trait).partition("-")
+    if sep and prefix.isdigit():
+        return base_trait, int(prefix)
+    return str(trait), None
+
+def build_summary_store(summary_path, store_path, filtered_csv_path = None, chunksize = 100000):
+    """
+    Stream a compiled master summary into the store, keeping significant modules only.
+
+    Args:
+        summary_path (str): master_summary_{study}.csv written by compile_results.py
+        store_path (str): SQLite file to (re)create
+        filtered_csv_path (str): also write the significant modules as master_summary_filtered_parsed.csv if given
+        chunksize (int): summary rows held in memory at once
+    """
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    connection = sqlite3.connect(store_path)
+    connection.execute("""CREATE TABLE modules (
+                              study TEXT, trait TEXT, base_trait TEXT, rp_index INTEGER, network TEXT,
+                              moduleIndex INTEGER, isModuleSig INTEGER, modulePval REAL, moduleBonPval REAL, size INTEGER)""")
+    num_modules = 0
+    write_header = True
+    for chunk in pd.read_csv(summary_path, usecols=SUMMARY_COLUMNS, chunksize=chunksize, float_precision="round_trip"):
+        chunk = chunk[chunk["isModuleSig"].astype(str) == "True"][SUMMARY_COLUMNS]
+        if filtered_csv_path is not None:
+            chunk.to_csv(filtered_csv_path, mode="w" if write_header else "a", header=write_header, index=False)
+            write_header = False
+        base_traits, rp_indices = zip(*map(split_trait, chunk["trait"])) if chunk.shape[0] > 0 else ((), ())
+        connection.executemany("INSERT INTO modules VALUES (?,?,?,?,?,?,?,?,?,?)",
+                               zip(chunk["study"].astype(str), chunk["trait"].astype(str), base_traits, rp_indices,
+                                   chunk["network"].astype(str), chunk["moduleIndex"].astype(int).tolist(),
+                                   [1] * chunk.shape[0], chunk["modulePval"].astype(float).tolist(),
+                                   chunk["moduleBonPval"].astype(float).tolist(), chunk["size"].astype(int).tolist()))
+        num_modules += chunk.shape[0]
+    if filtered_csv_path is not None and write_header:
+        pd.DataFrame(columns=SUMMARY_COLUMNS).to_csv(filtered_csv_path, index=False)
+    connection.execute("CREATE INDEX modules_partition ON modules (network, base_trait, study, rp_index)")
+    connection.execute("CREATE INDEX modules_trait ON modules (trait, network)")
+    connection.commit()
+    connection.close()
+    print(f"\tSaved {num_modules} significant modules of {summary_path} to {store_path}")
+    countRows("significantModules", num_modules)
+
+def load_master_summary(master_summary_path, network = None, trait = None, study = None, base_trait = None, columns = None):
+    """
+    Load the significant modules of one partition of the master summary.
+
+    Args:
+        master_summary_path (str): store written by build_summary_store (.sqlite/.db), or a master_summary_filtered_parsed.csv
+        network (str): only modules of this network
+        trait (str): only modules of this exact trait, e.g. "0-trait" or "5-trait"
+        study (str): only modules of this study
+        base_trait (str): only modules of every permutation "{rpIndex}-{base_trait}" of this trait
+        columns (list): columns to read. All SUMMARY_COLUMNS if None
+
+    Returns:
+        pd.DataFrame of the requested columns, in summary order
+    """
+    columns = list(SUMMARY_COLUMNS if columns is None else columns)
+    filters = {"network": network, "trait": trait, "study": study}
+
+    if master_summary_path.endswith(STORE_EXTENSIONS):
+        conditions = [f"{column} = ?" for column, value in filters.items() if value is not None]
+        parameters = [str(value) for value in filters.values() if value is not None]
+        if base_trait is not None:
+            conditions.append("base_trait = ? AND rp_index IS NOT NULL")
+            parameters.append(str(base_trait))
+        query = f"SELECT {', '.join(columns)} FROM modules"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        connection = sqlite3.connect(f"file:{master_summary_path}?mode=ro", uri=True)
+        try:
+            summary = pd.read_sql_query(query + " ORDER BY rowid", connection, params=parameters)
+        finally:
+            connection.close()
+    else:
+        filter_columns = [column for column, value in filters.items() if value is not None]
+        if base_trait is not None:
+            filter_columns.append("trait")
+        summary = pd.read_csv(master_summary_path, usecols=sorted(set(columns + filter_columns)))
+        for column in filter_columns:
+            if filters.get(column) is not None:
+                summary = summary[summary[column].astype(str) == str(filters[column])]
+        if base_trait is not None:
+            split_traits = summary["trait"].map(split_trait)
+            summary = summary[split_traits.map(lambda split: split[0] == str(base_trait) and split[1] is not None).to_numpy(dtype=bool)]
+        summary = summary[columns].reset_index(drop=True)
+
+    return summary.astype({column: SUMMARY_DTYPES[column] for column in columns if column in SUMMARY_DTYPES})
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--summary_path', '-summary_path', help='compiled master summary (compile_results.py)')
+    parser.add_argument('--store_path', '-store_path', help='path to the .sqlite store to write')
+    parser.add_argument('--filtered_csv_path', '-filtered_csv_path', default=None, help='also write the significant modules to this csv')
+    args = parser.parse_args()
+    with stageTelemetry():
+        build_summary_store(summary_path = args.summary_path, store_path = args.store_path, filtered_csv_path = args.filtered_csv_path)
@@ -0,0 +1,331 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_PATH = os.path.join(BENCHMARK_PATH, "..", "..", "scripts")
+sys.path.append(os.path.join(SCRIPTS_PATH, "phase1", "nextflow", "bin"))
+sys.path.append(os.path.join(SCRIPTS_PATH, "phase1"))
+sys.path.append(os.path.join(SCRIPTS_PATH, "phase2"))
+import numpy as np
+import pandas as pd
+from synthetic_data import generate, STUDY, STUDY_RANDOM, TRAIT, NETWORK, PIPELINE
+
+
+# python run_benchmarks.py
+#   --work_path /tmp/fishnet_benchmark
+#   --output_path benchmark_20000genes.json
+#   --num_genes 20000 --num_modules 1000 --module_size_scale 1.0 --num_permutations 100 --num_thresholds 50
+#   [--repeat 3] [--compare baseline.json]
+#
+# Times every pipeline component on a synthetic run (synthetic_data.py) in isolation: each component runs
+# in its own forked process, after an untimed setup, and reports wall and CPU seconds, the peak resident
+# set size of the process and the peak of python/numpy allocations (tracemalloc) during the component.
+# Components run in pipeline order, so later components read the outputs of earlier ones. Results are
+# saved as JSON with the scale and the environment, and --compare prints the ratio to an earlier run.
+# Everything runs offline: PascalX, Nextflow, SLURM and containers are not used.
+
+def component_preprocessing(run):
+    from preProcessForPascal import readModuleFile, processGeneScoreAndModules
+    paths = run["paths"]
+    output_path = os.path.join(run["work_path"], "preprocessed")
+    os.makedirs(output_path, exist_ok=True)
+    df_gs = pd.read_csv(os.path.join(paths["gene_set_path"], f"0-{TRAIT}.csv"))
+    def component():
+        modules = {NETWORK: readModuleFile(paths["module_path"])}
+        processGeneScoreAndModules(df_gs, modules, output_path, PIPELINE, f"0-{TRAIT}", "Genes", "p_vals")
+        return df_gs.shape[0]
+    return component
+
+def component_pascal_output_parsing(run):
+    from processPascalOutput import processOnePascalOutput
+    paths = run["paths"]
+    def component():
+        result, num_sig = processOnePascalOutput(paths["pascal_output"], 0.05, os.path.join(run["work_path"], "pascal_parsed.csv"))
+        return len(result)
+    return component
+
+def component_significance_tiering(run):
+    from processPascalOutput import processOnePascalOutput, geneSignificanceTiers, recordModulesFromPascalResult
+    paths = run["paths"]
+    output_path = os.path.join(run["work_path"], "significant_modules")
+    os.makedirs(output_path, exist_ok=True)
+    result, num_sig = processOnePascalOutput(paths["pascal_output"], 0.05, os.path.join(run["work_path"], "pascal_parsed.csv"))
+    def component():
+        gene_to_tier = geneSignificanceTiers(paths["gene_score_tsv"], 0.05 / run["scale"]["num_genes"])
+        recordModulesFromPascalResult(result, os.path.join(output_path, f"{STUDY}_0-{TRAIT}_{NETWORK}.txt"), gene_to_tier, STUDY, f"0-{TRAIT}", NETWORK)
+        return len(result)
+    return component
+
+def component_module_scoring(run):
+    from preProcessForPascal import readModuleFile
+    from chi2rankScorer import scoreSeries
+    paths = run["paths"]
+    modules = readModuleFile(paths["module_path"])
+    scores = [pd.read_csv(os.path.join(paths["gene_set_path_random"], f"{rp_index}-{STUDY_RANDOM}.csv")).set_index("Genes")["p_vals"]
+              for rp_index in range(1, run["scale"]["num_permutations"] + 1)]
+    def component():
+        pvals, scored_genes = scoreSeries(scores, modules)
+        return pvals.size
+    return component
+
+def component_master_summary_compile(run):
+    from compile_results import concatenate_csv
+    paths = run["paths"]
+    def component():
+        for study in [STUDY, STUDY_RANDOM]:
+            concatenate_csv(paths[f"slices_{study}"], study, results_path(run, study))
+        return run["scale"]["num_permutations"] + 1
+    return component
+
+def component_summary_store(run):
+    from dc_summary_store import build_summary_store
+    def component():
+        for study in [STUDY, STUDY_RANDOM]:
+            build_summary_store(os.path.join(results_path(run, study), f"master_summary_{study}.csv"), summary_store_path(run, study),
+                                os.path.join(results_path(run, study), "master_summary_filtered_parsed.csv"))
+        return run["scale"]["num_modules"] * (run["scale"]["num_permutations"] + 1)
+    return component
+
+def component_go_index(run):
+    from dc_go_index import build_go_index
+    def component():
+        for study in [STUDY, STUDY_RANDOM]:
+            build_go_index(os.path.join(results_path(run, study), "GO_summaries"), go_index_path(run, study))
+        return run["scale"]["num_permutations"] + 1
+    return component
+
+def component_or_statistics(run):
+    from dc_generate_or_statistics import generate_or_statistics
+    paths = run["paths"]
+    def component():
+        generate_or_statistics(gene_set_path = paths["gene_set_path"], master_summary_path = summary_store_path(run, STUDY), trait = TRAIT,
+                               module_path = paths["module_path"], go_path = os.path.join(results_path(run, STUDY), "GO_summaries"),
+                               study = STUDY, output_path = raw_results_path(run, STUDY), network = NETWORK,
+                               go_index_path = go_index_path(run, STUDY))
+        return run["scale"]["num_genes"]
+    return component
+
+def component_rp_statistics(run):
+    from dc_generate_rp_statistics import generate_rp_statistics
+    paths = run["paths"]
+    def component():
+        generate_rp_statistics(gene_set_path = paths["gene_set_path_random"], master_summary_path = summary_store_path(run, STUDY_RANDOM),
+                               trait = STUDY_RANDOM, module_path = paths["module_path"],
+                               go_path = os.path.join(results_path(run, STUDY_RANDOM), "GO_summaries"),
+                               output_path = raw_results_path(run, STUDY_RANDOM), threshold = ",".join(map(str, run["thresholds"])),
+                               network = NETWORK, num_permutations = run["scale"]["num_permutations"],
+                               go_index_path = go_index_path(run, STUDY_RANDOM))
+        return run["scale"]["num_permutations"] * len(run["thresholds"])
+    return component
+
+def component_summary_statistics(run):
+    from dc_summary_statistics_rp import summary_statistics_rp
+    def component():
+        summary_statistics_rp(trait = TRAIT, input_path = os.path.join(run["work_path"], "results"), or_id = STUDY,
+                              input_file_rr_id = STUDY_RANDOM, rr_id = STUDY_RANDOM, network = NETWORK,
+                              output_path = os.path.join(run["work_path"], "results", STUDY, "summary"),
+                              num_permutations = run["scale"]["num_permutations"])
+        return len(run["thresholds"])
+    return component
+
+def component_edge_extraction(run):
+    from dc_np_RP_identify_mea_passing_genes import identify_mea_passing_genes
+    paths = run["paths"]
+    input_path = os.path.join(results_path(run, STUDY), "")
+    os.makedirs(os.path.join(input_path, "summary"), exist_ok=True)
+    def component():
+        identify_mea_passing_genes(trait = TRAIT, geneset_input = paths["gene_set_path"], network = NETWORK, input_path = input_path,
+                                   network_connections_path = paths["network_connections_path"],
+                                   module_path = os.path.join(os.path.dirname(paths["module_path"]), ""))
+        return run["scale"]["num_edges"]
+    return component
+
+# pipeline order, later components read the outputs of earlier ones
+COMPONENTS = {"preprocessing": component_preprocessing,
+              "module_scoring": component_module_scoring,
+              "pascal_output_parsing": component_pascal_output_parsing,
+              "significance_tiering": component_significance_tiering,
+              "master_summary_compile": component_master_summary_compile,
+              "summary_store": component_summary_store,
+              "go_index": component_go_index,
+              "or_statistics": component_or_statistics,
+              "rp_statistics": component_rp_statistics,
+              "summary_statistics": component_summary_statistics,
+              "edge_extraction": component_edge_extraction}
+
+def results_path(run, study):
+    return os.path.join(run["work_path"], "results", study)
+
+def raw_results_path(run, study):
+    return os.path.join(results_path(run, study), "results", "raw")
+
+def summary_store_path(run, study):
+    return os.path.join(results_path(run, study), "master_summary.sqlite")
+
+def go_index_path(run, study):
+    return os.path.join(results_path(run, study), f"go_index_{study}.npz")
+
+def measure_component(name, run, connection):
+    """Run one component in this (forked) process and send its measurements through connection."""
+    try:
+        # components print progress, which is not part of the measurement
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            component = COMPONENTS[name](run)
+            tracemalloc.start()
+            start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start_cpu = time.process_time()
+            start_wall = time.perf_counter()
+            rows = component()
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            alloc_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        connection.send({"wallSeconds": wall, "cpuSeconds": cpu, "peakRssMB": peak_rss / 1024,
+                         "rssGrowthMB": (peak_rss - start_rss) / 1024, "allocPeakMB": alloc_peak / 2**20, "rows": rows})
+    except Exception as e:
+        connection.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        connection.close()
+
+def run_component(name, run):
+    """Measure a component in a fresh forked process, so the peak RSS of one component does not carry into the next."""
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=measure_component, args=(name, run, sender))
+    process.start()
+    sender.close()
+    try:
+        measurement = receiver.recv()
+    except EOFError:
+        measurement = {"error": "component process exited without a measurement"}
+    process.join()
+    if process.exitcode != 0 and "error" not in measurement:
+        measurement = {"error": f"component process exited with code {process.exitcode}"}
+    return measurement
+
+def summarize(measurements):
+    """Median of every measurement over repeats, with the per-repeat wall times."""
+    summary = {key: statistics.median(measurement[key] for measurement in measurements)
+               for key in measurements[0] if key != "rows"}
+    summary["rows"] = measurements[0]["rows"]
+    summary["rowsPerSecond"] = summary["rows"] / summary["wallSeconds"] if summary["wallSeconds"] > 0 else None
+    summary["repeatWallSeconds"] = [measurement["wallSeconds"] for measurement in measurements]
+    return summary
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "-C", BENCHMARK_PATH, "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"host": socket.gethostname(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__, "commit": commit}
+
+def run_benchmarks(work_path, output_path, num_genes, num_modules, module_size_scale, num_permutations, num_thresholds = None,
+                   repeat = 1, components = None, seed = 1, keep = False):
+    """
+    Generate a synthetic run and measure every component on it.
+
+    Args:
+        work_path (str): directory for the synthetic run and the component outputs, recreated
+        output_path (str): JSON file to save the results to
+        num_thresholds (int): gene rank thresholds of the RP statistics. Every OR threshold if None
+        repeat (int): measurements per component, the median is reported
+        components (list): components to report. Every component runs, in pipeline order, since later ones read earlier outputs
+        keep (bool): keep work_path after the run
+
+    Returns:
+        dict of the results saved to output_path
+    """
+    from dc_mea_engine import rank_thresholds
+    if os.path.exists(work_path):
+        shutil.rmtree(work_path)
+    print(f"Generating {num_genes} genes, {num_modules} modules x{module_size_scale}, {num_permutations} permutations in {work_path}")
+    start = time.perf_counter()
+    synthetic = generate(work_path, num_genes, num_modules, module_size_scale, num_permutations, seed = seed)
+    run = dict(synthetic, work_path = work_path)
+    run["thresholds"] = rank_thresholds(num_genes)[:num_thresholds]
+    print(f"\tGenerated in {time.perf_counter() - start:.1f}s")
+
+    results = {"timestamp": datetime.now().isoformat(timespec="seconds"),
+               "environment": environment(),
+               "scale": dict(synthetic["scale"], num_thresholds = len(run["thresholds"])),
+               "repeat": repeat,
+               "components": {}}
+    for name in COMPONENTS:
+        measurements = [run_component(name, run) for _ in range(repeat if components is None or name in components else 1)]
+        errors = [measurement["error"] for measurement in measurements if "error" in measurement]
+        if errors:
+            results["components"][name] = {"error": errors[0]}
+            print(f"\t{name}: FAILED {errors[0]}")
+        elif components is None or name in components:
+            results["components"][name] = summarize(measurements)
+            print(f"\t{name}: {results['components'][name]['wallSeconds']:.3f}s, peak RSS {results['components'][name]['peakRssMB']:.0f}MB, "
+                  f"peak allocations {results['components'][name]['allocPeakMB']:.1f}MB")
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved benchmark results to {output_path}")
+    if not keep:
+        shutil.rmtree(work_path, ignore_errors=True)
+    return results
+
+def compare(results, baseline):
+    """Print the wall time and peak allocations of every component relative to a baseline run."""
+    if results["scale"] != baseline["scale"]:
+        print("WARNING: the runs have different scales")
+    print(f"{'component':<24}{'wall (s)':>12}{'baseline':>12}{'ratio':>8}{'alloc (MB)':>12}{'baseline':>12}{'ratio':>8}")
+    for name, measurement in results["components"].items():
+        baseline_measurement = baseline["components"].get(name)
+        if "error" in measurement or baseline_measurement is None or "error" in baseline_measurement:
+            continue
+        row = f"{name:<24}"
+        for key in ["wallSeconds", "allocPeakMB"]:
+            ratio = measurement[key] / baseline_measurement[key] if baseline_measurement[key] > 0 else float("nan")
+            row += f"{measurement[key]:>12.3f}{baseline_measurement[key]:>12.3f}{ratio:>8.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--work_path', '-work_path', default=os.path.join("/tmp", "fishnet_benchmark"), help='directory for the synthetic run, recreated')
+    parser.add_argument('--output_path', '-output_path', default="benchmark.json", help='JSON file to save the results to')
+    parser.add_argument('--num_genes', type=int, default=20000, help='genes with a score')
+    parser.add_argument('--num_modules', type=int, default=1000, help='modules of the network')
+    parser.add_argument('--module_size_scale', type=float, default=1.0, help='multiplier on the module sizes of the seed networks')
+    parser.add_argument('--num_permutations', type=int, default=100, help='permutations of the random run')
+    parser.add_argument('--num_thresholds', type=int, default=None, help='gene rank thresholds of the RP statistics (default: every OR threshold)')
+    parser.add_argument('--repeat', type=int, default=1, help='measurements per component, the median is reported')
+    parser.add_argument('--components', default=None, help=f'comma-separated components to report, of {",".join(COMPONENTS)}')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic data')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic run after benchmarking')
+    parser.add_argument('--compare', default=None, help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    components = args.components.split(",") if args.components is not None else None
+    unknown = [name for name in components or [] if name not in COMPONENTS]
+    if unknown:
+        parser.error(f"unknown components {unknown}, expected any of {list(COMPONENTS)}")
+    results = run_benchmarks(work_path = args.work_path, output_path = args.output_path, num_genes = args.num_genes,
+                             num_modules = args.num_modules, module_size_scale = args.module_size_scale,
+                             num_permutations = args.num_permutations, num_thresholds = args.num_thresholds,
+                             repeat = args.repeat, components = components, seed = args.seed, keep = args.keep)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
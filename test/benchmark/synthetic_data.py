@@ -0,0 +1,171 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# python synthetic_data.py
+#   --output_path /tmp/fishnet_benchmark
+#   --num_genes 20000 --num_modules 1000 --module_size_scale 1.0 --num_permutations 100 --seed 1
+#
+# Generates a synthetic FISHNet run at a chosen scale, seeded from the test data shipped with the repo:
+# gene names and the p-value distribution are resampled from test/exampleOR/maleWC/0-maleWC.csv and module
+# sizes from the networks in test/ker_based/. Every file a pipeline component reads is written in the layout
+# the pipeline produces, so run_benchmarks.py can time each component in isolation without PascalX,
+# Nextflow, SLURM or containers.
+
+TEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+STUDY = "benchOR"
+STUDY_RANDOM = "benchRR"
+TRAIT = "synth"
+NETWORK = "bench"
+PIPELINE = "twas"
+MIN_MODULE_SIZE = 3
+
+def load_seed_data(test_path = TEST_PATH):
+    """
+    Read the seed distributions from the repo test data.
+
+    Returns:
+        (gene names, gene p-values, module sizes) as numpy arrays
+    """
+    gene_scores = pd.read_csv(os.path.join(test_path, "exampleOR", "maleWC", "0-maleWC.csv"))
+    module_sizes = []
+    network_dir = os.path.join(test_path, "ker_based")
+    for network_file in sorted(os.listdir(network_dir)):
+        with open(os.path.join(network_dir, network_file)) as f:
+            module_sizes.extend(len(line.split()) - 2 for line in f if line.strip())
+    return gene_scores.iloc[:, 0].to_numpy(dtype=str), gene_scores.iloc[:, 1].to_numpy(dtype=float), np.array(module_sizes)
+
+def synthetic_genes(seed_genes, num_genes):
+    """The first num_genes seed gene names, extended with synthetic names past the seed gene count."""
+    seed_genes = list(dict.fromkeys(seed_genes))
+    if num_genes <= len(seed_genes):
+        return np.array(seed_genes[:num_genes])
+    # SYN1, SYN2 and SYN3 are gene symbols of the seed genes
+    seed_gene_set = set(seed_genes)
+    extra_genes = (f"SYNTH{i}" for i in range(num_genes + len(seed_genes)))
+    return np.array(seed_genes + [gene for gene in extra_genes if gene not in seed_gene_set][:num_genes - len(seed_genes)])
+
+def write_gene_scores(path, genes, pvals):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({"Genes": genes, "p_vals": pvals}).to_csv(path, index=False)
+
+def write_summary_slice(path, study, trait, module_sizes, module_pvals, is_sig):
+    """One master summary slice (trait x network) in the column layout written by mergeORAandSummary.py."""
+    num_modules = len(module_sizes)
+    pd.DataFrame({"study": study,
+                  "trait": trait,
+                  "network": NETWORK,
+                  "moduleIndex": np.arange(1, num_modules + 1),
+                  "isModuleSig": is_sig,
+                  "modulePval": module_pvals,
+                  "moduleBonPval": np.minimum(module_pvals * num_modules, 1.0),
+                  "size": module_sizes,
+                  "numSigGenes": 0,
+                  "sigGenes": "[]"}).to_csv(path, index=False)
+
+def write_go_summary(path, genes, rng):
+    """A GO summary of one significant module, with a mix of enriched and non-enriched terms."""
+    num_terms = max(1, len(genes) // 10)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({"geneSet": [f"GO:{i:07d}" for i in range(num_terms)],
+                  "FDR": rng.uniform(0, 0.1, num_terms),
+                  "userId": [";".join(rng.choice(genes, size=min(len(genes), 5), replace=False)) for _ in range(num_terms)]}).to_csv(path, index=False)
+
+def generate(output_path, num_genes = 20000, num_modules = 1000, module_size_scale = 1.0, num_permutations = 100,
+             sig_fraction = 0.05, seed = 1, test_path = TEST_PATH):
+    """
+    Write a synthetic run to output_path.
+
+    Args:
+        output_path (str): directory to write the run into
+        num_genes (int): genes with a score, i.e. rows of every gene score file
+        num_modules (int): modules of the network
+        module_size_scale (float): multiplier on the module sizes sampled from the seed networks
+        num_permutations (int): permuted gene score files of the random run
+        sig_fraction (float): fraction of modules significant in each trait
+        seed (int): seed of every random draw
+
+    Returns:
+        dict of the scale parameters and the paths written, also saved as {output_path}/synthetic.json
+    """
+    rng = np.random.default_rng(seed)
+    seed_genes, seed_pvals, seed_sizes = load_seed_data(test_path)
+    genes = synthetic_genes(seed_genes, num_genes)
+    pvals = rng.choice(seed_pvals, size=num_genes, replace=True)
+
+    # <------ gene scores: original trait and permutations of its gene column ------>
+    paths = {"output_path": output_path}
+    paths["gene_set_path"] = os.path.join(output_path, "genesets", STUDY)
+    paths["gene_set_path_random"] = os.path.join(output_path, "genesets", STUDY_RANDOM)
+    write_gene_scores(os.path.join(paths["gene_set_path"], f"0-{TRAIT}.csv"), genes, pvals)
+    write_gene_scores(os.path.join(paths["gene_set_path_random"], f"{STUDY_RANDOM}.csv"), genes, pvals)
+    for rp_index in range(1, num_permutations + 1):
+        write_gene_scores(os.path.join(paths["gene_set_path_random"], f"{rp_index}-{STUDY_RANDOM}.csv"), rng.permutation(genes), pvals)
+
+    # <------ network: modules and edges ------>
+    module_sizes = np.clip(np.round(rng.choice(seed_sizes, size=num_modules) * module_size_scale).astype(int), MIN_MODULE_SIZE, num_genes)
+    modules = [rng.choice(genes, size=size, replace=False) for size in module_sizes]
+    paths["module_path"] = os.path.join(output_path, "modules", f"{NETWORK}.txt")
+    os.makedirs(os.path.dirname(paths["module_path"]), exist_ok=True)
+    with open(paths["module_path"], "w") as f:
+        for module_index, module in enumerate(modules, 1):
+            f.write("\t".join([str(module_index), "1.0"] + module.tolist()) + "\n")
+
+    # two edges per module gene within the module
+    paths["network_connections_path"] = os.path.join(output_path, "edges", "")
+    os.makedirs(paths["network_connections_path"], exist_ok=True)
+    sources = np.concatenate([rng.choice(module, size=2 * len(module)) for module in modules])
+    targets = np.concatenate([rng.choice(module, size=2 * len(module)) for module in modules])
+    pd.DataFrame({"Source": sources, "Target": targets, "Score": rng.uniform(0, 1, len(sources))}).to_csv(
+        os.path.join(paths["network_connections_path"], f"{NETWORK}.txt"), sep="\t", index=False)
+
+    # <------ PascalX output and processed gene scores of the original trait ------>
+    paths["pascal_path"] = os.path.join(output_path, "pascal")
+    os.makedirs(paths["pascal_path"], exist_ok=True)
+    paths["pascal_output"] = os.path.join(paths["pascal_path"], f"{STUDY}_0-{TRAIT}_{NETWORK}.txt")
+    is_sig = rng.uniform(0, 1, num_modules) < sig_fraction
+    module_pvals = np.where(is_sig, rng.uniform(0, 0.05 / num_modules, num_modules), rng.uniform(0, 1, num_modules))
+    with open(paths["pascal_output"], "w") as f:
+        for module_index, module in enumerate(modules, 1):
+            f.write(json.dumps({"moduleIndex": module_index, "genes": module.tolist(), "pval": module_pvals[module_index - 1]}) + "\n")
+    paths["gene_score_tsv"] = os.path.join(paths["pascal_path"], f"GS_{PIPELINE}_0-{TRAIT}_{NETWORK}.tsv")
+    pd.DataFrame({0: genes, 1: pvals}).to_csv(paths["gene_score_tsv"], sep="\t", header=False, index=False)
+
+    # <------ master summary slices and GO summaries of every trait ------>
+    for study, traits in [(STUDY, [f"0-{TRAIT}"]), (STUDY_RANDOM, [f"{rp_index}-{STUDY_RANDOM}" for rp_index in range(1, num_permutations + 1)])]:
+        results_path = os.path.join(output_path, "results", study)
+        paths[f"slices_{study}"] = os.path.join(results_path, "masterSummaries", "summaries")
+        os.makedirs(paths[f"slices_{study}"], exist_ok=True)
+        for trait in traits:
+            is_sig = rng.uniform(0, 1, num_modules) < sig_fraction
+            module_pvals = np.where(is_sig, rng.uniform(0, 0.05 / num_modules, num_modules), rng.uniform(0, 1, num_modules))
+            write_summary_slice(os.path.join(paths[f"slices_{study}"], f"{study}_{trait}_{NETWORK}.csv"), study, trait, module_sizes, module_pvals, is_sig)
+            for module_index in np.flatnonzero(is_sig) + 1:
+                write_go_summary(os.path.join(results_path, "GO_summaries", f"GO_summaries_{trait}_{NETWORK}",
+                                              f"sig_{study}_{trait}_{NETWORK}_{module_index}.csv"), modules[module_index - 1], rng)
+
+    scale = {"num_genes": num_genes, "num_modules": num_modules, "module_size_scale": module_size_scale,
+             "num_permutations": num_permutations, "sig_fraction": sig_fraction, "seed": seed,
+             "median_module_size": float(np.median(module_sizes)), "num_edges": int(len(sources))}
+    synthetic = {"scale": scale, "paths": paths}
+    with open(os.path.join(output_path, "synthetic.json"), "w") as f:
+        json.dump(synthetic, f, indent=2)
+    return synthetic
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--output_path', '-output_path', help='directory to write the synthetic run into')
+    parser.add_argument('--num_genes', type=int, default=20000, help='genes with a score')
+    parser.add_argument('--num_modules', type=int, default=1000, help='modules of the network')
+    parser.add_argument('--module_size_scale', type=float, default=1.0, help='multiplier on the seed module sizes')
+    parser.add_argument('--num_permutations', type=int, default=100, help='permutations of the random run')
+    parser.add_argument('--sig_fraction', type=float, default=0.05, help='fraction of modules significant in each trait')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the generator')
+    args = parser.parse_args()
+    generate(output_path = args.output_path, num_genes = args.num_genes, num_modules = args.num_modules,
+             module_size_scale = args.module_size_scale, num_permutations = args.num_permutations,
+             sig_fraction = args.sig_fraction, seed = args.seed)
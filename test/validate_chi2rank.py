@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+TEST_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TEST_PATH, "..", "scripts", "phase1", "nextflow", "bin"))
+from preProcessForPascal import readModuleFile, processGeneScoreAndModules
+from randomPermutation import permute_scores
+from chi2rankScorer import readScores, readProcessedModules, scoreSeries
+
+
+# python test/validate_chi2rank.py [--num_permutations 5] [--rtol 1e-6]
+#
+# Compares the matrix rank-chi2 scorer (chi2rankScorer.py) to PascalX chi2rank(fuse=False) on the test networks
+# (test/ker_based/) with the maleWC scores (test/exampleOR/) and a few of their permutations. Every module
+# p-value of both scorers is compared on the -log10 scale. Needs PascalX, as the RUN_PASCAL container.
+
+def pascalx_pvals(score_file, module_file):
+    from PascalX import pathway, genescorer
+    scorer = genescorer.chi2sum()
+    scorer.load_scores(score_file)
+    pscorer = pathway.chi2rank(scorer, fuse=False)
+    result = pscorer.score(pscorer.load_modules(module_file, ncol=0, fcol=1))
+    return {str(r[0]).replace("'", ""): float(r[3]) for r in result[0]}
+
+def validate(num_permutations = 5, rtol = 1e-6, root_seed = 42):
+    gene_scores = pd.read_csv(os.path.join(TEST_PATH, "exampleOR", "maleWC", "0-maleWC.csv"))
+    network_dir = os.path.join(TEST_PATH, "ker_based")
+    networks = {file[:-4]: readModuleFile(os.path.join(network_dir, file)) for file in sorted(os.listdir(network_dir)) if file.endswith(".txt")}
+    max_deviation = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        for rp_index in range(num_permutations + 1):
+            df_gs = gene_scores if rp_index == 0 else permute_scores(gene_scores, "Genes", rp_index, root_seed)
+            processGeneScoreAndModules(df_gs, networks, tmp, "validate", f"{rp_index}-maleWC", "Genes", "p_vals")
+        for network in networks:
+            score_files = [os.path.join(tmp, f"GS_validate_{rp_index}-maleWC_{network}.tsv") for rp_index in range(num_permutations + 1)]
+            module_file = os.path.join(tmp, f"Module_validate_0-maleWC_{network}.tsv")
+            modules = readProcessedModules(module_file)
+            pvals, _ = scoreSeries([readScores(score_file) for score_file in score_files], modules)
+            for column, score_file in enumerate(score_files):
+                expected = pascalx_pvals(score_file, module_file)
+                for row, (module_name, _) in enumerate(modules):
+                    if np.isnan(expected[module_name]) or np.isnan(pvals[row, column]):
+                        # a module without scored genes must be nan in both
+                        deviation = 0.0 if np.isnan(expected[module_name]) and np.isnan(pvals[row, column]) else np.inf
+                    else:
+                        deviation = abs(np.log10(pvals[row, column]) - np.log10(expected[module_name])) / max(1.0, abs(np.log10(expected[module_name])))
+                    max_deviation = max(max_deviation, deviation)
+            print(f"{network}: {len(modules)} modules x {len(score_files)} score files, max relative -log10 deviation so far {max_deviation:.3g}")
+    print(f"{'PASSED' if max_deviation <= rtol else 'FAILED'}: max relative -log10 deviation {max_deviation:.3g} (rtol {rtol})")
+    return max_deviation <= rtol
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--num_permutations', type=int, default=5, help='permutations of the maleWC scores scored besides the original scores')
+    parser.add_argument('--rtol', type=float, default=1e-6, help='tolerated relative deviation of -log10 module p-values')
+    args = parser.parse_args()
+    sys.exit(0 if validate(num_permutations = args.num_permutations, rtol = args.rtol) else 1)
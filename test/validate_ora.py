@@ -0,0 +1,78 @@
+import os
+import sys
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+
+TEST_PATH = os.path.dirname(os.path.abspath(__file__))
+BIN_PATH = os.path.join(TEST_PATH, "..", "scripts", "phase1", "nextflow", "bin")
+sys.path.append(BIN_PATH)
+from preProcessForPascal import readModuleFile, processGeneScoreAndModules
+from chi2rankScorer import readProcessedModules
+from oraEngine import Annotation, oraForModules, readGeneList, summaryCSV, writeSummary
+
+
+# python test/validate_ora.py --annotation go_bp.gmt [--num_modules 20] [--rtol 1e-6]
+#
+# Compares the python ORA engine (oraEngine.py) to WebGestaltR as called by ORA_cmd.R on the modules of the test
+# networks (test/ker_based/) against the GO background of the maleWC scores (test/exampleOR/). For every module the
+# reported (exemplar) terms of both engines are compared, and the FDR of every term reported by both.
+# Needs Rscript with WebGestaltR, as the GO_ANALYSIS container, and a GMT snapshot of the GO Biological Process
+# database WebGestaltR uses (--annotation), otherwise the comparison measures the snapshot difference.
+
+def read_summary(summary_file):
+    summary = pd.read_csv(summary_file)
+    if "geneSet" not in summary.columns:
+        # write.csv(NULL, ...) of a module without reported terms
+        return {}
+    return dict(zip(summary["geneSet"].astype(str), summary["FDR"].astype(float)))
+
+def validate(annotation_file, num_modules = 20, rtol = 1e-6):
+    gene_scores = pd.read_csv(os.path.join(TEST_PATH, "exampleOR", "maleWC", "0-maleWC.csv"))
+    network_dir = os.path.join(TEST_PATH, "ker_based")
+    networks = {file[:-4]: readModuleFile(os.path.join(network_dir, file)) for file in sorted(os.listdir(network_dir)) if file.endswith(".txt")}
+    annotation = Annotation(annotation_file)
+    modules_compared, term_mismatches, max_deviation = 0, 0, 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        processGeneScoreAndModules(gene_scores, networks, tmp, "validate", "0-maleWC", "Genes", "p_vals")
+        for network in networks:
+            # the first num_modules modules of the network stand in for its significant modules
+            sig_dir = os.path.join(tmp, f"sig_{network}")
+            os.makedirs(sig_dir)
+            modules = readProcessedModules(os.path.join(tmp, f"Module_validate_0-maleWC_{network}.tsv"))[:num_modules]
+            for module_name, genes in modules:
+                with open(os.path.join(sig_dir, f"sig_validate_0-maleWC_{network}_{module_name}.txt"), "w") as f:
+                    f.write("".join(f"{gene}\n" for gene in genes))
+            background_file = os.path.join(tmp, f"GO_validate_0-maleWC_{network}.txt")
+            r_dir, python_dir = os.path.join(tmp, f"r_{network}"), os.path.join(tmp, f"python_{network}")
+            subprocess.run(["Rscript", os.path.join(BIN_PATH, "ORA_cmd.R"), "--sigModuleDir", sig_dir, "--backGroundGenesFile", background_file,
+                            "--summaryRoot", r_dir, "--reportRoot", os.path.join(tmp, f"report_{network}")], check=True)
+            os.makedirs(python_dir)
+            module_genes = {file[:-len(".txt")]: readGeneList(os.path.join(sig_dir, file)) for file in sorted(os.listdir(sig_dir))}
+            for name, summary in oraForModules(annotation, module_genes, readGeneList(background_file)).items():
+                writeSummary(summaryCSV(summary), os.path.join(python_dir, f"{name}.csv"))
+            for name in module_genes:
+                expected = read_summary(os.path.join(r_dir, f"{name}.csv"))
+                reported = read_summary(os.path.join(python_dir, f"{name}.csv"))
+                if set(expected) != set(reported):
+                    term_mismatches += 1
+                    print(f"{name}: terms only in ORA_cmd.R {sorted(set(expected) - set(reported))}, only in oraEngine.py {sorted(set(reported) - set(expected))}")
+                for term in set(expected) & set(reported):
+                    deviation = abs(reported[term] - expected[term]) / max(expected[term], np.finfo(float).tiny)
+                    max_deviation = max(max_deviation, deviation)
+                modules_compared += 1
+            print(f"{network}: {len(modules)} modules, {term_mismatches} modules with different terms so far, max relative FDR deviation so far {max_deviation:.3g}")
+    passed = term_mismatches == 0 and max_deviation <= rtol
+    print(f"{'PASSED' if passed else 'FAILED'}: {term_mismatches} of {modules_compared} modules with different terms, max relative FDR deviation {max_deviation:.3g} (rtol {rtol})")
+    return passed
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--annotation', required=True, help='GO Biological Process snapshot in GMT format, as given to --go-annotation')
+    parser.add_argument('--num_modules', type=int, default=20, help='modules of every test network tested by both engines')
+    parser.add_argument('--rtol', type=float, default=1e-6, help='tolerated relative deviation of the FDR of terms reported by both engines')
+    args = parser.parse_args()
+    sys.exit(0 if validate(args.annotation, num_modules = args.num_modules, rtol = args.rtol) else 1)